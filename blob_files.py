@@ -0,0 +1,193 @@
+# blob_files.py
+import os
+import mmap
+import zlib
+import struct
+import logging
+from collections import OrderedDict
+from typing import Iterator, List, Optional
+
+_LOG = logging.getLogger("blob_files")
+
+# Формат файла <hash>.kb:
+#   MAGIC | u32 число фрагментов | N x (u64 смещение, u32 длина сжатого, u32 символов) | кадры zlib
+MAGIC = b"KBZ1"
+_HEADER = struct.Struct("<4sI")
+_ENTRY = struct.Struct("<QII")
+
+# Размер фрагмента в символах: одна страница /knowledge и единица выборки в промпт
+CHUNK_CHARS = 3500
+COMPRESS_LEVEL = 6
+# Сколько открытых (mmap) файлов держим одновременно
+MAX_OPEN_READERS = 64
+
+
+def split_text(text: str, limit: int = CHUNK_CHARS) -> List[str]:
+    """
+    Режет текст на куски ≤ limit символов по границам абзацев (затем строк).
+    "".join(result) == text.
+    """
+    pieces: List[str] = []
+    start = 0
+    n = len(text)
+    while n - start > limit:
+        end = start + limit
+        cut = text.rfind("\n\n", start + 1, end)
+        if cut != -1:
+            cut += 2
+        else:
+            cut = text.rfind("\n", start + 1, end)
+            cut = cut + 1 if cut != -1 else end
+        pieces.append(text[start:cut])
+        start = cut
+    if start < n or not pieces:
+        pieces.append(text[start:])
+    return pieces
+
+
+class BlobReader:
+    """Чтение отдельных фрагментов сжатого файла через mmap, без распаковки целиком."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        magic, count = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Неизвестный формат файла {path}")
+        base = _HEADER.size
+        self._entries = [_ENTRY.unpack_from(self._mm, base + i * _ENTRY.size) for i in range(count)]
+        self.chars = sum(e[2] for e in self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def chunk(self, i: int) -> str:
+        offset, length, _ = self._entries[i]
+        return zlib.decompress(self._mm[offset:offset + length]).decode("utf-8")
+
+    def chunks(self) -> Iterator[str]:
+        for i in range(len(self._entries)):
+            yield self.chunk(i)
+
+    def text(self) -> str:
+        return "".join(self.chunks())
+
+    def close(self) -> None:
+        try:
+            self._mm.close()
+        finally:
+            self._file.close()
+
+
+class TextChunks:
+    """Тот же интерфейс, что у BlobReader, для текста, ещё не записанного на диск."""
+
+    def __init__(self, text: str, limit: int = CHUNK_CHARS):
+        self._chunks = split_text(text, limit)
+        self.chars = len(text)
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def chunk(self, i: int) -> str:
+        return self._chunks[i]
+
+    def chunks(self) -> Iterator[str]:
+        return iter(self._chunks)
+
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def close(self) -> None:
+        pass
+
+
+class BlobFileStore:
+    """
+    Каталог сжатых текстов по sha256: один файл на уникальное содержимое,
+    каждый фрагмент сжат отдельно и адресуется по таблице смещений.
+    """
+
+    def __init__(self, directory: str, *, chunk_chars: int = CHUNK_CHARS):
+        self.directory = directory
+        self.chunk_chars = chunk_chars
+        os.makedirs(directory, exist_ok=True)
+        self._readers: "OrderedDict[str, BlobReader]" = OrderedDict()
+
+    def path_for(self, blob_hash: str) -> str:
+        return os.path.join(self.directory, f"{blob_hash}.kb")
+
+    def exists(self, blob_hash: str) -> bool:
+        return os.path.exists(self.path_for(blob_hash))
+
+    def write(self, blob_hash: str, text: str) -> int:
+        """Записывает текст (атомарно через *.part). Возвращает размер файла."""
+        path = self.path_for(blob_hash)
+        if os.path.exists(path):
+            return os.path.getsize(path)
+        pieces = split_text(text, self.chunk_chars)
+        frames = [zlib.compress(p.encode("utf-8"), COMPRESS_LEVEL) for p in pieces]
+        chars = [len(p) for p in pieces]
+        offset = _HEADER.size + _ENTRY.size * len(frames)
+        index = bytearray(_HEADER.pack(MAGIC, len(frames)))
+        for frame, n_chars in zip(frames, chars):
+            index += _ENTRY.pack(offset, len(frame), n_chars)
+            offset += len(frame)
+
+        tmp_name = path + ".part"
+        with open(tmp_name, "wb") as f:
+            f.write(index)
+            for frame in frames:
+                f.write(frame)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+        return offset
+
+    def open(self, blob_hash: str) -> Optional[BlobReader]:
+        reader = self._readers.get(blob_hash)
+        if reader is not None:
+            self._readers.move_to_end(blob_hash)
+            return reader
+        path = self.path_for(blob_hash)
+        if not os.path.exists(path):
+            return None
+        reader = BlobReader(path)
+        self._readers[blob_hash] = reader
+        while len(self._readers) > MAX_OPEN_READERS:
+            _, old = self._readers.popitem(last=False)
+            old.close()
+        return reader
+
+    def read_text(self, blob_hash: str) -> Optional[str]:
+        reader = self.open(blob_hash)
+        return reader.text() if reader else None
+
+    def delete(self, blob_hash: str) -> None:
+        reader = self._readers.pop(blob_hash, None)
+        if reader is not None:
+            reader.close()
+        try:
+            os.remove(self.path_for(blob_hash))
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        while self._readers:
+            _, reader = self._readers.popitem()
+            reader.close()
+
+
+__all__ = [
+    "BlobFileStore",
+    "BlobReader",
+    "TextChunks",
+    "split_text",
+    "CHUNK_CHARS",
+]
@@ -12,7 +12,8 @@ from aiogram.fsm.state import StatesGroup, State
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
-from aiogram.fsm.storage.memory import MemoryStorage
+from webhook_server import serve
+from fsm_storage import create_storage
 
 # Настройка логирования
 logging.basicConfig(
@@ -51,7 +52,7 @@ if not WEATHER_API_KEY:
 
 # Создание бота
 bot = Bot(token=TELEGRAM_BOT_TOKEN)
-storage = MemoryStorage()
+storage = create_storage(DATA_DIR)
 dp = Dispatcher(storage=storage)
 
 # ✅ Создай роутер
@@ -384,14 +385,16 @@ async def handle_message(message: Message):
         await message.answer("⚠️ Произошла ошибка при обработке запроса.")
 
 # --- Запуск бота ---
-async def main():
+async def main(run=serve):
+    """run(dp, bot) — способ получения обновлений: webhook/polling или очередь воркера (workers.py)"""
     dp.include_router(router)
-    await dp.start_polling(bot)
+    # Здесь, а не в __main__: воркеры workers.py вызывают main() напрямую
+    restore_user_data()
+    await run(dp, bot)
 
 if __name__ == "__main__":
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     )
-    restore_user_data()
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,84 @@
+# button_dispatch.py
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.dispatcher.middlewares.manager import MiddlewareManager
+from aiogram.types import Message, TelegramObject
+
+_LOG = logging.getLogger("button_dispatch")
+
+
+def _command_key(text: str) -> str:
+    """«/Start@my_bot payload» -> «/start»."""
+    return text.split(maxsplit=1)[0].split("@", 1)[0].lower()
+
+
+class ButtonDispatch(BaseMiddleware):
+    """
+    Таблица точных совпадений для кнопок и команд: текст сообщения -> обработчик.
+    Регистрируется outer-middleware на dp.message (последним, после антифлуда
+    и планировщика) и вызывает обработчик одним поиском в dict, минуя цепочку
+    фильтров F.text == ... . Остальные сообщения идут обычным путём.
+
+    Обработчик получает те же аргументы, что и при обычной регистрации
+    (message, state, bot, ...) — лишние отбрасываются HandlerObject, — и
+    проходит через inner-middleware dp.message (метрики и т.п.), как обычный.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, HandlerObject] = {}
+        self._inner: Optional[MiddlewareManager] = None
+        self.hits = 0
+
+    def message(self, *keys: str) -> Callable:
+        """
+        Декоратор: @buttons.message("🌤️ Погода") или @buttons.message("/start").
+        Ключ, начинающийся с «/», — команда (без учёта регистра и @имени бота).
+        """
+        def decorator(callback: Callable) -> Callable:
+            target = HandlerObject(callback=callback)
+            for key in keys:
+                key = _command_key(key) if key.startswith("/") else key
+                if key in self._handlers:
+                    raise ValueError(f"Кнопка/команда {key!r} уже зарегистрирована")
+                self._handlers[key] = target
+            return callback
+        return decorator
+
+    def lookup(self, text: Optional[str]) -> Optional[HandlerObject]:
+        if not text:
+            return None
+        if text.startswith("/"):
+            return self._handlers.get(_command_key(text))
+        return self._handlers.get(text)
+
+    @property
+    def keys(self) -> frozenset:
+        return frozenset(self._handlers)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Message):
+            target = self.lookup(event.text)
+            if target is not None:
+                self.hits += 1
+                if not self._inner:
+                    return await target.call(event, **data)
+                wrapped = MiddlewareManager.wrap_middlewares(self._inner, target.call)
+                return await wrapped(event, {**data, "handler": target})
+        return await handler(event, data)
+
+    def setup(self, dp: Dispatcher) -> None:
+        self._inner = dp.message.middleware
+        dp.message.outer_middleware(self)
+
+
+__all__ = [
+    "ButtonDispatch",
+]
@@ -0,0 +1,160 @@
+# disk_janitor.py
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+_LOG = logging.getLogger("disk_janitor")
+
+# Полный обход каталогов делаем раз в FULL_RESCAN_EVERY проходов,
+# между ними индекс пополняется через track()
+FULL_RESCAN_EVERY = 12
+
+
+class DiskJanitor:
+    """
+    Фоновая уборка временных файлов (audio/).
+
+    Держит индекс {путь: (размер, mtime)} и суммарный объём, построенные через
+    os.scandir. Удаляет файлы старше max_age_seconds, а при превышении квоты —
+    самые старые, пока объём не уложится в quota_bytes.
+    Файлы, закреплённые через pin(), не удаляются никогда.
+    """
+
+    def __init__(self, dirs: Iterable[str], *, quota_bytes: int,
+                 max_age_seconds: float, interval: float = 300.0):
+        self.dirs: List[str] = [os.path.abspath(d) for d in dirs]
+        self.quota_bytes = quota_bytes
+        self.max_age_seconds = max_age_seconds
+        self.interval = interval
+        self._index: Dict[str, Tuple[int, float]] = {}
+        self._total = 0
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._sweeps = 0
+
+    # ---------- Индекс ----------
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def rescan(self) -> None:
+        """Полностью перестраивает индекс обходом каталогов через scandir."""
+        index: Dict[str, Tuple[int, float]] = {}
+        for d in self.dirs:
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        try:
+                            if not entry.is_file(follow_symlinks=False):
+                                continue
+                            st = entry.stat(follow_symlinks=False)
+                        except FileNotFoundError:
+                            continue
+                        index[entry.path] = (st.st_size, st.st_mtime)
+            except FileNotFoundError:
+                continue
+        with self._lock:
+            self._index = index
+            self._total = sum(size for size, _ in index.values())
+
+    def track(self, *paths: str) -> None:
+        """Добавляет в индекс только что записанные файлы (без обхода каталога)."""
+        with self._lock:
+            for path in paths:
+                path = os.path.abspath(path)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                old = self._index.get(path)
+                if old:
+                    self._total -= old[0]
+                self._index[path] = (st.st_size, st.st_mtime)
+                self._total += st.st_size
+
+    # ---------- Закрепление файлов ----------
+    @contextmanager
+    def pin(self, *paths: str) -> Iterator[None]:
+        """Пока блок выполняется, файлы не будут удалены (например, идёт отправка)."""
+        keys = [os.path.abspath(p) for p in paths]
+        with self._lock:
+            for k in keys:
+                self._pins[k] = self._pins.get(k, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for k in keys:
+                    left = self._pins.get(k, 0) - 1
+                    if left > 0:
+                        self._pins[k] = left
+                    else:
+                        self._pins.pop(k, None)
+            self.track(*keys)
+
+    # ---------- Уборка ----------
+    def _select(self, now: float) -> List[str]:
+        """Выбирает файлы на удаление и сразу убирает их из индекса (под self._lock)."""
+        victims: List[str] = []
+        total = self._total
+        # Старые записи — от старых к новым
+        by_age = sorted(self._index.items(), key=lambda kv: kv[1][1])
+        for path, (size, mtime) in by_age:
+            if path in self._pins:
+                continue
+            expired = now - mtime > self.max_age_seconds
+            if not expired and total <= self.quota_bytes:
+                break
+            victims.append(path)
+            total -= size
+        for path in victims:
+            size, _ = self._index.pop(path)
+            self._total -= size
+        return victims
+
+    def sweep(self) -> int:
+        """Один проход уборки. Возвращает число удалённых файлов."""
+        if self._sweeps % FULL_RESCAN_EVERY == 0:
+            self.rescan()
+        self._sweeps += 1
+
+        with self._lock:
+            victims = self._select(time.time())
+
+        # Удаление — без блокировки: pin() на event loop не ждёт медленный диск
+        removed = 0
+        for path in victims:
+            with self._lock:
+                if path in self._pins:
+                    # Закрепили после выбора — оставляем, вернётся в индекс через track()
+                    continue
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                _LOG.error("Не удалось удалить %s: %r", path, e)
+                # Файл остался на диске — учитываем его снова
+                self.track(path)
+        if removed:
+            _LOG.info("Уборка: удалено файлов %s, занято %s байт", removed, self._total)
+        return removed
+
+    async def run(self) -> None:
+        """Бесконечный цикл уборки; запускается через asyncio.create_task."""
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                _LOG.error("Ошибка уборки: %r", e)
+            await asyncio.sleep(self.interval)
+
+
+__all__ = [
+    "DiskJanitor",
+]
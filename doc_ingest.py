@@ -0,0 +1,163 @@
+# doc_ingest.py
+import codecs
+import hashlib
+import logging
+import unicodedata
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional
+
+from aiogram import Bot
+
+from tracing import span
+
+_LOG = logging.getLogger("doc_ingest")
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024
+# Кодировка, на которую переключаемся, если файл не UTF-8 (Блокнот Windows)
+FALLBACK_ENCODING = "cp1251"
+
+
+class DocumentTooLarge(ValueError):
+    """Файл превышает допустимый размер."""
+
+
+@dataclass
+class IngestedText:
+    text: str
+    sha256: str
+    encoding: str
+    size: int
+    paragraphs: int = 0
+
+
+class TextIngestor:
+    """
+    Потоковый разбор загруженного текста: определение кодировки по ходу чтения,
+    нормализация строк (NFC, без хвостовых пробелов и \\r), подсчёт абзацев
+    и sha256 итогового текста — без промежуточного файла на диске.
+    На фрагменты текст режет BlobFileStore при сохранении.
+    """
+
+    def __init__(self, *, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.encoding = "utf-8"
+        self._raw: List[bytes] = []  # нужны только для повторного декодирования при смене кодировки
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._tail = ""
+        self._lines: List[str] = []
+        self._blank_run = 0
+        self._hash = hashlib.sha256()
+        self.paragraphs = 0
+
+    def _add_line(self, line: str) -> None:
+        line = unicodedata.normalize("NFC", line.rstrip())
+        if not line:
+            # Пустые строки откладываем: в начале и в конце текста они отбрасываются
+            if self._lines:
+                self._blank_run += 1
+            return
+        for _ in range(self._blank_run):
+            self._store_line("")
+        self._blank_run = 0
+        self._store_line(line)
+
+    def _store_line(self, line: str) -> None:
+        if self._lines:
+            self._hash.update(b"\n")
+        self._hash.update(line.encode("utf-8"))
+        # Пустые строки попадают сюда только между абзацами
+        if line and (not self._lines or not self._lines[-1]):
+            self.paragraphs += 1
+        self._lines.append(line)
+
+    def _feed_text(self, text: str) -> None:
+        text = self._tail + text
+        lines = text.split("\n")
+        self._tail = lines.pop()
+        for line in lines:
+            self._add_line(line)
+
+    def _switch_to_fallback(self) -> None:
+        _LOG.info("Файл не в UTF-8, декодирую как %s", FALLBACK_ENCODING)
+        self.encoding = FALLBACK_ENCODING
+        self._decoder = codecs.getincrementaldecoder(FALLBACK_ENCODING)(errors="replace")
+        self._tail = ""
+        self._lines = []
+        self._blank_run = 0
+        self._hash = hashlib.sha256()
+        self.paragraphs = 0
+        for raw in self._raw:
+            self._feed_text(self._decoder.decode(raw))
+
+    def feed(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise DocumentTooLarge(f"Файл больше {self.max_bytes} байт")
+        if self.encoding == "utf-8":
+            self._raw.append(chunk)
+            try:
+                self._feed_text(self._decoder.decode(chunk))
+                return
+            except UnicodeDecodeError:
+                self._switch_to_fallback()
+                return
+        self._feed_text(self._decoder.decode(chunk))
+
+    def finish(self) -> IngestedText:
+        try:
+            self._feed_text(self._decoder.decode(b"", final=True))
+        except UnicodeDecodeError:
+            self._switch_to_fallback()
+            self._feed_text(self._decoder.decode(b"", final=True))
+        self._add_line(self._tail)
+        self._tail = ""
+        self._raw = []
+        return IngestedText(
+            text="\n".join(self._lines),
+            sha256=self._hash.hexdigest(),
+            encoding=self.encoding,
+            size=self.size,
+            paragraphs=self.paragraphs,
+        )
+
+
+async def ingest_stream(stream: AsyncIterator[bytes], *, max_bytes: int = DEFAULT_MAX_BYTES) -> IngestedText:
+    ingestor = TextIngestor(max_bytes=max_bytes)
+    async for chunk in stream:
+        if chunk:
+            ingestor.feed(chunk)
+    return ingestor.finish()
+
+
+async def ingest_telegram_file(
+    bot: Bot,
+    file_id: str,
+    *,
+    file_size: Optional[int] = None,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> IngestedText:
+    """
+    Скачивает документ Telegram потоком в память и сразу разбирает его.
+    Бросает DocumentTooLarge, если размер (заявленный или фактический) больше max_bytes.
+    """
+    if file_size is not None and file_size > max_bytes:
+        raise DocumentTooLarge(f"Файл больше {max_bytes} байт")
+    with span("download_file", file_size=file_size) as trace_span:
+        file_info = await bot.get_file(file_id)
+        url = bot.session.api.file_url(bot.token, file_info.file_path)
+        stream = bot.session.stream_content(url=url, chunk_size=chunk_size, raise_for_status=True)
+        doc = await ingest_stream(stream, max_bytes=max_bytes)
+        trace_span.set(encoding=doc.encoding, paragraphs=doc.paragraphs)
+        return doc
+
+
+__all__ = [
+    "DocumentTooLarge",
+    "IngestedText",
+    "TextIngestor",
+    "ingest_stream",
+    "ingest_telegram_file",
+]
@@ -0,0 +1,101 @@
+# doc_translate.py
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+from blob_files import split_text
+
+_LOG = logging.getLogger("doc_translate")
+
+# Грубая оценка: в среднем ~3 символа на токен (кириллица дороже латиницы)
+CHARS_PER_TOKEN = 3
+
+Translate = Callable[[str], Awaitable[str]]
+Progress = Callable[[int, int], Awaitable[None]]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_for_translation(text: str, max_tokens: int) -> List[str]:
+    """
+    Режет документ на фрагменты не больше max_tokens (по оценке) по границам
+    абзацев, затем строк. "".join(result) == text — разделители остаются
+    в конце фрагментов и при сборке возвращаются на место.
+    """
+    return split_text(text, max(1, max_tokens) * CHARS_PER_TOKEN)
+
+
+class ChunkFailed(RuntimeError):
+    """Фрагмент не удалось перевести за отведённые попытки."""
+
+    def __init__(self, index: int, error: BaseException):
+        super().__init__(f"фрагмент {index}: {error!r}")
+        self.index = index
+        self.error = error
+
+
+async def _translate_one(index: int, piece: str, translate: Translate, semaphore: asyncio.Semaphore,
+                         attempts: int) -> str:
+    # Пробелы и переводы строк на краях модель не сохраняет — переносим их сами
+    body = piece.strip()
+    if not body:
+        return piece
+    head = piece[:len(piece) - len(piece.lstrip())]
+    tail = piece[len(piece.rstrip()):]
+    async with semaphore:
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = await translate(body)
+                return head + result.strip() + tail
+            except Exception as e:
+                if attempt >= attempts:
+                    raise ChunkFailed(index, e) from e
+                _LOG.warning("Фрагмент %s: ошибка %r, повтор %s", index, e, attempt)
+                await asyncio.sleep(2 ** (attempt - 1))
+
+
+async def translate_chunks(
+    chunks: List[str],
+    translate: Translate,
+    *,
+    concurrency: int = 4,
+    attempts: int = 3,
+    on_progress: Optional[Progress] = None,
+) -> List[str]:
+    """
+    Переводит фрагменты параллельно, не больше concurrency одновременно,
+    и возвращает их в исходном порядке. on_progress(done, total) вызывается
+    по мере готовности фрагментов. Если фрагмент не переведён за attempts
+    попыток — остальные отменяются и поднимается ChunkFailed; при отмене
+    задачи отменяются и все фрагменты.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    tasks = [
+        asyncio.ensure_future(_translate_one(i, piece, translate, semaphore, attempts))
+        for i, piece in enumerate(chunks)
+    ]
+    try:
+        done = 0
+        for future in asyncio.as_completed(tasks):
+            await future
+            done += 1
+            if on_progress is not None:
+                await on_progress(done, len(tasks))
+        return [task.result() for task in tasks]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+__all__ = [
+    "CHARS_PER_TOKEN",
+    "ChunkFailed",
+    "estimate_tokens",
+    "split_for_translation",
+    "translate_chunks",
+]
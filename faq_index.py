@@ -0,0 +1,107 @@
+# faq_index.py
+import re
+import math
+import logging
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+_LOG = logging.getLogger("faq_index")
+
+# «1. **Вопрос?**» + строка «Ответ: …» до следующего пункта или конца текста
+_ENTRY_RE = re.compile(
+    r"^\s*\d+[.)]\s*\*\*(?P<question>.+?)\*\*\s*Ответ:\s*(?P<answer>.+?)(?=^\s*\d+[.)]\s*\*\*|\Z)",
+    re.MULTILINE | re.DOTALL,
+)
+_WORD_RE = re.compile(r"\w+")
+
+# Слова, которые есть почти в любом вопросе и не различают их
+_STOPWORDS = frozenset(
+    "и в во на с со к ко о об от до по за из у а но или ли же бы не ни то что как где когда "
+    "какой какая какие каком мне меня мой я вы вам вас ваш это этот для при ли можно нужно "
+    "лучше".split()
+)
+
+# Грубый стеммер: у русских слов совпадающая основа почти всегда в первых 5 буквах
+_STEM_LEN = 5
+
+
+def _stems(text: str) -> FrozenSet[str]:
+    words = _WORD_RE.findall(text.lower().replace("ё", "е"))
+    return frozenset(w[:_STEM_LEN] for w in words if w not in _STOPWORDS and len(w) > 1)
+
+
+def _trigrams(text: str) -> FrozenSet[str]:
+    norm = " " + " ".join(_WORD_RE.findall(text.lower().replace("ё", "е"))) + " "
+    return frozenset(norm[i:i + 3] for i in range(len(norm) - 2))
+
+
+@dataclass(frozen=True)
+class FaqEntry:
+    question: str
+    answer: str
+
+
+class FaqIndex:
+    """
+    Индекс «вопрос -> ответ» по базе знаний в формате FAQ.
+    match() ищет ближайший вопрос: косинус по основам слов (70%) плюс
+    сходство символьных триграмм (30%), устойчивое к опечаткам.
+    Кандидаты берутся из обратного индекса по основам — сравнение идёт
+    не со всеми вопросами.
+    """
+
+    def __init__(self, entries: List[FaqEntry]):
+        self.entries = entries
+        self._stems = [_stems(e.question) for e in entries]
+        self._trigrams = [_trigrams(e.question) for e in entries]
+        self._postings: Dict[str, List[int]] = {}
+        for i, stems in enumerate(self._stems):
+            for stem in stems:
+                self._postings.setdefault(stem, []).append(i)
+
+    @classmethod
+    def build(cls, text: str) -> "FaqIndex":
+        """Разбирает текст базы знаний; если формат не FAQ — индекс пустой."""
+        entries = [
+            FaqEntry(
+                question=" ".join(m.group("question").split()),
+                answer=m.group("answer").strip(),
+            )
+            for m in _ENTRY_RE.finditer(text)
+        ]
+        _LOG.info("FAQ: разобрано вопросов %s", len(entries))
+        return cls(entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def match(self, query: str, threshold: float = 0.6) -> Optional[Tuple[FaqEntry, float]]:
+        """Лучший вопрос с оценкой не ниже threshold (0..1) или None."""
+        query_stems = _stems(query)
+        if not query_stems:
+            return None
+        candidates: Set[int] = set()
+        for stem in query_stems:
+            candidates.update(self._postings.get(stem, ()))
+        if not candidates:
+            return None
+
+        query_trigrams = _trigrams(query)
+        best, best_score = None, 0.0
+        for i in candidates:
+            stems = self._stems[i]
+            cosine = len(stems & query_stems) / math.sqrt(len(stems) * len(query_stems))
+            trigrams = self._trigrams[i]
+            jaccard = len(trigrams & query_trigrams) / len(trigrams | query_trigrams)
+            score = 0.7 * cosine + 0.3 * jaccard
+            if score > best_score:
+                best, best_score = i, score
+        if best is None or best_score < threshold:
+            return None
+        return self.entries[best], best_score
+
+
+__all__ = [
+    "FaqEntry",
+    "FaqIndex",
+]
@@ -0,0 +1,131 @@
+# flood_control.py
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+_LOG = logging.getLogger("flood_control")
+
+NOTICE_TEXT = "⏳ Слишком много сообщений подряд. Подождите немного — предыдущие уже обрабатываются."
+
+
+class _Bucket:
+    __slots__ = ("tokens", "stamp", "last_key", "last_at", "noticed")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.stamp = now
+        self.last_key: Optional[str] = None
+        self.last_at = 0.0
+        self.noticed = False
+
+
+def _event_key(event: TelegramObject) -> Optional[str]:
+    """Чем считается «то же самое сообщение» для подавления дублей."""
+    if isinstance(event, CallbackQuery):
+        return f"cb:{event.data}"
+    if isinstance(event, Message):
+        if event.text is not None:
+            return f"t:{event.text.strip()}"
+        if event.document is not None:
+            return f"d:{event.document.file_unique_id}"
+    return None
+
+
+class FloodControl(BaseMiddleware):
+    """
+    Outer-middleware: ограничивает частоту обновлений от одного пользователя
+    (token bucket: rate в секунду, запас burst) и отбрасывает повтор того же
+    текста/кнопки/файла в течение dup_window секунд.
+
+    Отброшенные обновления до обработчиков не доходят; флудеру один раз
+    отправляется короткое уведомление, пока он снова не уложится в лимит.
+    exempt_texts (например «❌ Отмена») пропускаются всегда.
+    """
+
+    def __init__(
+        self,
+        *,
+        rate: float = 1.0,
+        burst: int = 5,
+        dup_window: float = 5.0,
+        exempt_texts: Iterable[str] = (),
+        max_users: int = 100_000,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.dup_window = dup_window
+        self.exempt_texts = frozenset(exempt_texts)
+        self.max_users = max_users
+        self._buckets: "OrderedDict[int, _Bucket]" = OrderedDict()
+        self.dropped_rate = 0
+        self.dropped_dup = 0
+
+    def _bucket(self, user_id: int, now: float) -> _Bucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _Bucket(self.burst, now)
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.stamp) * self.rate)
+            bucket.stamp = now
+        return bucket
+
+    async def _notify(self, event: TelegramObject, bucket: _Bucket) -> None:
+        try:
+            if isinstance(event, CallbackQuery):
+                # На callback ответить нужно в любом случае — иначе «часики» на кнопке
+                await event.answer(NOTICE_TEXT if not bucket.noticed else None)
+            elif isinstance(event, Message) and not bucket.noticed:
+                await event.answer(NOTICE_TEXT)
+        except Exception as e:
+            _LOG.warning("Не удалось отправить уведомление о флуде: %r", e)
+        bucket.noticed = True
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or (isinstance(event, Message) and event.text in self.exempt_texts):
+            return await handler(event, data)
+
+        now = time.monotonic()
+        bucket = self._bucket(user.id, now)
+
+        key = _event_key(event)
+        if key is not None and key == bucket.last_key and now - bucket.last_at < self.dup_window:
+            # Двойное нажатие / повторная отправка: первая копия уже в работе
+            self.dropped_dup += 1
+            bucket.last_at = now
+            if isinstance(event, CallbackQuery):
+                await event.answer()
+            return None
+
+        if bucket.tokens < 1:
+            self.dropped_rate += 1
+            await self._notify(event, bucket)
+            return None
+
+        bucket.tokens -= 1
+        bucket.noticed = False
+        bucket.last_key = key
+        bucket.last_at = now
+        return await handler(event, data)
+
+    def setup(self, dp: Dispatcher) -> None:
+        """Регистрировать раньше остальных outer-middleware, чтобы флуд отсекался первым."""
+        dp.message.outer_middleware(self)
+        dp.callback_query.outer_middleware(self)
+
+
+__all__ = [
+    "FloodControl",
+]
@@ -0,0 +1,345 @@
+# fsm_storage.py
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+_LOG = logging.getLogger("fsm_storage")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key        TEXT PRIMARY KEY,
+    state      TEXT,
+    data       TEXT,
+    state_exp  REAL,
+    data_exp   REAL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Компактный JSON: без пробелов и без \u-экранирования кириллицы
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+_loads = json.loads
+
+
+def key_to_str(key: StorageKey) -> str:
+    """Тот же порядок полей, что у DefaultKeyBuilder в aiogram."""
+    parts = [str(key.bot_id)]
+    if key.business_connection_id:
+        parts.append(str(key.business_connection_id))
+    parts.append(str(key.chat_id))
+    if key.thread_id:
+        parts.append(str(key.thread_id))
+    parts.append(str(key.user_id))
+    parts.append(key.destiny)
+    return ":".join(parts)
+
+
+def _state_str(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище в SQLite (режим WAL): переживает перезапуск и разделяется
+    между несколькими процессами бота на одном диске.
+
+    state_ttl / data_ttl — время жизни записи в секундах (None — бессрочно),
+    отсчитывается от последнего обращения, как у TTLMemoryStorage. Чтения
+    не пишут в базу сразу: продление копится и записывается пакетом
+    (touch_batch ключей или раз в touch_interval секунд, а также перед
+    purge_expired() и при закрытии).
+    """
+
+    def __init__(self, path: str, *, state_ttl: Optional[float] = None,
+                 data_ttl: Optional[float] = None, touch_batch: int = 100,
+                 touch_interval: float = 30.0):
+        self.path = path
+        self.state_ttl = state_ttl
+        self.data_ttl = data_ttl
+        self.touch_batch = touch_batch
+        self.touch_interval = touch_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm_storage")
+        self._conn: Optional[sqlite3.Connection] = None
+        # key -> время последнего чтения, ещё не записанное в базу
+        self._touched: Dict[str, float] = {}
+        self._touched_flushed_at = time.monotonic()
+
+    # ---------- Синхронная часть (выполняется в executor) ----------
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            out_dir = os.path.dirname(self.path)
+            if out_dir:
+                os.makedirs(out_dir, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _exp(ttl: Optional[float], now: float) -> Optional[float]:
+        return now + ttl if ttl else None
+
+    def _get_many(self, keys: List[str]) -> Dict[str, Tuple[Optional[str], Dict[str, Any]]]:
+        if not keys:
+            return {}
+        now = time.time()
+        marks = ",".join("?" * len(keys))
+        rows = self._db().execute(
+            f"SELECT key, state, data, state_exp, data_exp FROM fsm WHERE key IN ({marks})",
+            keys,
+        ).fetchall()
+        result: Dict[str, Tuple[Optional[str], Dict[str, Any]]] = {}
+        for key, state, data, state_exp, data_exp in rows:
+            if state_exp is not None and state_exp <= now:
+                state = None
+            if data_exp is not None and data_exp <= now:
+                data = None
+            result[key] = (state, _loads(data) if data else {})
+        return result
+
+    def _set_states(self, items: Iterable[Tuple[str, Optional[str]]]) -> None:
+        now = time.time()
+        exp = self._exp(self.state_ttl, now)
+        conn = self._db()
+        with conn:
+            conn.executemany(
+                "INSERT INTO fsm (key, state, state_exp, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+                "state_exp = excluded.state_exp, updated_at = excluded.updated_at",
+                [(k, s, exp if s is not None else None, now) for k, s in items],
+            )
+
+    def _set_datas(self, items: Iterable[Tuple[str, Mapping[str, Any]]]) -> None:
+        now = time.time()
+        exp = self._exp(self.data_ttl, now)
+        conn = self._db()
+        with conn:
+            conn.executemany(
+                "INSERT INTO fsm (key, data, data_exp, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data, "
+                "data_exp = excluded.data_exp, updated_at = excluded.updated_at",
+                [(k, _dumps(dict(d)) if d else None, exp if d else None, now) for k, d in items],
+            )
+
+    def _touch_many(self, items: List[Tuple[str, float]]) -> None:
+        """Продлевает срок прочитанных записей; уже истёкшие не оживляются."""
+        state_ttl, data_ttl = self.state_ttl or 0, self.data_ttl or 0
+        conn = self._db()
+        with conn:
+            conn.executemany(
+                "UPDATE fsm SET "
+                "state_exp = CASE WHEN state_exp > ? THEN MAX(state_exp, ?) ELSE state_exp END, "
+                "data_exp = CASE WHEN data_exp > ? THEN MAX(data_exp, ?) ELSE data_exp END "
+                "WHERE key = ?",
+                [(t, t + state_ttl, t, t + data_ttl, k) for k, t in items],
+            )
+
+    def _purge(self) -> int:
+        now = time.time()
+        conn = self._db()
+        with conn:
+            conn.execute("UPDATE fsm SET state = NULL, state_exp = NULL WHERE state_exp <= ?", (now,))
+            conn.execute("UPDATE fsm SET data = NULL, data_exp = NULL WHERE data_exp <= ?", (now,))
+            cur = conn.execute("DELETE FROM fsm WHERE state IS NULL AND data IS NULL")
+        return cur.rowcount
+
+    def _count_states(self) -> Dict[str, int]:
+        rows = self._db().execute(
+            "SELECT state, COUNT(*) FROM fsm WHERE state IS NOT NULL "
+            "AND (state_exp IS NULL OR state_exp > ?) GROUP BY state",
+            (time.time(),),
+        ).fetchall()
+        return dict(rows)
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    # ---------- Продление срока при чтении ----------
+    async def _touch(self, found: Mapping[str, Tuple[Optional[str], Dict[str, Any]]]) -> None:
+        if not (self.state_ttl or self.data_ttl):
+            return
+        now = time.time()
+        for k, (state, data) in found.items():
+            if state is not None or data:
+                self._touched[k] = now
+        if (len(self._touched) >= self.touch_batch
+                or time.monotonic() - self._touched_flushed_at >= self.touch_interval):
+            await self._flush_touched()
+
+    async def _flush_touched(self) -> None:
+        self._touched_flushed_at = time.monotonic()
+        if not self._touched:
+            return
+        items, self._touched = list(self._touched.items()), {}
+        await self._run(self._touch_many, items)
+
+    # ---------- BaseStorage ----------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._run(self._set_states, [(key_to_str(key), _state_str(state))])
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        k = key_to_str(key)
+        found = await self._run(self._get_many, [k])
+        await self._touch(found)
+        return found.get(k, (None, {}))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._run(self._set_datas, [(key_to_str(key), data)])
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        k = key_to_str(key)
+        found = await self._run(self._get_many, [k])
+        await self._touch(found)
+        return found.get(k, (None, {}))[1]
+
+    async def close(self) -> None:
+        try:
+            await self._flush_touched()
+        finally:
+            await self._run(self._close)
+            self._executor.shutdown(wait=True)
+
+    # ---------- Пакетные операции ----------
+    async def get_many(self, keys: Iterable[StorageKey]) -> Dict[StorageKey, Tuple[Optional[str], Dict[str, Any]]]:
+        """Состояния и данные нескольких ключей одним запросом."""
+        keys = list(keys)
+        found = await self._run(self._get_many, [key_to_str(k) for k in keys])
+        await self._touch(found)
+        return {k: found.get(key_to_str(k), (None, {})) for k in keys}
+
+    async def set_many(self, states: Optional[Mapping[StorageKey, StateType]] = None,
+                       datas: Optional[Mapping[StorageKey, Mapping[str, Any]]] = None) -> None:
+        """Запись нескольких состояний и/или данных пакетом."""
+        if states:
+            await self._run(self._set_states, [(key_to_str(k), _state_str(s)) for k, s in states.items()])
+        if datas:
+            await self._run(self._set_datas, [(key_to_str(k), d) for k, d in datas.items()])
+
+    async def purge_expired(self) -> int:
+        """Удаляет истёкшие записи. Возвращает число удалённых ключей."""
+        # Иначе пропадут контексты, которые читались, но ещё не продлены в базе
+        await self._flush_touched()
+        return await self._run(self._purge)
+
+    async def count_states(self) -> Dict[str, int]:
+        """Сколько пользователей в каждом состоянии (для метрик)."""
+        return await self._run(self._count_states)
+
+
+class TTLMemoryStorage(MemoryStorage):
+    """
+    MemoryStorage, который забывает неактивных пользователей: контекст,
+    к которому не обращались idle_ttl секунд, удаляется при purge_expired().
+    """
+
+    def __init__(self, idle_ttl: Optional[float] = None):
+        super().__init__()
+        self.idle_ttl = idle_ttl
+        self._touched: Dict[StorageKey, float] = {}
+
+    def _touch(self, key: StorageKey) -> None:
+        self._touched[key] = time.monotonic()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._touch(key)
+        await super().set_state(key, state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        self._touch(key)
+        return await super().get_state(key)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        self._touch(key)
+        await super().set_data(key, data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        self._touch(key)
+        return await super().get_data(key)
+
+    async def purge_expired(self) -> int:
+        if not self.idle_ttl:
+            return 0
+        deadline = time.monotonic() - self.idle_ttl
+        stale = [k for k, t in self._touched.items() if t <= deadline]
+        for key in stale:
+            self._touched.pop(key, None)
+            self.storage.pop(key, None)
+        return len(stale)
+
+    async def count_states(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for record in self.storage.values():
+            if record.state is not None:
+                counts[record.state] = counts.get(record.state, 0) + 1
+        return counts
+
+
+async def run_fsm_janitor(storage: BaseStorage, interval: float = 600.0) -> None:
+    """Периодически удаляет истёкшие FSM-контексты; запускается через asyncio.create_task."""
+    purge = getattr(storage, "purge_expired", None)
+    if purge is None:
+        # Redis удаляет ключи по TTL сам
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await purge()
+            if removed:
+                _LOG.info("FSM: удалено неактивных контекстов %s", removed)
+        except Exception as e:
+            _LOG.error("Ошибка очистки FSM: %r", e)
+
+
+def create_storage(data_dir: str) -> BaseStorage:
+    """
+    FSM-хранилище по переменным окружения:
+      FSM_STORAGE=sqlite (по умолчанию) — файл FSM_DB_PATH или {data_dir}/fsm.db;
+      FSM_STORAGE=redis — REDIS_URL (нужен пакет redis);
+      FSM_STORAGE=memory — MemoryStorage (состояния теряются при перезапуске).
+    FSM_IDLE_TTL — через сколько секунд простоя контекст пользователя забывается
+    (по умолчанию сутки, 0 — никогда); FSM_STATE_TTL / FSM_DATA_TTL уточняют его
+    отдельно для состояния и данных.
+    """
+    kind = os.getenv("FSM_STORAGE", "sqlite").lower()
+    idle_ttl = os.getenv("FSM_IDLE_TTL", "86400")
+    state_ttl = float(os.getenv("FSM_STATE_TTL", idle_ttl)) or None
+    data_ttl = float(os.getenv("FSM_DATA_TTL", idle_ttl)) or None
+
+    if kind == "memory":
+        return TTLMemoryStorage(idle_ttl=max(state_ttl or 0, data_ttl or 0) or None)
+    if kind == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            state_ttl=int(state_ttl) if state_ttl else None,
+            data_ttl=int(data_ttl) if data_ttl else None,
+        )
+    path = os.getenv("FSM_DB_PATH") or os.path.join(data_dir, "fsm.db")
+    _LOG.info("FSM-хранилище: SQLite %s", path)
+    return SQLiteStorage(path, state_ttl=state_ttl, data_ttl=data_ttl)
+
+
+__all__ = [
+    "SQLiteStorage",
+    "TTLMemoryStorage",
+    "create_storage",
+    "run_fsm_janitor",
+    "key_to_str",
+]
@@ -0,0 +1,173 @@
+# intent_router.py
+import re
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Pattern, Tuple
+
+_LOG = logging.getLogger("intent_router")
+
+CHAT = "chat"
+WEATHER = "weather"
+TRANSLATE = "translate"
+
+
+@dataclass
+class Intent:
+    name: str
+    score: float = 0.0
+    slot: Optional[str] = None  # город для погоды, текст для перевода
+
+
+@dataclass
+class _Spec:
+    name: str
+    keywords: List[str]          # регулярные выражения ключевых слов
+    keyword_weight: float
+    threshold: float
+    slot_re: Optional[Pattern] = None
+    slot_weight: float = 0.0
+    # Без найденного слота намерение не выбирается, сколько бы ни набрало
+    slot_required: bool = False
+    # (выражение, вес) — дополнительные признаки
+    features: List[Tuple[Pattern, float]] = field(default_factory=list)
+
+
+_CYRILLIC_RE = re.compile(r"[А-Яа-яЁё]")
+
+_SPECS = [
+    _Spec(
+        name=WEATHER,
+        keywords=[r"погод\w*", r"прогноз\w*", r"температур\w*", r"градус\w*", r"weather", r"forecast"],
+        keyword_weight=1.5,
+        threshold=3.0,
+        # «погода в Москве», «какая погода во Владивостоке», «weather in London»
+        # Регистр важен только для второго слова города («Нижний Новгород», но не «Москве сегодня»)
+        slot_re=re.compile(
+            r"(?i:погод\w*|прогноз\w*|температур\w*|градус\w*|weather|forecast)"
+            r"(?:\s+\w+)?\s+(?i:в|во|in|for)\s+([A-Za-zА-Яа-яЁё][\w\-]*(?:\s[A-ZА-ЯЁ][\w\-]*)?)",
+        ),
+        slot_weight=2.0,
+        features=[
+            # Длинные рассуждения («что надеть, если погода…») — к LLM
+            (re.compile(r"(?:\S+\s+){12,}"), -2.0),
+            (re.compile(r"\b(?:почему|зачем|посоветуй|что\s+надеть|как\s+одеться)\b", re.IGNORECASE), -2.0),
+        ],
+    ),
+    _Spec(
+        name=TRANSLATE,
+        keywords=[r"переведи\w*", r"перевод\w*", r"translate"],
+        keyword_weight=2.0,
+        threshold=3.0,
+        # Текст для перевода — только после повелительного глагола или «перевод:»:
+        # «переведи: …», «translate "…"», «переведи на русский язык …».
+        # «перевод денег в Турцию», «переводчик нужен в Китае?» слота не дают и уходят в CHAT
+        slot_re=re.compile(
+            r"(?:\b(?:переведи(?:те)?|translate)\b(?:\s+(?:на|to|into)\s+\w+(?:\s+язык\w*)?)?"
+            r"|\bперевод(?=\s*[:\-—]))\s*[:\-—]?\s*(.+)",
+            re.IGNORECASE | re.DOTALL,
+        ),
+        slot_weight=1.0,
+        slot_required=True,
+    ),
+]
+
+
+class IntentRouter:
+    """
+    Определяет намерение запроса без LLM: ключевые слова всех намерений собраны
+    в одно скомпилированное регулярное выражение (один проход по тексту),
+    затем линейная оценка — вес ключевых слов, найденный слот (город/текст)
+    и дополнительные признаки. Ниже порога — CHAT (ответ через LLM).
+
+    Счётчики routed / llm_saved показывают, сколько запросов ушли мимо LLM.
+    """
+
+    def __init__(self, specs: List[_Spec] = _SPECS, log_every: int = 100):
+        self._specs = {spec.name: spec for spec in specs}
+        self._keywords_re = re.compile(
+            "|".join(
+                f"(?P<{spec.name}>{'|'.join(spec.keywords)})" for spec in specs
+            ),
+            re.IGNORECASE,
+        )
+        self.log_every = log_every
+        self.routed: Dict[str, int] = {CHAT: 0, **{spec.name: 0 for spec in specs}}
+        self.llm_calls = 0
+        self.llm_saved = 0
+        self.fallbacks = 0
+
+    def classify(self, text: str) -> Intent:
+        hits: Dict[str, int] = {}
+        for match in self._keywords_re.finditer(text):
+            hits[match.lastgroup] = hits.get(match.lastgroup, 0) + 1
+        if not hits:
+            return Intent(CHAT)
+
+        best = Intent(CHAT)
+        for name, count in hits.items():
+            spec = self._specs[name]
+            # Повтор одного слова почти ничего не добавляет
+            score = spec.keyword_weight * (1 + 0.25 * (count - 1))
+            slot = None
+            if spec.slot_re is not None:
+                match = spec.slot_re.search(text)
+                if match:
+                    slot = match.group(1).strip(" .,!?")
+                    score += spec.slot_weight
+            for pattern, weight in spec.features:
+                if pattern.search(text):
+                    score += weight
+            if spec.slot_required and not slot:
+                continue
+            if score >= spec.threshold and score > best.score:
+                best = Intent(name, score, slot or None)
+        return best
+
+    def route(self, text: str) -> Intent:
+        """classify() + учёт в статистике."""
+        intent = self.classify(text)
+        self.routed[intent.name] += 1
+        total = sum(self.routed.values())
+        if self.log_every and total % self.log_every == 0:
+            _LOG.info("Намерения: %s, LLM-вызовов %s, сэкономлено %s, возвратов в LLM %s",
+                      self.routed, self.llm_calls, self.llm_saved, self.fallbacks)
+        return intent
+
+    def answered_locally(self) -> None:
+        """Запрос обслужен без обращения к LLM."""
+        self.llm_saved += 1
+
+    def fell_back(self) -> None:
+        """Быстрый путь не справился — запрос всё-таки ушёл в LLM."""
+        self.fallbacks += 1
+
+    def llm_called(self) -> None:
+        self.llm_calls += 1
+
+
+# Предложный падеж -> именительный: «в Москве» -> «Москва», «в Казани» -> «Казань»
+_CITY_ENDINGS = [("ве", "ва"), ("не", "на"), ("ле", "ль"), ("ни", "нь"), ("ге", "г"), ("ке", "к"),
+                 ("е", "а"), ("е", ""), ("и", "ь"), ("и", "")]
+
+
+def city_candidates(city: str) -> List[str]:
+    """Город как есть и варианты без падежного окончания — по порядку проверки."""
+    candidates = [city]
+    if _CYRILLIC_RE.search(city):
+        lower = city.lower()
+        for ending, replacement in _CITY_ENDINGS:
+            if lower.endswith(ending) and len(city) > len(ending) + 2:
+                candidate = city[: -len(ending)] + replacement
+                if candidate not in candidates:
+                    candidates.append(candidate)
+    return candidates[:3]
+
+
+__all__ = [
+    "CHAT",
+    "WEATHER",
+    "TRANSLATE",
+    "Intent",
+    "IntentRouter",
+    "city_candidates",
+]
@@ -0,0 +1,310 @@
+# job_queue.py
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from tracing import start_trace
+
+_LOG = logging.getLogger("job_queue")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind       TEXT    NOT NULL,
+    user_id    INTEGER,
+    payload    TEXT    NOT NULL,
+    status     TEXT    NOT NULL,
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    error      TEXT,
+    created_at REAL    NOT NULL,
+    updated_at REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+-- Кто сейчас исполняет очередь: одна строка, продлевается владельцем
+CREATE TABLE IF NOT EXISTS lease (
+    id         INTEGER PRIMARY KEY CHECK (id = 1),
+    owner      TEXT    NOT NULL,
+    expires_at REAL    NOT NULL
+);
+"""
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class QueueFull(RuntimeError):
+    """Очередь переполнена — задачу нужно отклонить (backpressure)."""
+
+
+class _Kind:
+    """Тип задач: своя очередь и столько исполнителей, сколько задач можно вести одновременно."""
+
+    def __init__(self, handler: JobHandler, concurrency: int):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.queue: "asyncio.Queue[Tuple[int, Dict[str, Any]]]" = asyncio.Queue()
+
+
+class JobQueue:
+    """
+    Фоновая очередь тяжёлых задач (озвучка, разбор документов).
+
+    Задачи сохраняются в SQLite до выполнения, поэтому переживают перезапуск:
+    незавершённые при старте снова ставятся в очередь. У каждого типа задач
+    своя очередь и concurrency исполнителей, так что поток задач одного типа
+    не задерживает остальные. submit() бросает QueueFull, если ожидающих
+    задач больше max_pending.
+
+    Исполнять очередь из одного файла может только один процесс: он держит
+    аренду (lease), продлевая её каждые lease_ttl / 3 секунд. При поочерёдном
+    перезапуске новый процесс принимает задачи сразу, а восстанавливает
+    прерванные и начинает исполнять только после выхода старого (или через
+    lease_ttl после его падения).
+    """
+
+    def __init__(self, path: str, *, max_pending: int = 200, max_attempts: int = 3,
+                 lease_ttl: float = 30.0):
+        self.path = path
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.lease_ttl = lease_ttl
+        self._owner = f"{os.getpid()}:{id(self):x}"
+        self._kinds: Dict[str, _Kind] = {}
+        self._lease_task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job_queue")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._tasks: List[asyncio.Task] = []
+        # Незавершённые задачи: id -> (user_id, payload); у выполняющихся — ещё и Task
+        self._active: Dict[int, Tuple[Optional[int], Dict[str, Any]]] = {}
+        self._running: Dict[int, asyncio.Task] = {}
+        self._cancelled: Set[int] = set()
+        self.running = 0
+
+    # ---------- SQLite (в executor) ----------
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            out_dir = os.path.dirname(self.path)
+            if out_dir:
+                os.makedirs(out_dir, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _insert(self, kind: str, user_id: Optional[int], payload: Dict[str, Any]) -> int:
+        now = time.time()
+        conn = self._db()
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO jobs (kind, user_id, payload, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?)",
+                (kind, user_id, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+        return cur.lastrowid
+
+    def _set_status(self, job_id: int, status: str, error: Optional[str] = None,
+                    attempt: bool = False) -> None:
+        conn = self._db()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ?, "
+                "attempts = attempts + ? WHERE id = ?",
+                (status, error, time.time(), 1 if attempt else 0, job_id),
+            )
+
+    def _mark_cancelled(self, job_ids: List[int]) -> None:
+        conn = self._db()
+        with conn:
+            conn.executemany(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ?",
+                [(time.time(), job_id) for job_id in job_ids],
+            )
+
+    def _take_lease(self) -> bool:
+        """Берёт или продлевает аренду; False — её держит другой живой процесс."""
+        now = time.time()
+        conn = self._db()
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO lease (id, owner, expires_at) VALUES (1, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE lease.owner = excluded.owner OR lease.expires_at < ?",
+                (self._owner, now + self.lease_ttl, now),
+            )
+        return cur.rowcount == 1
+
+    def _release_lease(self) -> None:
+        conn = self._db()
+        with conn:
+            conn.execute("DELETE FROM lease WHERE owner = ?", (self._owner,))
+
+    def _recover(self) -> List[Tuple[int, Optional[int], str, Dict[str, Any]]]:
+        conn = self._db()
+        with conn:
+            # Задача, которая уже несколько раз роняла процесс, больше не повторяется
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'too many attempts', updated_at = ? "
+                "WHERE status = 'running' AND attempts >= ?",
+                (time.time(), self.max_attempts),
+            )
+            # Остальные задачи, прерванные перезапуском, выполняем заново
+            conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+            # Завершённые старше суток больше не нужны
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated_at < ?",
+                (time.time() - 86400,),
+            )
+        rows = conn.execute(
+            "SELECT id, user_id, kind, payload FROM jobs WHERE status = 'queued' ORDER BY id"
+        ).fetchall()
+        return [(job_id, user_id, kind, json.loads(payload)) for job_id, user_id, kind, payload in rows]
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    # ---------- API ----------
+    def register(self, kind: str, handler: JobHandler, *, concurrency: int = 1) -> None:
+        """Обработчик задач типа kind; одновременно выполняется не больше concurrency."""
+        self._kinds[kind] = _Kind(handler, max(1, concurrency))
+
+    @property
+    def pending(self) -> int:
+        """Задачи, которые ещё ждут исполнителя."""
+        return sum(k.queue.qsize() for k in self._kinds.values())
+
+    async def submit(self, kind: str, payload: Dict[str, Any], *, user_id: Optional[int] = None) -> int:
+        if kind not in self._kinds:
+            raise KeyError(f"Нет обработчика задач «{kind}»")
+        pending = self.pending
+        if pending >= self.max_pending:
+            raise QueueFull(f"В очереди {pending} задач")
+        job_id = await self._run(self._insert, kind, user_id, payload)
+        self._active[job_id] = (user_id, payload)
+        self._kinds[kind].queue.put_nowait((job_id, payload))
+        return job_id
+
+    async def cancel_user(self, user_id: int) -> List[Dict[str, Any]]:
+        """
+        Отменяет ожидающие и выполняющиеся задачи пользователя.
+        Возвращает их payload, чтобы вызывающий код мог обновить статусные сообщения.
+        """
+        job_ids = [job_id for job_id, (uid, _) in self._active.items() if uid == user_id]
+        if not job_ids:
+            return []
+        payloads = [self._active.pop(job_id)[1] for job_id in job_ids]
+        for job_id in job_ids:
+            self._cancelled.add(job_id)
+            task = self._running.get(job_id)
+            if task is not None:
+                task.cancel()
+        await self._run(self._mark_cancelled, job_ids)
+        _LOG.info("Пользователь %s отменил задачи %s", user_id, job_ids)
+        return payloads
+
+    @staticmethod
+    async def _call(job_id: int, kind: str, handler: JobHandler, payload: Dict[str, Any]) -> None:
+        # Своя трасса на задачу; trace_id из payload связывает её с обновлением, которое её поставило
+        async with start_trace("job:" + kind, trace_id=payload.get("trace_id"),
+                               job_id=job_id, user_id=payload.get("user_id")):
+            await handler(payload)
+
+    async def _execute(self, job_id: int, kind: str, payload: Dict[str, Any]) -> None:
+        if job_id in self._cancelled:
+            return
+        await self._run(self._set_status, job_id, "running", None, True)
+        if job_id in self._cancelled:
+            # Отменили, пока записывался статус
+            return
+        # Обработчик — отдельная задача: её можно отменить, не останавливая исполнителя
+        task = asyncio.create_task(self._call(job_id, kind, self._kinds[kind].handler, payload))
+        self._running[job_id] = task
+        self.running += 1
+        try:
+            await task
+        except asyncio.CancelledError:
+            if task.cancelled() and job_id in self._cancelled:
+                return
+            # Останов процесса: задача останется 'running' и будет повторена после старта
+            raise
+        except Exception as e:
+            _LOG.error("Задача %s (%s) завершилась ошибкой: %r", job_id, kind, e, exc_info=True)
+            await self._run(self._set_status, job_id, "failed", repr(e))
+            return
+        finally:
+            self.running -= 1
+            self._running.pop(job_id, None)
+        await self._run(self._set_status, job_id, "done")
+
+    async def _worker(self, kind: str) -> None:
+        queue = self._kinds[kind].queue
+        while True:
+            job_id, payload = await queue.get()
+            try:
+                await self._execute(job_id, kind, payload)
+            finally:
+                self._active.pop(job_id, None)
+                self._cancelled.discard(job_id)
+                queue.task_done()
+
+    async def _start_workers(self) -> None:
+        recovered = await self._run(self._recover)
+        restored = 0
+        for job_id, user_id, kind, payload in recovered:
+            # Поставленные этим процессом до получения аренды уже в памяти
+            if kind in self._kinds and job_id not in self._active:
+                self._active[job_id] = (user_id, payload)
+                self._kinds[kind].queue.put_nowait((job_id, payload))
+                restored += 1
+        if restored:
+            _LOG.info("Восстановлено задач из очереди: %s", restored)
+        self._tasks = [
+            asyncio.create_task(self._worker(kind))
+            for kind, spec in self._kinds.items()
+            for _ in range(spec.concurrency)
+        ]
+
+    async def _hold_lease(self) -> None:
+        if not await self._run(self._take_lease):
+            _LOG.info("Очередь %s исполняет другой процесс — жду его выхода", self.path)
+            while not await self._run(self._take_lease):
+                await asyncio.sleep(1.0)
+        await self._start_workers()
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                if not await self._run(self._take_lease):
+                    _LOG.error("Аренда очереди %s перехвачена другим процессом", self.path)
+            except Exception as e:
+                _LOG.error("Ошибка продления аренды очереди %s: %r", self.path, e)
+
+    async def start(self) -> None:
+        """Не блокирует: задачи принимаются сразу, исполнение — после получения аренды."""
+        self._lease_task = asyncio.create_task(self._hold_lease())
+
+    async def stop(self) -> None:
+        tasks = [t for t in (self._lease_task, *self._tasks) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._lease_task, self._tasks = None, []
+        await self._run(self._release_lease)
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+
+__all__ = [
+    "JobQueue",
+    "QueueFull",
+]
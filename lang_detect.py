@@ -0,0 +1,188 @@
+# lang_detect.py
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+# ---------- Письменность ----------
+# Первое слово имени символа в Unicode -> письменность
+_SCRIPT_PREFIXES = {
+    "CYRILLIC": "cyrillic",
+    "LATIN": "latin",
+    "GREEK": "greek",
+    "ARABIC": "arabic",
+    "HEBREW": "hebrew",
+    "DEVANAGARI": "devanagari",
+    "ARMENIAN": "armenian",
+    "GEORGIAN": "georgian",
+    "THAI": "thai",
+    "HANGUL": "hangul",
+    "HIRAGANA": "kana",
+    "KATAKANA": "kana",
+    "CJK": "han",
+}
+
+# Язык по умолчанию для письменности при равных признаках (чаще всего встречается у нас)
+_SCRIPT_PRIORS = {"cyrillic": "ru", "latin": "en"}
+# Сколько своих признаков (триграммы плюс одна за характерные буквы) нужно языку
+# по умолчанию, чтобы его вернуть: одних общих букв (ы, э есть и в монгольском,
+# и в киргизском) или ничьей без признаков мало
+_PRIOR_MIN_EVIDENCE = 2
+
+# Письменность, однозначно задающая язык
+_SCRIPT_LANGS = {
+    "greek": "el",
+    "hebrew": "he",
+    "devanagari": "hi",
+    "armenian": "hy",
+    "georgian": "ka",
+    "thai": "th",
+    "hangul": "ko",
+    "kana": "ja",
+    "han": "zh",
+    "arabic": "ar",
+}
+
+LANG_NAMES = {
+    "ru": "русский", "uk": "украинский", "be": "белорусский", "bg": "болгарский",
+    "kk": "казахский", "sr": "сербский", "en": "английский", "de": "немецкий",
+    "fr": "французский", "es": "испанский", "it": "итальянский", "pt": "португальский",
+    "pl": "польский", "tr": "турецкий", "el": "греческий", "he": "иврит", "hi": "хинди",
+    "hy": "армянский", "ka": "грузинский", "th": "тайский", "ko": "корейский",
+    "ja": "японский", "zh": "китайский", "ar": "арабский",
+}
+
+
+def _char_script(ch: str) -> Optional[str]:
+    if ch.isascii():
+        return "latin" if ch.isalpha() else None
+    if not ch.isalpha():
+        return None
+    name = unicodedata.name(ch, "")
+    return _SCRIPT_PREFIXES.get(name.split(" ", 1)[0])
+
+
+def dominant_script(text: str) -> Tuple[Optional[str], float]:
+    """Основная письменность текста и её доля среди букв."""
+    counts: Dict[str, int] = {}
+    for ch in text:
+        script = _char_script(ch)
+        if script:
+            counts[script] = counts.get(script, 0) + 1
+    if not counts:
+        return None, 0.0
+    # Японский текст — смесь каны и иероглифов; кана однозначнее
+    if "kana" in counts:
+        counts["kana"] += counts.pop("han", 0)
+    script, count = max(counts.items(), key=lambda kv: kv[1])
+    return script, count / sum(counts.values())
+
+
+# ---------- Профили n-грамм ----------
+# Частые триграммы (с пробелом как границей слова) и буквы, характерные только для языка
+_PROFILES: Dict[str, Dict[str, Tuple[FrozenSet[str], FrozenSet[str]]]] = {
+    "cyrillic": {
+        "ru": (frozenset(" не|ть |ого|ени| по|ост|ся | пр|ет |то |ния|ать|что| чт|ов |ый |ой |как|ли |ие ".split("|")),
+               frozenset("ыэё")),
+        "uk": (frozenset(" не|ння|ти |ого| по|ть |ськ| пр|ий |ся |що |ати| що|ів |ні |ій | на|на |них|ого".split("|")),
+               frozenset("іїєґ")),
+        "be": (frozenset(" не|ць |ння| па|ага|ыя |ай | на|на | і |ў | ў |цца|скі| пр|ых |ні |ая |ам |да ".split("|")),
+               frozenset("ўі")),
+        "bg": (frozenset(" на|на |та |то |ата| за|за |ите| не|не |ст |ни |ва |от |ия | от|ият|ане|ото|ще ".split("|")),
+               frozenset("ъ")),
+        "sr": (frozenset(" је|је | на|на | да|да |ња |ије| се|се |ост| у |ти |ни |ање|ста| по|ом |ог |ење".split("|")),
+               frozenset("јљњћђџ")),
+        "kk": (frozenset(" ме|мен|ен |ын |ің |ан |ар | бо|бол|ады|лар|дар| жа|жән|әне|ты |ды |ға |ге |ның".split("|")),
+               frozenset("әғқңөұүһі")),
+    },
+    "latin": {
+        "en": (frozenset(" th|the|he |and| an|nd |ing|ng | to|to | of|of |ion| in|is |ed |er |you| yo|at ".split("|")),
+               frozenset("")),
+        "de": (frozenset("der|die|ein|ch |sch|und| un|nd |ich|en |den| de|ie |cht|ung|ei |das| da|ist|zu ".split("|")),
+               frozenset("äöüß")),
+        "fr": (frozenset(" le|les|es | de|de |ent|le |ion| la|la |que|ez | vo|ous|des|eur|est|ais|ui |aut|ou ".split("|")),
+               frozenset("èêëîôûçœâ")),
+        "es": (frozenset(" de|de |os | la|la |que| qu|ue |el |as |es |ent|ión|ado| el|los| lo|par|con|ara".split("|")),
+               frozenset("ñ¿¡")),
+        "it": (frozenset(" di|di |che| ch|la |to |re |ell|lla|del| de|ent|are| il|il |per| pe|zio|ion|ato".split("|")),
+               frozenset("ìò")),
+        "pt": (frozenset(" de|de |os |ão |que| qu|ue |do | do|da |ção|as |ent| co|com|nte|est|par|em | em".split("|")),
+               frozenset("ãõ")),
+        "pl": (frozenset(" ni|nie|ie | pr|prz|rze|ych| po|owa|ani|ego| do|ch |sz |cz | za|wie|ąc |ię | w ".split("|")),
+               frozenset("ąęłśżźćń")),
+        "tr": (frozenset(" bi|bir|ir |lar|ler|in |da | ve|ve |en |an |ını|eri|yor|ara|ın | ol|dir|ına|nda".split("|")),
+               frozenset("ğışİ")),
+    },
+}
+
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+def _trigrams(text: str) -> List[str]:
+    grams: List[str] = []
+    for word in _WORD_RE.findall(text.lower()):
+        padded = f" {word} "
+        grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+@dataclass
+class Detection:
+    lang: Optional[str]
+    script: Optional[str]
+    confidence: float
+
+    @property
+    def name(self) -> str:
+        return LANG_NAMES.get(self.lang or "", self.lang or "неизвестный")
+
+
+def detect_language(text: str) -> Detection:
+    """
+    Язык текста без сети: сначала письменность (для кириллицы и латиницы —
+    ещё и сравнение с профилями частых триграмм и характерных букв).
+    confidence (0..1) — доля основной письменности с поправкой на отрыв лучшего
+    профиля от второго и на длину текста. Язык по умолчанию письменности (ru, en)
+    лишь разрешает ничью; без собственных признаков lang=None, а не ru.
+    """
+    script, share = dominant_script(text)
+    if script is None:
+        return Detection(None, None, 0.0)
+    if script in _SCRIPT_LANGS:
+        return Detection(_SCRIPT_LANGS[script], script, share)
+
+    profiles = _PROFILES.get(script)
+    if not profiles:
+        return Detection(None, script, 0.0)
+
+    grams = _trigrams(text)
+    letters = set(text.lower())
+    scores: Dict[str, float] = {}
+    found: Dict[str, int] = {}
+    for lang, (top, marks) in profiles.items():
+        hits = sum(1 for g in grams if g in top)
+        marked = len(letters & marks)
+        # Характерная буква весит больше десятка совпавших триграмм
+        scores[lang] = hits / (len(grams) or 1) + 0.3 * marked
+        found[lang] = hits + bool(marked)
+    # Язык по умолчанию только разрешает ничью — в отрыв и уверенность он не входит
+    prior = _SCRIPT_PRIORS.get(script)
+    ranked = sorted(scores.items(), key=lambda kv: (kv[1], kv[0] == prior), reverse=True)
+    (best, top_score), second_score = ranked[0], ranked[1][1] if len(ranked) > 1 else 0.0
+    if top_score <= 0:
+        return Detection(None, script, 0.0)
+    if best == prior and found[best] < _PRIOR_MIN_EVIDENCE:
+        # Другой язык той же письменности, которого нет в профилях (mn, ky, ...)
+        return Detection(None, script, 0.0)
+    margin = (top_score - second_score) / top_score
+    # На коротком тексте (пара слов) уверенность ниже
+    evidence = min(1.0, len(grams) / 12)
+    return Detection(best, script, round(share * min(1.0, 0.5 + margin) * evidence, 3))
+
+
+__all__ = [
+    "Detection",
+    "LANG_NAMES",
+    "detect_language",
+    "dominant_script",
+]
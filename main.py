@@ -1,25 +1,42 @@
 # ... ваши импорты ...
 import logging
 import os
-import aiohttp
 import asyncio
 import time
 from pathlib import Path
 from aiogram import Bot, Dispatcher, types
-from aiogram.types import Message, FSInputFile
+from aiogram.types import BufferedInputFile, FSInputFile, Message, CallbackQuery
 from aiogram import Router, F
-from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
-from aiogram.fsm.storage.memory import MemoryStorage
+from user_store import content_sha256, open_store
+from user_cache import UserDataCache
+from doc_ingest import DocumentTooLarge, ingest_telegram_file
+from text_pager import PageCallback, render_page
+from webhook_server import serve
+from fsm_storage import create_storage, run_fsm_janitor
+from job_queue import JobQueue, QueueFull
+from scheduling import PriorityScheduler
+from flood_control import FloodControl
+from button_dispatch import ButtonDispatch
+from overload import NO_VOICE, REJECT, REJECT_TEXT, get_controller
+from send_limiter import SendRateLimiter
+from tracing import TelegramSpans, current_trace_id, setup_tracing, span
+from metrics import setup_bot_metrics
 
 # >>> ADD: импортируем pydub для конвертации и наш модуль voice
 from pydub import AudioSegment
 import voice_async
-from main2 import ai_response
+from main2 import RU_SKIP_CONFIDENCE, complete, translate_reply, translation_params, weather_report
+from doc_translate import ChunkFailed, estimate_tokens, split_for_translation, translate_chunks
+from lang_detect import detect_language
+from faq_index import FaqIndex
+from tg_file_cache import open_cache
+from disk_janitor import DiskJanitor
 
 # ---
 
@@ -34,17 +51,32 @@ load_dotenv()
 
 BASE_DIR = Path(__file__).parent.parent
 DATA_DIR = os.path.abspath(os.path.join(os.getcwd(), "data"))
-DOWNLOADS_DIR = os.path.abspath(os.path.join(os.getcwd(), "downloads"))
 AUDIO_DIR = os.path.abspath(os.path.join(os.getcwd(), "audio"))  # >>> ADD
+# Шарды (workers.py) пишут озвучку каждый в свой подкаталог: уборщик одного
+# шарда не должен удалять файлы, которые другой шард ещё отправляет
+if os.getenv("SHARD_INDEX"):
+    AUDIO_DIR = os.path.join(AUDIO_DIR, f"shard-{os.getenv('SHARD_INDEX')}")
 
 os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+
+# Предельный размер загружаемого .txt
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_KB", "2048")) * 1024
+# Минимальная оценка сходства вопроса с вопросом FAQ для ответа без LLM
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.6"))
+
+# Перевод документов: бюджет фрагмента в токенах, параллельность и предел размера
+TRANSLATE_CHUNK_TOKENS = int(os.getenv("TRANSLATE_CHUNK_TOKENS", "1000"))
+TRANSLATE_PARALLEL = int(os.getenv("TRANSLATE_PARALLEL", "4"))
+TRANSLATE_MAX_CHUNKS = int(os.getenv("TRANSLATE_MAX_CHUNKS", "60"))
+# Не чаще одного обновления прогресса в столько секунд
+TRANSLATE_PROGRESS_SEC = float(os.getenv("TRANSLATE_PROGRESS_SEC", "3"))
 os.makedirs(AUDIO_DIR, exist_ok=True)  # >>> ADD
 
+START_PHOTO_PATH = os.path.abspath(os.path.join(os.getcwd(), "img", "ФотоБот1.jpg"))
+
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 API_KEY = os.getenv("API_KEY")
 WEATHER_API_KEY = os.getenv("WEATHER_API_KEY")
-BASE_WEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
 
 if not TELEGRAM_BOT_TOKEN:
     logging.error("❌ TELEGRAM_BOT_TOKEN не найден в переменных окружения!")
@@ -56,7 +88,12 @@ if not WEATHER_API_KEY:
     logging.warning("⚠️ WEATHER_API_KEY не найден — функции погоды отключены.")
 
 bot = Bot(token=TELEGRAM_BOT_TOKEN)
-storage = MemoryStorage()
+# Спаны вызовов Bot API в трассе обновления (вместе с ожиданием лимитов отправки)
+bot.session.middleware(TelegramSpans())
+# Исходящие отправки — в пределах лимитов Telegram, RetryAfter обрабатывается централизованно
+send_limiter = SendRateLimiter.from_env()
+bot.session.middleware(send_limiter)
+storage = create_storage(DATA_DIR)
 dp = Dispatcher(storage=storage)
 router = Router()
 
@@ -65,7 +102,30 @@ client = AsyncOpenAI(
     base_url="https://api.openai.com/v1",
 )
 
-user_data = {}
+store = open_store(os.path.join(DATA_DIR, "users.db"))
+# Данные пользователей подгружаются из базы по запросу и держатся в LRU
+user_data = UserDataCache(store, max_bytes=int(os.getenv("USER_CACHE_MB", "64")) * 1024 * 1024)
+
+# Кеш file_id: повторные отправки того же содержимого идут без загрузки байтов
+# (общий с main2.py — один файл, один объект)
+file_ids = open_cache(os.path.join(DATA_DIR, "file_ids.json"))
+
+# Уборка audio/ по квоте и возрасту файлов (загрузки в downloads/ больше не пишутся);
+# при нескольких шардах квота делится между ними поровну
+janitor = DiskJanitor(
+    [AUDIO_DIR],
+    quota_bytes=int(os.getenv("FILES_QUOTA_MB", "200")) * 1024 * 1024
+    // max(1, int(os.getenv("SHARD_COUNT", "1"))),
+    max_age_seconds=float(os.getenv("FILES_MAX_AGE_HOURS", "24")) * 3600,
+    interval=float(os.getenv("JANITOR_INTERVAL_SEC", "300")),
+)
+
+# Очередь тяжёлых задач (озвучка, разбор документов): сохраняется в SQLite,
+# JOB_MAX_PENDING ограничивает число ожидающих задач
+jobs = JobQueue(
+    os.getenv("JOBS_DB_PATH") or os.path.join(DATA_DIR, "jobs.db"),
+    max_pending=int(os.getenv("JOB_MAX_PENDING", "200")),
+)
 
 # >>> ADD: вспомогательная функция конвертации mp3 -> ogg (opus)
 def mp3_to_ogg_opus(mp3_path: str, ogg_path: str) -> str:
@@ -79,59 +139,45 @@ def mp3_to_ogg_opus(mp3_path: str, ogg_path: str) -> str:
     return ogg_path
 # ---
 
-def restore_user_data():
-    """Восстанавливает данные пользователей из файлов"""
-    for file_name in os.listdir(DATA_DIR):
-        if not file_name.endswith('.txt'):
-            continue
-        try:
-            parts = file_name.replace('.txt', '').split('_')
-            if len(parts) != 2:
-                continue
-            data_type, user_id_str = parts
-            user_id = int(user_id_str)
-            file_path = os.path.join(DATA_DIR, file_name)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-
-            if user_id not in user_data:
-                user_data[user_id] = {"knowledge": "", "instruction": ""}
-            user_data[user_id][data_type] = content
-            logging.info(f"Восстановлены данные для user_id={user_id}, type={data_type}")
-        except Exception as e:
-            logging.error(f"Ошибка восстановления из файла {file_name}: {e}")
+async def restore_user_data():
+    """Переносит старые .txt в базу (один раз); сами данные читаются лениво через user_data"""
+    await store.migrate_from_dir(DATA_DIR)
 
 def process_text_file(file_path):
     # ... как у вас было ...
     pass
 
-def save_user_data(user_id: int, data_type: str, content: str):
-    """Сохраняет данные пользователя в файл"""
+def save_user_data(user_id: int, data_type: str, content: str, content_hash: str = None):
+    """Ставит данные пользователя в очередь записи в базу (сброс — фоновой задачей)"""
     if not content.strip():
         logging.warning("Попытка сохранить пустые данные.")
         return
 
-    file_path = os.path.join(DATA_DIR, f"{data_type}_{user_id}.txt")
+    store.put_later(user_id, data_type, content, content_hash)
+    logging.info(f"Данные поставлены на сохранение: user_id={user_id}, type={data_type}")
+
+async def load_user_data(user_id: int, data_type: str) -> str:
+    """Загружает данные пользователя из базы"""
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
-        logging.info(f"Данные сохранены: {file_path}")
+        return await store.get(user_id, data_type) or ""
     except Exception as e:
-        logging.error(f"Ошибка сохранения данных в файл {file_path}: {e}")
-
-def load_user_data(user_id: int, data_type: str) -> str:
-    """Загружает данные пользователя из файла"""
-    file_path = os.path.join(DATA_DIR, f"{data_type}_{user_id}.txt")
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-            logging.info(f"Данные загружены: {file_path}")
-            return content
-        except Exception as e:
-            logging.error(f"Ошибка чтения файла {file_path}: {e}")
+        logging.error(f"Ошибка чтения данных user_id={user_id}, type={data_type}: {e}")
     return ""
 
+async def index_faq(blob_hash: str, text: str) -> FaqIndex:
+    """Разбирает FAQ из базы знаний при загрузке; индекс общий для одинаковых баз"""
+    return await user_data.shared("faq", blob_hash, lambda: asyncio.to_thread(FaqIndex.build, text))
+
+async def faq_answer(user_id: int, question: str) -> str:
+    """Готовый ответ из FAQ пользователя, если вопрос достаточно близок; иначе пустая строка"""
+    faq = await user_data.shared_index(user_id, "knowledge", "faq", FaqIndex.build)
+    hit = faq.match(question, FAQ_MATCH_THRESHOLD) if faq else None
+    if not hit:
+        return ""
+    entry, score = hit
+    logging.info(f"FAQ: user_id={user_id}, оценка {score:.2f}, вопрос «{entry.question}»")
+    return entry.answer
+
 # --- Клавиатуры ---
 def main_keyboard():
     builder = ReplyKeyboardBuilder()
@@ -172,29 +218,61 @@ class TTS(StatesGroup):
     waiting_text = State()
 # ---
 
-@router.message(Command("start"))
+# Антифлуд: лимит частоты на пользователя и отбрасывание повторов (до планировщика)
+flood = FloodControl(
+    rate=float(os.getenv("FLOOD_RATE", "1")),
+    burst=int(os.getenv("FLOOD_BURST", "5")),
+    dup_window=float(os.getenv("FLOOD_DUP_WINDOW_SEC", "5")),
+    exempt_texts={"❌ Отмена"},
+)
+flood.setup(dp)
+
+# Очереди по приоритету: команды, меню и отмена не ждут генерации
+scheduler = PriorityScheduler(
+    control_texts={"❌ Отмена", "🎙️ Озвучка", "🌤️ Погода", "🌍 Перевод"},
+    heavy_states={Form.translate.state},
+    limits={
+        "light": int(os.getenv("LANE_LIGHT_CONCURRENCY", "16")),
+        "heavy": int(os.getenv("LANE_HEAVY_CONCURRENCY", "4")),
+    },
+)
+
+# Деградация под нагрузкой (общая с main2.ai_response ступень)
+overload = get_controller()
+overload.add_queue(lambda: sum(scheduler.waiting.values()) + jobs.pending)
+overload.setup(dp, classify=scheduler.classify)
+scheduler.setup(dp)
+
+# Кнопки и команды — одним поиском в таблице (регистрируется последним)
+buttons = ButtonDispatch()
+buttons.setup(dp)
+
+# Метрики Prometheus: /metrics на порту контейнера (см. metrics.py)
+registry = setup_bot_metrics(dp, storage, overload=overload, scheduler=scheduler,
+                             flood=flood, buttons=buttons, send_limiter=send_limiter)
+# Трассы обновлений: медленные и выборочные — в data/traces.jsonl (см. tracing.py)
+setup_tracing(dp)
+registry.track_cache("user_data", user_data)
+registry.track_cache("file_ids", file_ids)
+registry.gauge_func("bot_jobs", "Фоновые задачи по состоянию",
+                    lambda: {("pending",): jobs.pending, ("running",): jobs.running}, ("status",))
+
+@buttons.message("/start")
 async def start_command(message: Message, state: FSMContext):
     try:
         # Подтягиваем голоса и показываем выбор
         voices = await voice_async.get_all_voices()  # [{'name','id'},...]
-        # Сохраним соответствие имя->id в состоянии для конкретного юзера
-        await state.update_data(voices_map={v["name"]: v["id"] for v in voices})
+        # Список голосов общий для всех — в состоянии пользователя его не храним
         await state.set_state(TTS.choosing_voice)
 
-        photo = None
-        try:
-            photo = FSInputFile('img/ФотоБот1.jpg')
-        except Exception:
-            pass
-
         text = (
             "Привет! Я ваш AI-помощник. Выберите голос для озвучки, а затем пришлите текст.\n\n"
             "Сначала выберите голос:"
         )
 
-        if photo:
-            await message.answer_photo(
-                photo=photo,
+        if os.path.exists(START_PHOTO_PATH):
+            await file_ids.send(
+                message.answer_photo, "photo", START_PHOTO_PATH,
                 caption=text,
                 reply_markup=voices_keyboard(voices)
             )
@@ -205,11 +283,10 @@ async def start_command(message: Message, state: FSMContext):
         await message.answer("Добро пожаловать! Чем могу помочь?", reply_markup=main_keyboard())
 
 # >>> ADD: отдельная кнопка из главного меню для озвучки
-@dp.message(F.text == "🎙️ Озвучка")
+@buttons.message("🎙️ Озвучка")
 async def tts_entry(message: Message, state: FSMContext):
     try:
         voices = await voice_async.get_all_voices()
-        await state.update_data(voices_map={v["name"]: v["id"] for v in voices})
         await state.set_state(TTS.choosing_voice)
         await message.answer("Выберите голос:", reply_markup=voices_keyboard(voices))
     except Exception as e:
@@ -218,138 +295,119 @@ async def tts_entry(message: Message, state: FSMContext):
 # ---
 
 @dp.message(F.document)
-async def handle_document(message: Message):
+async def handle_document(message: Message, state: FSMContext):
     if not message.document.file_name.endswith('.txt'):
         await message.answer("⚠ Принимаются только текстовые файлы (.txt)")
         return
 
-    try:
-        file_info = await bot.get_file(message.document.file_id)
-        file_name = f"{message.from_user.id}_{file_info.file_path.split('/')[-1]}"
-        file_path = Path(DOWNLOADS_DIR) / file_name
-        await bot.download_file(file_info.file_path, destination=file_path)
-
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-
-        if not content:
-            await message.answer("❌ Файл пустой.")
-            return
-
-        user_id = message.from_user.id
-        filename = message.document.file_name.lower()
+    filename = message.document.file_name.lower()
+    translating = await state.get_state() == Form.translate.state
+
+    if translating or "перевод" in filename:
+        data_type = "translate"
+    elif "инструкция" in filename:
+        data_type = "instruction"
+    elif "база" in filename:
+        data_type = "knowledge"
+    else:
+        await message.answer("⚠ Название файла должно содержать 'инструкция', 'база' или 'перевод'.")
+        return
 
-        if "инструкция" in filename:
-            data_type = "instruction"
-            reply_text = "✅ Инструкция обновлена!"
-        elif "база" in filename:
-            data_type = "knowledge"
-            reply_text = "✅ База знаний обновлена!"
-        else:
-            await message.answer("⚠ Название файла должно содержать 'инструкция' или 'база'.")
-            return
+    if message.document.file_size and message.document.file_size > MAX_UPLOAD_BYTES:
+        await message.answer(f"⚠ Файл слишком большой (максимум {MAX_UPLOAD_BYTES // 1024} КБ).")
+        return
 
-        if user_id not in user_data:
-            user_data[user_id] = {"knowledge": "", "instruction": ""}
-        user_data[user_id][data_type] = content
-        save_user_data(user_id, data_type, content)
+    if data_type == "translate":
+        if await submit_job(message, "translate_doc", "⏳ Файл получен, перевожу…", {
+            "file_id": message.document.file_id,
+            "file_size": message.document.file_size,
+            "file_name": message.document.file_name,
+        }) and translating:
+            await state.clear()
+        return
 
-        await message.answer(reply_text)
-    except Exception as e:
-        logging.error(f"Ошибка обработки документа: {e}")
-        await message.answer("⚠ Ошибка при загрузке файла.")
+    # Скачивание и разбор — в фоновой задаче, обработчик сразу освобождается
+    await submit_job(message, "document", "⏳ Файл получен, обрабатываю…", {
+        "file_id": message.document.file_id,
+        "file_size": message.document.file_size,
+        "data_type": data_type,
+    })
 
-@dp.message(Command("instruction"))
+@buttons.message("/instruction")
 async def show_instruction(message: Message):
-    user_id = message.from_user.id
-    instruction = user_data.get(user_id, {}).get("instruction", "Не загружена.")
-    await message.answer(f"Ваша инструкция:\n{instruction}")
+    text, markup = await render_page(store, user_data, message.from_user.id, "instruction")
+    await message.answer(text, reply_markup=markup)
 
-@dp.message(Command("knowledge"))
+@buttons.message("/knowledge")
 async def show_knowledge(message: Message):
-    user_id = message.from_user.id
-    knowledge = user_data.get(user_id, {}).get("knowledge", "Не загружена.")
-    await message.answer(f"Ваша база знаний:\n{knowledge}")
+    text, markup = await render_page(store, user_data, message.from_user.id, "knowledge")
+    await message.answer(text, reply_markup=markup)
 
-@dp.message(F.text == "❌ Отмена")
+@dp.callback_query(PageCallback.filter())
+async def turn_page(callback: CallbackQuery, callback_data: PageCallback):
+    text, markup = await render_page(
+        store, user_data, callback.from_user.id, callback_data.data_type, callback_data.page
+    )
+    try:
+        await callback.message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest:
+        # «message is not modified» — нажали на текущую страницу
+        pass
+    await callback.answer()
+
+@buttons.message("❌ Отмена")
 async def cancel_handler(message: Message, state: FSMContext):
+    user_id = message.from_user.id
+    # Прерываем тяжёлые обработчики и фоновые задачи пользователя
+    stopped = scheduler.cancel_user(user_id)
+    for job in await jobs.cancel_user(user_id):
+        await edit_status(job, "❌ Отменено.")
+        stopped += 1
+
     await state.clear()
-    await message.answer("Действие отменено", reply_markup=main_keyboard())
+    if stopped:
+        await message.answer(f"Действие отменено (остановлено задач: {stopped})", reply_markup=main_keyboard())
+    else:
+        await message.answer("Действие отменено", reply_markup=main_keyboard())
 
-@dp.message(F.text == "🌤️ Погода")
+@buttons.message("🌤️ Погода")
 async def weather_handler(message: Message, state: FSMContext):
     await state.set_state(Form.weather)
     await message.answer("Введите название города:", reply_markup=cancel_keyboard())
 
-@dp.message(F.text == "🌍 Перевод")
+@buttons.message("🌍 Перевод")
 async def translate_handler(message: Message, state: FSMContext):
     await state.set_state(Form.translate)
-    await message.answer("Введите текст для перевода:", reply_markup=cancel_keyboard())
+    await message.answer("Введите текст для перевода или пришлите .txt-файл:", reply_markup=cancel_keyboard())
 
 
 # --- Обработка погоды ---
 @dp.message(Form.weather)
 async def get_weather(message: Message, state: FSMContext):
-    city = message.text
-    if not WEATHER_API_KEY:
-        await message.answer("⚠️ Сервис погоды временно недоступен.")
-        await state.clear()
-        await message.answer("Выберите действие:", reply_markup=main_keyboard())
-        return
-
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{BASE_WEATHER_URL}?q={city}&appid={WEATHER_API_KEY}&units=metric&lang=ru"
-            ) as response:
-                data = await response.json()
-                if response.status != 200:
-                    await message.answer(f"❌ Ошибка: {data.get('message', 'Город не найден')}")
-                    return
-
-                weather = data["weather"][0]["description"].capitalize()
-                temp = data["main"]["temp"]
-                humidity = data["main"]["humidity"]
-                wind = data["wind"]["speed"]
-
-                response_text = (
-                    f"🌤 Погода в {city}:\n"
-                    f"{weather}\n"
-                    f"🌡 Температура: {temp}°C\n"
-                    f"💧 Влажность: {humidity}%\n"
-                    f"🍃 Ветер: {wind} м/с"
-                )
-                await message.answer(response_text)
-    except Exception as e:
-        logging.error(f"Ошибка погоды: {e}")
-        await message.answer("⚠️ Не удалось получить погоду.")
-    finally:
-        await state.clear()
-        await message.answer("Выберите действие:", reply_markup=main_keyboard())
+    report = await weather_report(message.text)
+    await state.clear()
+    # Результат и приглашение к следующему действию — одним сообщением
+    await message.answer(f"{report}\n\nВыберите действие:", reply_markup=main_keyboard())
 
 # --- Обработка перевода ---
 @dp.message(Form.translate)
 async def translate_text(message: Message, state: FSMContext):
-    text = message.text
-    system_prompt = "Переведи текст на русский язык. Сохрани смысл и стиль. Без пояснений."
-
-    await ai_response(message, system_prompt, text)
     await state.clear()
-    await message.answer("Выберите действие:", reply_markup=main_keyboard())
+    # Язык определяется локально: русский текст не уходит в LLM, модель — по языку
+    await translate_reply(message, message.text, reply_markup=main_keyboard())
 
 # >>> ADD: выбор голоса (состояние TTS.choosing_voice)
 @dp.message(TTS.choosing_voice)
 async def choose_voice(message: Message, state: FSMContext):
-    user_choice = message.text.strip()
-    data = await state.get_data()
-    voices_map = data.get("voices_map", {})
+    user_choice = (message.text or "").strip()
+    voice_idx = voice_async.voice_index(user_choice)
 
-    if user_choice not in voices_map:
+    if voice_idx is None:
         await message.answer("Пожалуйста, выберите голос кнопкой на клавиатуре или нажмите «❌ Отмена».")
         return
 
-    voice_id = voices_map[user_choice]
-    await state.update_data(selected_voice_id=voice_id, selected_voice_name=user_choice)
+    # В FSM — только номер голоса; id и имя берутся из общего списка
+    await state.set_data({"voice": voice_idx})
     await state.set_state(TTS.waiting_text)
     await message.answer(
         f"✅ Голос «{user_choice}» выбран.\nТеперь отправьте текст, который нужно озвучить.",
@@ -365,84 +423,302 @@ async def tts_generate_and_send(message: Message, state: FSMContext):
         return
 
     data = await state.get_data()
-    voice_id = data.get("selected_voice_id")
-    voice_name = data.get("selected_voice_name", "voice")
-
-    if not voice_id:
+    if not voice_async.voice_by_index(data.get("voice")):
         await message.answer("Не найден выбранный голос. Начните заново: /start")
         await state.clear()
         return
 
+    # Генерация идёт в фоне; при переполнении очереди остаёмся в ожидании текста
+    if await submit_job(message, "tts", "⏳ Текст принят, озвучиваю…", {
+        "text": text,
+        "voice": data.get("voice"),
+    }):
+        await state.clear()
+
+# --- Фоновые задачи ---
+async def submit_job(message: Message, kind: str, status_text: str, payload: dict) -> bool:
+    """Отвечает статусным сообщением и ставит задачу в очередь; False — задача не принята (перегрузка)"""
+    if overload.level >= REJECT:
+        await message.answer(REJECT_TEXT)
+        return False
+
     try:
-        # Уникальные ИМЕНА ФАЙЛОВ + абсолютные пути
-        base = f"{message.from_user.id}_{time.time_ns()}"
-        mp3_path = os.path.abspath(os.path.join(AUDIO_DIR, f"{base}.mp3"))
-        ogg_path = os.path.abspath(os.path.join(AUDIO_DIR, f"{base}.ogg"))
+        status = await message.answer(status_text)
+        await jobs.submit(kind, {
+            "chat_id": message.chat.id,
+            "user_id": message.from_user.id,
+            "status_id": status.message_id,
+            "trace_id": current_trace_id(),
+            **payload,
+        }, user_id=message.from_user.id)
+    except QueueFull:
+        logging.warning(f"Очередь задач переполнена, задача {kind} отклонена")
+        await status.edit_text("⚠️ Сейчас слишком много запросов. Попробуйте через минуту.")
+        return False
+    return True
+
+async def edit_status(job: dict, text: str, **kwargs):
+    """Обновляет статусное сообщение задачи; если оно недоступно — пишет новое"""
+    try:
+        await bot.edit_message_text(text, chat_id=job["chat_id"], message_id=job["status_id"], **kwargs)
+    except TelegramBadRequest:
+        await bot.send_message(job["chat_id"], text, **kwargs)
 
-        # 1) Генерация MP3 (ИМЕННО в mp3_path, а не 'audio.mp3')
-        await voice_async.generate_audio(text=text, voice_id=voice_id, out_name=mp3_path)
+async def ingest_job_file(job: dict):
+    """Загружает .txt задачи; None — ошибка уже показана в статусном сообщении"""
+    try:
+        # Файл читается потоком в память (без копии в downloads/) с ограничением размера
+        doc = await ingest_telegram_file(
+            bot, job["file_id"],
+            file_size=job["file_size"],
+            max_bytes=MAX_UPLOAD_BYTES,
+        )
+    except DocumentTooLarge:
+        await edit_status(job, f"⚠ Файл слишком большой (максимум {MAX_UPLOAD_BYTES // 1024} КБ).")
+        return None
+    except Exception as e:
+        logging.error(f"Ошибка обработки документа: {e}")
+        await edit_status(job, "⚠ Ошибка при загрузке файла.")
+        return None
+
+    if not doc.text:
+        await edit_status(job, "❌ Файл пустой.")
+        return None
+    return doc
+
+async def run_document_job(job: dict):
+    user_id, data_type = job["user_id"], job["data_type"]
+    doc = await ingest_job_file(job)
+    if doc is None:
+        return
 
-        # 2) Проверяем, что файл реально создан
-        if not os.path.exists(mp3_path) or os.path.getsize(mp3_path) == 0:
-            logging.error(f"MP3 не создан: {mp3_path}")
-            await message.answer("⚠️ Не удалось сохранить аудио-файл. Попробуйте ещё раз.")
-            return
+    if doc.sha256 == await store.get_hash(user_id, data_type):
+        await edit_status(job, "ℹ️ Этот файл уже загружен — изменений нет.")
+        return
+
+    logging.info(
+        f"Документ user_id={user_id}, type={data_type}: {doc.size} байт, "
+        f"{doc.encoding}, абзацев {doc.paragraphs}"
+    )
+    user_data.put(user_id, data_type, doc.text, doc.sha256)
+    save_user_data(user_id, data_type, doc.text, doc.sha256)
+    if data_type == "knowledge":
+        # Индекс по хэшу новой базы: старый больше не найдётся и вытеснится из LRU
+        await index_faq(doc.sha256, doc.text)
+
+    if data_type == "instruction":
+        await edit_status(job, "✅ Инструкция обновлена!")
+    else:
+        await edit_status(job, "✅ База знаний обновлена!")
+
+async def run_translate_doc_job(job: dict):
+    chat_id = job["chat_id"]
+    doc = await ingest_job_file(job)
+    if doc is None:
+        return
+
+    # Язык определяем по началу документа — этого достаточно и быстро
+    detected = detect_language(doc.text[:4000])
+    if detected.lang == "ru" and detected.confidence >= RU_SKIP_CONFIDENCE:
+        await edit_status(job, "ℹ️ Документ уже на русском — переводить нечего.")
+        return
 
-        # 3) Конвертация в OGG (Opus) для voice
-        try:
-            mp3_to_ogg_opus(mp3_path, ogg_path)
-        except Exception as conv_err:
-            logging.error(f"OGG convert error: {conv_err}")
-            await message.answer("Аудио создано, но не удалось сделать голосовое. Отправляю только mp3.")
-
-        # 4) Отправляем MP3
-        await message.answer_audio(
-            audio=FSInputFile(mp3_path),
-            caption=f"🎧 Озвучка голосом {voice_name}",
+    chunks = split_for_translation(doc.text, TRANSLATE_CHUNK_TOKENS)
+    if len(chunks) > TRANSLATE_MAX_CHUNKS:
+        await edit_status(
+            job, f"⚠ Документ слишком большой для перевода (фрагментов {len(chunks)}, максимум {TRANSLATE_MAX_CHUNKS})."
         )
+        return
+
+    system_prompt, model = translation_params(detected)
+    logging.info(
+        f"Перевод документа user_id={job['user_id']}: {doc.size} байт, "
+        f"язык {detected.lang}, фрагментов {len(chunks)}"
+    )
+
+    async def translate(text: str) -> str:
+        # Русский текст обычно длиннее в токенах, чем исходный
+        return await complete(system_prompt, text, model=model,
+                              max_tokens=estimate_tokens(text) * 2, temperature=0.3)
+
+    last_update = time.monotonic()
+
+    async def on_progress(done: int, total: int):
+        nonlocal last_update
+        now = time.monotonic()
+        if done < total and now - last_update >= TRANSLATE_PROGRESS_SEC:
+            last_update = now
+            await edit_status(job, f"⏳ Перевожу… {done}/{total} фрагментов")
+
+    await edit_status(job, f"⏳ Перевожу… 0/{len(chunks)} фрагментов")
+    try:
+        parts = await translate_chunks(
+            chunks, translate,
+            concurrency=TRANSLATE_PARALLEL,
+            on_progress=on_progress,
+        )
+    except ChunkFailed as e:
+        logging.error(f"Ошибка перевода документа: {e}")
+        await edit_status(job, "⚠️ Не удалось перевести документ. Попробуйте позже.")
+        await bot.send_message(chat_id, "Выберите следующее действие:", reply_markup=main_keyboard())
+        return
+
+    stem = os.path.splitext(job["file_name"])[0]
+    await bot.send_document(
+        chat_id,
+        BufferedInputFile("".join(parts).encode("utf-8"), filename=f"{stem}_ru.txt"),
+        caption=f"🌍 Перевод ({detected.name} → русский), фрагментов: {len(chunks)}",
+        reply_markup=main_keyboard(),
+    )
+    await edit_status(job, "✅ Перевод готов.")
 
-        # 5) Если получилось — отправляем и voice (OGG)
-        if os.path.exists(ogg_path) and os.path.getsize(ogg_path) > 0:
-            await message.answer_voice(
-                voice=FSInputFile(ogg_path),
+def tts_cache_key(voice_id: str, text: str, kind: str) -> str:
+    """Ключ file_id озвучки: тот же голос и тот же текст дают тот же файл"""
+    return f"tts:{voice_id}:{content_sha256(text)}:{kind}"
+
+async def run_tts_job(job: dict):
+    chat_id = job["chat_id"]
+    voice = voice_async.voice_by_index(job["voice"])
+    if not voice:
+        await edit_status(job, "Не найден выбранный голос. Начните заново: /start")
+        return
+
+    voice_id, voice_name = voice["id"], voice["name"]
+    want_voice = overload.level < NO_VOICE
+    mp3_key = tts_cache_key(voice_id, job["text"], "mp3")
+    ogg_key = tts_cache_key(voice_id, job["text"], "ogg")
+
+    try:
+        # 0) Та же озвучка уже отправлялась — шлём по file_id, без генерации
+        mp3_sent = False
+        if file_ids.get(mp3_key) and (not want_voice or file_ids.get(ogg_key)):
+            mp3_sent = await file_ids.send_cached(
+                bot.send_audio, "audio", mp3_key,
+                chat_id=chat_id,
+                caption=f"🎧 Озвучка голосом {voice_name}",
+                reply_markup=None if want_voice else main_keyboard(),
+            ) is not None
+            if mp3_sent and (not want_voice or await file_ids.send_cached(
+                bot.send_voice, "voice", ogg_key,
+                chat_id=chat_id,
                 caption=f"🎙️ Голосовое (Opus) — {voice_name}",
-            )
+                reply_markup=main_keyboard(),
+            )):
+                await edit_status(job, f"✅ Озвучка голосом {voice_name} готова.")
+                return
+
+        # Уникальные ИМЕНА ФАЙЛОВ + абсолютные пути
+        base = f"{job['user_id']}_{time.time_ns()}"
+        mp3_path = os.path.abspath(os.path.join(AUDIO_DIR, f"{base}.mp3"))
+        ogg_path = os.path.abspath(os.path.join(AUDIO_DIR, f"{base}.ogg"))
+
+        # Файлы закреплены, чтобы уборка не удалила их во время отправки
+        with janitor.pin(mp3_path, mp3_path + ".part", ogg_path):
+            # 1) Генерация MP3 (ИМЕННО в mp3_path, а не 'audio.mp3')
+            await voice_async.generate_audio(text=job["text"], voice_id=voice_id, out_name=mp3_path)
+
+            # 2) Проверяем, что файл реально создан
+            if not os.path.exists(mp3_path) or os.path.getsize(mp3_path) == 0:
+                logging.error(f"MP3 не создан: {mp3_path}")
+                await edit_status(job, "⚠️ Не удалось сохранить аудио-файл. Попробуйте ещё раз.")
+                await bot.send_message(chat_id, "Выберите следующее действие:", reply_markup=main_keyboard())
+                return
+
+            # 3) Конвертация в OGG (Opus) для voice; под нагрузкой — только mp3
+            try:
+                if want_voice:
+                    with span("mp3_to_ogg_opus"):
+                        await asyncio.to_thread(mp3_to_ogg_opus, mp3_path, ogg_path)
+            except Exception as conv_err:
+                logging.error(f"OGG convert error: {conv_err}")
+                await bot.send_message(chat_id, "Аудио создано, но не удалось сделать голосовое. Отправляю только mp3.")
+
+            # Клавиатура меню едет с последним файлом — без отдельного «Готово»
+            has_voice = os.path.exists(ogg_path) and os.path.getsize(ogg_path) > 0
+
+            # 4) Отправляем MP3 (если он ещё не ушёл из кеша); file_id запоминается
+            #    по голосу и тексту — повтор той же озвучки не генерируется заново
+            if not mp3_sent:
+                await file_ids.send(
+                    bot.send_audio, "audio", mp3_path,
+                    key=mp3_key,
+                    chat_id=chat_id,
+                    caption=f"🎧 Озвучка голосом {voice_name}",
+                    reply_markup=None if has_voice else main_keyboard(),
+                )
+
+            # 5) Если получилось — отправляем и voice (OGG)
+            if has_voice:
+                await file_ids.send(
+                    bot.send_voice, "voice", ogg_path,
+                    key=ogg_key,
+                    chat_id=chat_id,
+                    caption=f"🎙️ Голосовое (Opus) — {voice_name}",
+                    reply_markup=main_keyboard(),
+                )
+            elif mp3_sent:
+                # mp3 ушёл из кеша без клавиатуры, а голосовое не получилось
+                await bot.send_message(chat_id, "Выберите следующее действие:", reply_markup=main_keyboard())
+
+        await edit_status(job, f"✅ Озвучка голосом {voice_name} готова.")
+        return
 
     except Exception as e:
         logging.error(f"TTS error: {e}", exc_info=True)
         msg = str(e)
         if "detected_unusual_activity" in msg:
-            await message.answer(
+            await edit_status(
+                job,
                 "❌ ElevenLabs заблокировал Free-тариф (detected_unusual_activity). "
                 "Подключите платную подписку или используйте другой ключ/движок."
             )
         elif "voice_not_found" in msg or "404" in msg:
-            await message.answer(
-                "⚠️ Этот голос сейчас недоступен. Пожалуйста, выберите другой голос."
-            )
+            await edit_status(job, "⚠️ Этот голос сейчас недоступен. Пожалуйста, выберите другой голос.")
             voices = await voice_async.get_all_voices()
-            await state.update_data(voices_map={v["name"]: v["id"] for v in voices})
+            state = dp.fsm.get_context(bot, chat_id=chat_id, user_id=job["user_id"])
+            await state.set_data({})
             await state.set_state(TTS.choosing_voice)
-            await message.answer("Выберите голос:", reply_markup=voices_keyboard(voices))
+            await bot.send_message(chat_id, "Выберите голос:", reply_markup=voices_keyboard(voices))
             return
         else:
-            await message.answer("Не удалось сгенерировать аудио. Проверьте ключ/подписку ElevenLabs.")
-    finally:
-        # Возвращаемся в главное меню только если не остались в выборе голоса
-        curr = await state.get_state()
-        if curr != TTS.choosing_voice:
-            await state.clear()
-            await message.answer("Готово. Выберите следующее действие:", reply_markup=main_keyboard())
+            await edit_status(job, "Не удалось сгенерировать аудио. Проверьте ключ/подписку ElevenLabs.")
+
+    await bot.send_message(chat_id, "Готово. Выберите следующее действие:", reply_markup=main_keyboard())
+
+jobs.register("document", run_document_job, concurrency=int(os.getenv("JOB_DOCUMENT_CONCURRENCY", "4")))
+jobs.register("translate_doc", run_translate_doc_job, concurrency=int(os.getenv("JOB_TRANSLATE_CONCURRENCY", "2")))
+jobs.register("tts", run_tts_job, concurrency=int(os.getenv("JOB_TTS_CONCURRENCY", "2")))
 
 @router.message()
 async def handle_message(message: Message):
+    # Вопрос из FAQ базы знаний — отвечаем сохранённым ответом
+    if message.text:
+        answer = await faq_answer(message.from_user.id, message.text)
+        if answer:
+            await message.answer(answer)
+            return
     # ... ваш существующий обработчик чата с OpenAI ...
     pass
 
-async def main():
+async def main(run=serve):
+    """run(dp, bot) — способ получения обновлений: webhook/polling или очередь воркера (workers.py)"""
     dp.include_router(router)
-    await dp.start_polling(bot)
+    await restore_user_data()
+    janitor_task = asyncio.create_task(janitor.run())
+    flusher_task = asyncio.create_task(store.run_flusher(float(os.getenv("STORE_FLUSH_SEC", "2"))))
+    fsm_janitor_task = asyncio.create_task(run_fsm_janitor(storage))
+    await jobs.start()
+    overload_task = asyncio.create_task(overload.run())
+    try:
+        await run(dp, bot)
+    finally:
+        overload_task.cancel()
+        await jobs.stop()
+        fsm_janitor_task.cancel()
+        flusher_task.cancel()
+        janitor_task.cancel()
+        await file_ids.flush()
+        await store.close()
 
 if __name__ == "__main__":
-    restore_user_data()
     asyncio.run(main())
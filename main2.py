@@ -1,18 +1,35 @@
 import logging
 import os
+import re
 import aiohttp
 import asyncio
 from pathlib import Path
 from aiogram import Bot, Dispatcher, types
-from aiogram.types import Message, FSInputFile
+from aiogram.types import Message, CallbackQuery
 from aiogram import Router, F
-from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, RateLimitError
 from dotenv import load_dotenv
-from aiogram.fsm.storage.memory import MemoryStorage
+from user_store import open_store
+from user_cache import UserDataCache
+from doc_ingest import DocumentTooLarge, ingest_telegram_file
+from text_pager import PageCallback, render_page
+from webhook_server import serve
+from fsm_storage import create_storage, run_fsm_janitor
+from scheduling import PriorityScheduler
+from flood_control import FloodControl
+from button_dispatch import ButtonDispatch
+from overload import BUSY_TEXT, CACHED_ONLY, AnswerCache, get_controller
+from send_limiter import RateLimiter, SendRateLimiter
+from intent_router import CHAT, TRANSLATE, WEATHER, IntentRouter, city_candidates
+from faq_index import FaqIndex
+from tg_file_cache import open_cache
+from lang_detect import Detection, detect_language
+from tracing import TelegramSpans, setup_tracing
+from metrics import setup_bot_metrics, upstream
 
 # Настройка логирования
 logging.basicConfig(
@@ -27,10 +44,11 @@ load_dotenv()
 # Настройка путей
 BASE_DIR = Path(__file__).parent
 DATA_DIR = os.path.abspath(os.path.join(os.getcwd(), "data"))
-DOWNLOADS_DIR = os.path.abspath(os.path.join(os.getcwd(), "downloads"))
 
 os.makedirs(DATA_DIR, exist_ok=True)
-os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+
+# Предельный размер загружаемого .txt
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_KB", "2048")) * 1024
 
 # Переменные окружения
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -54,7 +72,12 @@ if not WEATHER_API_KEY:
 
 # Создание бота
 bot = Bot(token=TELEGRAM_BOT_TOKEN)
-storage = MemoryStorage()
+# Спаны вызовов Bot API в трассе обновления (вместе с ожиданием лимитов отправки)
+bot.session.middleware(TelegramSpans())
+# Исходящие отправки — в пределах лимитов Telegram, RetryAfter обрабатывается централизованно
+send_limiter = SendRateLimiter.from_env()
+bot.session.middleware(send_limiter)
+storage = create_storage(DATA_DIR)
 dp = Dispatcher(storage=storage)
 router = Router()
 
@@ -65,59 +88,86 @@ client = AsyncOpenAI(
     # base_url="https://api.groq.com/openai/v1",  # Для Groq
     # base_url="http://localhost:11434/v1",       # Для Ollama
 )
+# Общий лимит запросов к LLM на процесс: ответы чата и фрагменты перевода документов
+llm_limiter = RateLimiter(
+    float(os.getenv("LLM_RATE", "5")),
+    burst=int(os.getenv("LLM_BURST", "5")),
+)
+
+# Насколько вопрос должен совпасть с вопросом из FAQ, чтобы ответить без LLM (0..1)
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.6"))
+
+# Сколько символов базы знаний попадает в системный промпт
+PROMPT_KNOWLEDGE_CHARS = int(os.getenv("PROMPT_KNOWLEDGE_CHARS", "7000"))
+_WORD_RE = re.compile(r"\w{3,}")
 
 # Хранилище данных пользователей
-user_data = {}
+store = open_store(os.path.join(DATA_DIR, "users.db"))
+# Данные пользователей подгружаются из базы по запросу и держатся в LRU
+user_data = UserDataCache(store, max_bytes=int(os.getenv("USER_CACHE_MB", "64")) * 1024 * 1024)
 
-def restore_user_data():
-    """Восстанавливает данные пользователей из файлов"""
-    for file_name in os.listdir(DATA_DIR):
-        if not file_name.endswith('.txt'):
-            continue
-        try:
-            parts = file_name.replace('.txt', '').split('_')
-            if len(parts) != 2:
-                continue
-            data_type, user_id_str = parts
-            user_id = int(user_id_str)
-            file_path = os.path.join(DATA_DIR, file_name)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-
-            if user_id not in user_data:
-                user_data[user_id] = {"knowledge": "", "instruction": ""}
-            user_data[user_id][data_type] = content
-            logging.info(f"Восстановлены данные для user_id={user_id}, type={data_type}")
-        except Exception as e:
-            logging.error(f"Ошибка восстановления из файла {file_name}: {e}")
+async def restore_user_data():
+    """Переносит старые .txt в базу (один раз); сами данные читаются лениво через user_data"""
+    await store.migrate_from_dir(DATA_DIR)
 
-def save_user_data(user_id: int, data_type: str, content: str):
-    """Сохраняет данные пользователя в файл"""
+def save_user_data(user_id: int, data_type: str, content: str, content_hash: str = None):
+    """Ставит данные пользователя в очередь записи в базу (сброс — фоновой задачей)"""
     if not content.strip():
         logging.warning("Попытка сохранить пустые данные.")
         return
 
-    file_path = os.path.join(DATA_DIR, f"{data_type}_{user_id}.txt")
+    store.put_later(user_id, data_type, content, content_hash)
+    logging.info(f"Данные поставлены на сохранение: user_id={user_id}, type={data_type}")
+
+async def load_user_data(user_id: int, data_type: str) -> str:
+    """Загружает данные пользователя из базы"""
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
-        logging.info(f"Данные сохранены: {file_path}")
+        return await store.get(user_id, data_type) or ""
     except Exception as e:
-        logging.error(f"Ошибка сохранения данных в файл {file_path}: {e}")
-
-def load_user_data(user_id: int, data_type: str) -> str:
-    """Загружает данные пользователя из файла"""
-    file_path = os.path.join(DATA_DIR, f"{data_type}_{user_id}.txt")
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-            logging.info(f"Данные загружены: {file_path}")
-            return content
-        except Exception as e:
-            logging.error(f"Ошибка чтения файла {file_path}: {e}")
+        logging.error(f"Ошибка чтения данных user_id={user_id}, type={data_type}: {e}")
     return ""
 
+async def knowledge_for_prompt(user_id: int, query: str, limit: int = PROMPT_KNOWLEDGE_CHARS) -> str:
+    """
+    Фрагменты базы знаний, ближе всего подходящие к вопросу, в пределах limit символов.
+    Распаковываются только выбранные фрагменты; полный текст в память не поднимается.
+    """
+    blob_hash = (await user_data.get_refs(user_id)).get("knowledge")
+    if not blob_hash:
+        return ""
+
+    async def load_terms():
+        count = await store.chunk_count(blob_hash)
+        return [set(_WORD_RE.findall((await store.read_chunk(blob_hash, i) or "").lower())) for i in range(count)]
+
+    chunk_terms = await user_data.shared("chunk_terms", blob_hash, load_terms)
+    query_terms = set(_WORD_RE.findall(query.lower()))
+    # Самые релевантные фрагменты; при равенстве — в порядке следования
+    ranked = sorted(range(len(chunk_terms)), key=lambda i: (-len(chunk_terms[i] & query_terms), i))
+
+    selected, total = {}, 0
+    for i in ranked:
+        chunk = await store.read_chunk(blob_hash, i) or ""
+        if selected and total + len(chunk) > limit:
+            break
+        selected[i] = chunk
+        total += len(chunk)
+    return "".join(selected[i] for i in sorted(selected))
+
+async def index_faq(blob_hash: str, text: str) -> FaqIndex:
+    """Разбирает FAQ из базы знаний при загрузке; индекс общий для одинаковых баз"""
+    return await user_data.shared("faq", blob_hash, lambda: asyncio.to_thread(FaqIndex.build, text))
+
+async def faq_answer(user_id: int, question: str) -> str:
+    """Готовый ответ из FAQ пользователя, если вопрос достаточно близок; иначе пустая строка"""
+    faq = await user_data.shared_index(user_id, "knowledge", "faq", FaqIndex.build)
+    hit = faq.match(question, FAQ_MATCH_THRESHOLD) if faq else None
+    if not hit:
+        return ""
+    entry, score = hit
+    logging.info(f"FAQ: user_id={user_id}, оценка {score:.2f}, вопрос «{entry.question}»")
+    return entry.answer
+
 # --- Клавиатуры ---
 def main_keyboard():
     builder = ReplyKeyboardBuilder()
@@ -138,14 +188,75 @@ class Form(StatesGroup):
     weather = State()
     translate = State()
 
+# Антифлуд: лимит частоты на пользователя и отбрасывание повторов (до планировщика)
+flood = FloodControl(
+    rate=float(os.getenv("FLOOD_RATE", "1")),
+    burst=int(os.getenv("FLOOD_BURST", "5")),
+    dup_window=float(os.getenv("FLOOD_DUP_WINDOW_SEC", "5")),
+    exempt_texts={"❌ Отмена"},
+)
+flood.setup(dp)
+
+# Очереди по приоритету: меню и отмена не ждут LLM-запросов
+scheduler = PriorityScheduler(
+    control_texts={"❌ Отмена", "🌤️ Погода", "🌍 Перевод", "❓ Спросить"},
+    heavy_states={Form.translate.state},
+    limits={
+        "light": int(os.getenv("LANE_LIGHT_CONCURRENCY", "16")),
+        "heavy": int(os.getenv("LANE_HEAVY_CONCURRENCY", "4")),
+    },
+)
+
+# Деградация под нагрузкой: ступень общая для процесса (см. overload.py)
+overload = get_controller()
+overload.add_queue(lambda: sum(scheduler.waiting.values()))
+overload.setup(dp, classify=scheduler.classify)
+scheduler.setup(dp)
+
+# Кнопки и команды — одним поиском в таблице (регистрируется последним)
+buttons = ButtonDispatch()
+buttons.setup(dp)
+
+# Намерения свободного текста: погода и перевод — мимо общего LLM-промпта
+intents = IntentRouter()
+TRANSLATE_PROMPT = "Переведи текст на русский язык. Сохрани смысл и стиль. Без пояснений."
+
+# Модель перевода по исходному языку: TRANSLATE_MODELS="en=gpt-4o-mini,de=gpt-4o-mini"
+TRANSLATE_MODEL = os.getenv("TRANSLATE_MODEL", "gpt-3.5-turbo")
+TRANSLATE_MODELS = dict(
+    pair.split("=", 1) for pair in os.getenv("TRANSLATE_MODELS", "").split(",") if "=" in pair
+)
+# С какой уверенностью детектора текст считается русским и не переводится
+RU_SKIP_CONFIDENCE = float(os.getenv("RU_SKIP_CONFIDENCE", "0.5"))
+
+# Кеш file_id: фото /start загружается один раз, дальше уходит по file_id
+file_ids = open_cache(os.path.join(DATA_DIR, "file_ids.json"))
+
+# Недавние ответы LLM — отдаются без запроса, когда сервер перегружен
+answers = AnswerCache(int(os.getenv("ANSWER_CACHE_SIZE", "1000")))
+
+# Метрики Prometheus: /metrics на порту контейнера (см. metrics.py)
+registry = setup_bot_metrics(dp, storage, overload=overload, scheduler=scheduler,
+                             flood=flood, buttons=buttons, send_limiter=send_limiter)
+# Трассы обновлений: медленные и выборочные — в data/traces.jsonl (см. tracing.py)
+setup_tracing(dp)
+registry.track_cache("answers", answers)
+registry.track_cache("user_data", user_data)
+registry.track_cache("file_ids", file_ids)
+registry.counter_func("bot_intents_total", "Запросы по распознанному намерению",
+                      lambda: {(name,): n for name, n in intents.routed.items()}, ("intent",))
+registry.counter_func("bot_llm_calls_total", "Обращения к LLM", lambda: intents.llm_calls)
+registry.counter_func("bot_llm_saved_total", "Запросы, обслуженные без LLM", lambda: intents.llm_saved)
+registry.counter_func("bot_llm_delayed_total", "Запросы к LLM, придержанные общим лимитом",
+                      lambda: llm_limiter.delayed)
+
 # --- Хендлеры ---
-@dp.message(Command("start"))
+@buttons.message("/start")
 async def start_command(message: Message):
     photo_path = BASE_DIR / "img" / "ФотоБот1.jpg"
     if photo_path.exists():
-        photo = FSInputFile(str(photo_path))
-        await message.answer_photo(
-            photo=photo,
+        await file_ids.send(
+            message.answer_photo, "photo", str(photo_path),
             caption="Привет! Я ваш AI-помощник в путешествиях. Чем могу помочь?",
             reply_markup=main_keyboard()
         )
@@ -161,155 +272,244 @@ async def handle_document(message: Message):
         await message.answer("⚠ Принимаются только текстовые файлы (.txt)")
         return
 
-    try:
-        file_info = await bot.get_file(message.document.file_id)
-        file_name = f"{message.from_user.id}_{file_info.file_path.split('/')[-1]}"
-        file_path = Path(DOWNLOADS_DIR) / file_name
-        await bot.download_file(file_info.file_path, destination=file_path)
+    user_id = message.from_user.id
+    filename = message.document.file_name.lower()
+
+    if "инструкция" in filename:
+        data_type = "instruction"
+        reply_text = "✅ Инструкция обновлена!"
+    elif "база" in filename:
+        data_type = "knowledge"
+        reply_text = "✅ База знаний обновлена!"
+    else:
+        await message.answer("⚠ Название файла должно содержать 'инструкция' или 'база'.")
+        return
 
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
+    try:
+        # Файл читается потоком в память (без копии в downloads/) с ограничением размера
+        doc = await ingest_telegram_file(
+            bot, message.document.file_id,
+            file_size=message.document.file_size,
+            max_bytes=MAX_UPLOAD_BYTES,
+        )
 
-        if not content:
+        if not doc.text:
             await message.answer("❌ Файл пустой.")
             return
 
-        user_id = message.from_user.id
-        filename = message.document.file_name.lower()
-
-        if "инструкция" in filename:
-            data_type = "instruction"
-            reply_text = "✅ Инструкция обновлена!"
-        elif "база" in filename:
-            data_type = "knowledge"
-            reply_text = "✅ База знаний обновлена!"
-        else:
-            await message.answer("⚠ Название файла должно содержать 'инструкция' или 'база'.")
+        if doc.sha256 == await store.get_hash(user_id, data_type):
+            await message.answer("ℹ️ Этот файл уже загружен — изменений нет.")
             return
 
-        if user_id not in user_data:
-            user_data[user_id] = {"knowledge": "", "instruction": ""}
-        user_data[user_id][data_type] = content
-        save_user_data(user_id, data_type, content)
+        logging.info(
+            f"Документ user_id={user_id}, type={data_type}: {doc.size} байт, "
+            f"{doc.encoding}, абзацев {doc.paragraphs}"
+        )
+        user_data.put(user_id, data_type, doc.text, doc.sha256)
+        save_user_data(user_id, data_type, doc.text, doc.sha256)
+        if data_type == "knowledge":
+            await index_faq(doc.sha256, doc.text)
 
         await message.answer(reply_text)
+    except DocumentTooLarge:
+        await message.answer(f"⚠ Файл слишком большой (максимум {MAX_UPLOAD_BYTES // 1024} КБ).")
     except Exception as e:
         logging.error(f"Ошибка обработки документа: {e}")
         await message.answer("⚠ Ошибка при загрузке файла.")
 
-@dp.message(Command("instruction"))
+@buttons.message("/instruction")
 async def show_instruction(message: Message):
-    user_id = message.from_user.id
-    instruction = user_data.get(user_id, {}).get("instruction", "Не загружена.")
-    await message.answer(f"Ваша инструкция:\n{instruction}")
+    text, markup = await render_page(store, user_data, message.from_user.id, "instruction")
+    await message.answer(text, reply_markup=markup)
 
-@dp.message(Command("knowledge"))
+@buttons.message("/knowledge")
 async def show_knowledge(message: Message):
-    user_id = message.from_user.id
-    knowledge = user_data.get(user_id, {}).get("knowledge", "Не загружена.")
-    await message.answer(f"Ваша база знаний:\n{knowledge}")
+    text, markup = await render_page(store, user_data, message.from_user.id, "knowledge")
+    await message.answer(text, reply_markup=markup)
 
-@dp.message(F.text == "❌ Отмена")
+@dp.callback_query(PageCallback.filter())
+async def turn_page(callback: CallbackQuery, callback_data: PageCallback):
+    text, markup = await render_page(
+        store, user_data, callback.from_user.id, callback_data.data_type, callback_data.page
+    )
+    try:
+        await callback.message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest:
+        # «message is not modified» — нажали на текущую страницу
+        pass
+    await callback.answer()
+
+@buttons.message("❌ Отмена")
 async def cancel_handler(message: Message, state: FSMContext):
+    # Прерываем и ещё не завершённые ответы LLM этого пользователя
+    scheduler.cancel_user(message.from_user.id)
     await state.clear()
     await message.answer("Действие отменено", reply_markup=main_keyboard())
 
-@dp.message(F.text == "🌤️ Погода")
+@buttons.message("🌤️ Погода")
 async def weather_handler(message: Message, state: FSMContext):
     await state.set_state(Form.weather)
     await message.answer("Введите название города:", reply_markup=cancel_keyboard())
 
-@dp.message(F.text == "🌍 Перевод")
+@buttons.message("🌍 Перевод")
 async def translate_handler(message: Message, state: FSMContext):
     await state.set_state(Form.translate)
     await message.answer("Введите текст для перевода:", reply_markup=cancel_keyboard())
 
-@dp.message(F.text == "❓ Спросить")
+@buttons.message("❓ Спросить")
 async def ask_handler(message: Message, state: FSMContext):
     await message.answer("Напишите ваш вопрос о путешествиях:", reply_markup=cancel_keyboard())
 
 # --- Обработка погоды ---
-@dp.message(Form.weather)
-async def get_weather(message: Message, state: FSMContext):
-    city = message.text
+class CityNotFound(Exception):
+    pass
+
+async def fetch_weather(city: str) -> str:
+    """Сводка погоды для города; CityNotFound — если OpenWeather его не знает"""
+    async with aiohttp.ClientSession() as session, upstream("openweather") as call:
+        async with session.get(
+            f"{BASE_WEATHER_URL}?q={city}&appid={WEATHER_API_KEY}&units=metric&lang=ru"
+        ) as response:
+            call.status = str(response.status)
+            data = await response.json()
+            if response.status != 200:
+                raise CityNotFound(data.get('message', 'Город не найден'))
+
+            weather = data["weather"][0]["description"].capitalize()
+            temp = data["main"]["temp"]
+            humidity = data["main"]["humidity"]
+            wind = data["wind"]["speed"]
+
+            return (
+                f"🌤 Погода в {city}:\n"
+                f"{weather}\n"
+                f"🌡 Температура: {temp}°C\n"
+                f"💧 Влажность: {humidity}%\n"
+                f"🍃 Ветер: {wind} м/с"
+            )
+
+async def weather_report(city: str) -> str:
+    """Текст сводки погоды для города (или сообщение об ошибке)"""
     if not WEATHER_API_KEY:
-        await message.answer("⚠️ Сервис погоды временно недоступен.")
-        await state.clear()
-        await message.answer("Выберите действие:", reply_markup=main_keyboard())
-        return
+        return "⚠️ Сервис погоды временно недоступен."
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{BASE_WEATHER_URL}?q={city}&appid={WEATHER_API_KEY}&units=metric&lang=ru"
-            ) as response:
-                data = await response.json()
-                if response.status != 200:
-                    await message.answer(f"❌ Ошибка: {data.get('message', 'Город не найден')}")
-                    return
-
-                weather = data["weather"][0]["description"].capitalize()
-                temp = data["main"]["temp"]
-                humidity = data["main"]["humidity"]
-                wind = data["wind"]["speed"]
-
-                response_text = (
-                    f"🌤 Погода в {city}:\n"
-                    f"{weather}\n"
-                    f"🌡 Температура: {temp}°C\n"
-                    f"💧 Влажность: {humidity}%\n"
-                    f"🍃 Ветер: {wind} м/с"
-                )
-                await message.answer(response_text)
+        return await fetch_weather(city)
+    except CityNotFound as e:
+        return f"❌ Ошибка: {e}"
     except Exception as e:
         logging.error(f"Ошибка погоды: {e}")
-        await message.answer("⚠️ Не удалось получить погоду.")
-    finally:
-        await state.clear()
-        await message.answer("Выберите действие:", reply_markup=main_keyboard())
+        return "⚠️ Не удалось получить погоду."
+
+@dp.message(Form.weather)
+async def get_weather(message: Message, state: FSMContext):
+    report = await weather_report(message.text)
+    await state.clear()
+    # Результат и приглашение к следующему действию — одним сообщением
+    await message.answer(f"{report}\n\nВыберите действие:", reply_markup=main_keyboard())
 
 # --- Обработка перевода ---
 @dp.message(Form.translate)
 async def translate_text(message: Message, state: FSMContext):
     text = message.text
-    system_prompt = "Переведи текст на русский язык. Сохрани смысл и стиль. Без пояснений."
-
-    await ai_response(message, system_prompt, text)
     await state.clear()
-    await message.answer("Выберите действие:", reply_markup=main_keyboard())
+    # Клавиатура меню приходит вместе с переводом, без отдельного сообщения
+    await translate_reply(message, text, reply_markup=main_keyboard())
+
+async def translate_reply(message: Message, text: str, reply_markup=None):
+    """Перевод на русский; язык определяется локально, русский текст не переводится"""
+    detected = detect_language(text)
+    if detected.lang == "ru" and detected.confidence >= RU_SKIP_CONFIDENCE:
+        intents.answered_locally()
+        await message.answer("ℹ️ Текст уже на русском — переводить нечего.", reply_markup=reply_markup)
+        return
+
+    system_prompt, model = translation_params(detected)
+    await ai_response(message, system_prompt, text, reply_markup=reply_markup, model=model)
+
+def translation_params(detected: Detection):
+    """Системный промпт и модель перевода для определённого языка"""
+    system_prompt = TRANSLATE_PROMPT
+    if detected.lang and detected.confidence >= RU_SKIP_CONFIDENCE:
+        system_prompt = f"Исходный язык: {detected.name}. " + TRANSLATE_PROMPT
+    return system_prompt, TRANSLATE_MODELS.get(detected.lang, TRANSLATE_MODEL)
+
+async def complete(system_prompt: str, user_text: str, model: str = None, max_tokens: int = 500,
+                   temperature: float = 0.7) -> str:
+    """Один запрос к LLM в пределах общего лимита llm_limiter"""
+    await llm_limiter.acquire()
+    try:
+        async with upstream("openai"):
+            completion = await client.chat.completions.create(
+                model=model or "gpt-3.5-turbo",  # или "llama3-8b-8192" для Groq, "llama3" для Ollama
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_text}
+                ],
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+    except RateLimitError:
+        # 429 от API — притормаживаем все запросы процесса, а не только этот
+        llm_limiter.pause(float(os.getenv("LLM_429_PAUSE_SEC", "5")))
+        raise
+    return completion.choices[0].message.content
 
 # --- Универсальный AI-ответ ---
-async def ai_response(message: Message, system_prompt: str, user_text: str):
+async def ai_response(message: Message, system_prompt: str, user_text: str, reply_markup=None, model: str = None):
+    key = answers.key(system_prompt, user_text)
+    if overload.level >= CACHED_ONLY:
+        # Под нагрузкой LLM не вызываем: повторный вопрос — из кеша, новый — отказ
+        cached = answers.get(key)
+        if cached:
+            intents.answered_locally()
+            await message.answer(cached, reply_markup=reply_markup)
+        else:
+            overload.rejected += 1
+            await message.answer(BUSY_TEXT, reply_markup=reply_markup)
+        return
+
+    # Считаем только реальные обращения к LLM, ответы из кеша — нет
+    intents.llm_called()
     try:
-        completion = await client.chat.completions.create(
-            model="gpt-3.5-turbo",  # или "llama3-8b-8192" для Groq, "llama3" для Ollama
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_text}
-            ],
-            temperature=0.7,
-            max_tokens=500
-        )
-        response_text = completion.choices[0].message.content
-        await message.answer(response_text)
+        response_text = await complete(system_prompt, user_text, model=model, max_tokens=overload.shrink(500))
+        answers.put(key, response_text)
+        await message.answer(response_text, reply_markup=reply_markup)
     except Exception as e:
         logging.error(f"Ошибка AI: {e}")
-        await message.answer("⚠️ Не удалось обработать запрос. Проверьте API-ключ или попробуйте позже.")
+        await message.answer(
+            "⚠️ Не удалось обработать запрос. Проверьте API-ключ или попробуйте позже.",
+            reply_markup=reply_markup,
+        )
 
 @dp.message(F.text)
 async def handle_ai_query(message: Message):
     user_id = message.from_user.id
-    text = message.text.strip().lower()
 
-    # Проверка на перевод
-    if any(keyword in text for keyword in ["переведи", "перевод", "translate", "на русском", "на английском"]):
-        await translate_text(message, None)  # временно, можно улучшить
+    # Погоду и перевод обслуживаем своими путями, без общего промпта с базой знаний
+    intent = intents.route(message.text)
+    if intent.name == WEATHER and intent.slot and await answer_weather(message, intent.slot):
+        intents.answered_locally()
+        return
+    if intent.name == TRANSLATE:
+        await translate_reply(message, intent.slot or message.text)
+        return
+    if intent.name != CHAT:
+        intents.fell_back()
+
+    # Вопрос из FAQ базы знаний — отвечаем сохранённым ответом
+    answer = await faq_answer(user_id, message.text)
+    if answer:
+        intents.answered_locally()
+        await message.answer(answer)
         return
 
     # Формируем контекст
-    user_context = user_data.get(user_id, {})
-    instruction = user_context.get("instruction", "")
-    knowledge = user_context.get("knowledge", "")
+    user_context = await user_data.get_refs(user_id)
+    instruction = await user_data.get_blob(user_context["instruction"]) if "instruction" in user_context else ""
+    knowledge = await knowledge_for_prompt(user_id, message.text, overload.shrink(PROMPT_KNOWLEDGE_CHARS))
+    # Под нагрузкой инструкция тоже урезается
+    instruction = instruction[:overload.shrink(len(instruction))]
 
     system_prompt = "Ты — дружелюбный AI-гид для путешественников. Отвечай кратко и полезно."
 
@@ -320,12 +520,38 @@ async def handle_ai_query(message: Message):
 
     await ai_response(message, system_prompt, message.text)
 
+async def answer_weather(message: Message, city: str) -> bool:
+    """Погода по городу из запроса; False — город не распознан, пусть отвечает LLM"""
+    if not WEATHER_API_KEY:
+        return False
+    for candidate in city_candidates(city):
+        try:
+            await message.answer(await fetch_weather(candidate))
+            return True
+        except CityNotFound:
+            continue
+        except Exception as e:
+            logging.error(f"Ошибка погоды: {e}")
+            return False
+    return False
+
 # --- Запуск бота ---
-async def main():
+async def main(run=serve):
+    """run(dp, bot) — способ получения обновлений: webhook/polling или очередь воркера (workers.py)"""
     dp.include_router(router)
-    restore_user_data()
+    await restore_user_data()
     logging.info("Бот запущен и готов к работе.")
-    await dp.start_polling(bot)
+    flusher_task = asyncio.create_task(store.run_flusher(float(os.getenv("STORE_FLUSH_SEC", "2"))))
+    fsm_janitor_task = asyncio.create_task(run_fsm_janitor(storage))
+    overload_task = asyncio.create_task(overload.run())
+    try:
+        await run(dp, bot)
+    finally:
+        overload_task.cancel()
+        fsm_janitor_task.cancel()
+        flusher_task.cancel()
+        await file_ids.flush()
+        await store.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,490 @@
+# metrics.py
+import os
+import time
+import bisect
+import asyncio
+import inspect
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject
+
+from tracing import span
+
+_LOG = logging.getLogger("metrics")
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Labels, float]
+# (имя, тип, описание, сэмплы) — простые кортежи: передаются между процессами (workers.py)
+Family = Tuple[str, str, str, List[Sample]]
+
+
+def _fmt(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value == float("inf"):
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# ---------- Метрики ----------
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: Any):
+        """Дочерняя метрика для набора значений меток (создаётся один раз)."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _labels(self, key: Tuple[str, ...]) -> Labels:
+        return tuple(zip(self.labelnames, key))
+
+    def samples(self) -> List[Sample]:
+        return [(self.name, self._labels(key), child.value) for key, child in self._children.items()]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+    _new_child = _Value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+    _new_child = _Value
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.bounds, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def samples(self) -> List[Sample]:
+        result: List[Sample] = []
+        for key, child in self._children.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(child.bounds, child.counts):
+                cumulative += count
+                result.append((self.name + "_bucket", labels + (("le", _fmt(bound)),), cumulative))
+            result.append((self.name + "_bucket", labels + (("le", "+Inf"),), child.count))
+            result.append((self.name + "_sum", labels, child.sum))
+            result.append((self.name + "_count", labels, child.count))
+        return result
+
+
+class _FuncMetric:
+    """Значение снимается при сборе: fn() -> число или {значения меток: число}; может быть async."""
+
+    def __init__(self, kind: str, name: str, help: str, fn: Callable[[], Any],
+                 labelnames: Sequence[str] = ()):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+
+    async def samples(self) -> List[Sample]:
+        values = self.fn()
+        if inspect.isawaitable(values):
+            values = await values
+        if not isinstance(values, dict):
+            return [(self.name, (), float(values))]
+        return [
+            (self.name, tuple(zip(self.labelnames, (str(v) for v in key))), float(value))
+            for key, value in values.items()
+        ]
+
+
+# ---------- Реестр ----------
+class Registry:
+    """
+    Реестр метрик процесса. Запись — это инкремент числа в dict без блокировок
+    (всё в одном event loop), поэтому метрики можно держать включёнными всегда;
+    текст в формате Prometheus собирается только при запросе /metrics.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Union[_Metric, _FuncMetric]] = {}
+        self._caches: Dict[str, Any] = {}
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def counter_func(self, name: str, help: str, fn: Callable[[], Any], labelnames: Sequence[str] = ()) -> None:
+        """Счётчик, который уже ведёт сам компонент (например, AnswerCache.hits)."""
+        self._metrics[name] = _FuncMetric("counter", name, help, fn, labelnames)
+
+    def gauge_func(self, name: str, help: str, fn: Callable[[], Any], labelnames: Sequence[str] = ()) -> None:
+        self._metrics[name] = _FuncMetric("gauge", name, help, fn, labelnames)
+
+    def track_cache(self, name: str, cache: Any) -> None:
+        """
+        Кеш со счётчиками hits/misses: экспортируются оба счётчика и доля
+        попаданий с момента старта (для окна — rate() по счётчикам).
+        """
+        if not self._caches:
+            caches = self._caches
+            self.counter_func("bot_cache_hits_total", "Попадания в кеш",
+                              lambda: {(n,): c.hits for n, c in caches.items()}, ("cache",))
+            self.counter_func("bot_cache_misses_total", "Промахи кеша",
+                              lambda: {(n,): c.misses for n, c in caches.items()}, ("cache",))
+            self.gauge_func("bot_cache_hit_ratio", "Доля попаданий в кеш с момента старта",
+                            lambda: {(n,): c.hits / ((c.hits + c.misses) or 1) for n, c in caches.items()},
+                            ("cache",))
+        self._caches[name] = cache
+
+    async def collect(self, extra_labels: Optional[Dict[str, str]] = None) -> List[Family]:
+        extra: Labels = tuple((k, str(v)) for k, v in (extra_labels or {}).items())
+        families: List[Family] = []
+        for metric in list(self._metrics.values()):
+            try:
+                if isinstance(metric, _FuncMetric):
+                    samples = await metric.samples()
+                else:
+                    samples = metric.samples()
+            except Exception as e:
+                _LOG.error("Метрика %s: ошибка сбора %r", metric.name, e)
+                continue
+            if extra:
+                samples = [(name, extra + labels, value) for name, labels, value in samples]
+            families.append((metric.name, metric.kind, metric.help, samples))
+        return families
+
+
+def render(families: Iterable[Family]) -> str:
+    """Текстовый формат Prometheus; одноимённые семейства (от разных шардов) объединяются."""
+    merged: Dict[str, Family] = {}
+    for name, kind, help, samples in families:
+        if name in merged:
+            merged[name][3].extend(samples)
+        else:
+            merged[name] = (name, kind, help, list(samples))
+    lines: List[str] = []
+    for name, kind, help, samples in merged.values():
+        lines.append(f"# HELP {name} {_escape(help)}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_name, labels, value in samples:
+            if labels:
+                body = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(f"{sample_name}{{{body}}} {_fmt(value)}")
+            else:
+                lines.append(f"{sample_name} {_fmt(value)}")
+    lines.append("")
+    return "\n".join(lines)
+
+
+_registry: Optional[Registry] = None
+
+
+def get_registry() -> Registry:
+    """Общий реестр процесса (main.py и main2.py в одном процессе делят его)."""
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return _registry
+
+
+# ---------- Обработчики ----------
+class HandlerMetrics(BaseMiddleware):
+    """
+    Inner-middleware: длительность каждого обработчика по имени функции
+    и исходу (ok/error). Кнопки из ButtonDispatch тоже проходят через него.
+    """
+
+    def __init__(self, registry: Registry):
+        self._seconds = registry.histogram(
+            "bot_handler_seconds", "Длительность обработчиков обновлений", ("handler", "status"),
+        )
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        target = data.get("handler")
+        name = getattr(getattr(target, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await handler(event, data)
+            status = "ok"
+            return result
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            self._seconds.labels(name, status).observe(time.perf_counter() - started)
+
+    def setup(self, dp: Dispatcher) -> None:
+        dp.message.middleware(self)
+        dp.callback_query.middleware(self)
+
+
+# ---------- Внешние API ----------
+class UpstreamCall:
+    """Объект внутри upstream(): status можно уточнить кодом ответа."""
+
+    __slots__ = ("status",)
+
+    def __init__(self):
+        self.status = "ok"
+
+
+def _error_status(e: BaseException) -> str:
+    for attr in ("status_code", "status"):
+        code = getattr(e, attr, None)
+        if isinstance(code, int):
+            return str(code)
+    response = getattr(e, "response", None)
+    code = getattr(response, "status_code", None)
+    if isinstance(code, int):
+        return str(code)
+    return type(e).__name__
+
+
+@asynccontextmanager
+async def upstream(service: str):
+    """
+    async with upstream("openai") as call: ... — время запроса к внешнему API
+    и исход: код HTTP (call.status = response.status) или имя исключения.
+    Заодно это спан upstream:<service> в трассе обновления (tracing.py).
+    """
+    registry = get_registry()
+    call = UpstreamCall()
+    started = time.perf_counter()
+    with span("upstream:" + service) as trace_span:
+        try:
+            yield call
+        except asyncio.CancelledError:
+            call.status = "cancelled"
+            raise
+        except Exception as e:
+            # Код ответа, выставленный до исключения, точнее имени исключения
+            if call.status == "ok":
+                call.status = _error_status(e)
+            raise
+        finally:
+            trace_span.set(status=call.status)
+            registry.histogram(
+                "bot_upstream_seconds", "Длительность запросов к внешним API", ("service",),
+            ).labels(service).observe(time.perf_counter() - started)
+            registry.counter(
+                "bot_upstream_requests_total", "Запросы к внешним API по исходу", ("service", "status"),
+            ).labels(service, call.status).inc()
+
+
+# ---------- Кеши и FSM ----------
+def fsm_states(storage: Any, min_interval: float = 30.0) -> Callable[[], Awaitable[Dict[Tuple[str], int]]]:
+    """
+    Число пользователей в каждом состоянии FSM для gauge_func. Хранилищу нужен
+    count_states() (см. fsm_storage.py); результат кешируется на min_interval,
+    чтобы частые опросы /metrics не сканировали таблицу.
+    """
+    count = getattr(storage, "count_states", None)
+    cached: Dict[Tuple[str], int] = {}
+    taken_at = float("-inf")
+
+    async def collect() -> Dict[Tuple[str], int]:
+        nonlocal cached, taken_at
+        if count is None:
+            return {}
+        now = time.monotonic()
+        if now - taken_at >= min_interval:
+            cached = {(state,): n for state, n in (await count()).items()}
+            taken_at = now
+        return cached
+
+    return collect
+
+
+def setup_bot_metrics(dp: Dispatcher, storage: Any, *, overload: Any, scheduler: Any,
+                      flood: Any, buttons: Any, send_limiter: Any) -> Registry:
+    """
+    Общие для main.py и main2.py метрики: длительность обработчиков, задержка
+    event loop и ступень перегрузки, очереди планировщика, антифлуд, кнопки,
+    исходящие отправки и пользователи по состояниям FSM. Значения снимаются
+    со счётчиков самих компонентов при запросе /metrics.
+
+    main.py импортирует main2, поэтому вызовов два, а реестр один: метрики
+    компонентов регистрируются при startup диспетчера, то есть только для
+    того бота, который действительно запущен.
+    """
+    registry = get_registry()
+    HandlerMetrics(registry).setup(dp)
+
+    async def register(**_: Any) -> None:
+        _register_components(registry, storage, overload=overload, scheduler=scheduler,
+                             flood=flood, buttons=buttons, send_limiter=send_limiter)
+
+    dp.startup.register(register)
+    return registry
+
+
+def _register_components(registry: Registry, storage: Any, *, overload: Any, scheduler: Any,
+                         flood: Any, buttons: Any, send_limiter: Any) -> None:
+    registry.gauge_func("bot_event_loop_lag_seconds", "Задержка event loop",
+                        lambda: overload.lag_ms / 1000)
+    registry.gauge_func("bot_overload_level", "Ступень деградации (0 — норма, 4 — отказ)",
+                        lambda: overload.level)
+    registry.gauge_func("bot_inflight_updates", "Обновлений в обработке", lambda: overload.inflight)
+    registry.counter_func("bot_overload_rejected_total", "Отклонено из-за перегрузки",
+                          lambda: overload.rejected)
+    registry.gauge_func("bot_lane_waiting", "Ожидают слота в очереди планировщика",
+                        lambda: {(lane,): n for lane, n in scheduler.waiting.items()}, ("lane",))
+    registry.counter_func("bot_flood_dropped_total", "Отброшено антифлудом",
+                          lambda: {("rate",): flood.dropped_rate, ("duplicate",): flood.dropped_dup},
+                          ("reason",))
+    registry.counter_func("bot_button_hits_total", "Кнопки и команды из таблицы ButtonDispatch",
+                          lambda: buttons.hits)
+    registry.counter_func("bot_send_delayed_total", "Отправки, придержанные лимитами Telegram",
+                          lambda: send_limiter.delayed)
+    registry.counter_func("bot_send_retries_total", "Повторы отправки после RetryAfter",
+                          lambda: send_limiter.retries)
+    registry.gauge_func("bot_fsm_users", "Пользователей в состоянии FSM", fsm_states(storage), ("state",))
+
+
+# ---------- HTTP ----------
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+
+
+def metrics_enabled() -> bool:
+    return os.getenv("METRICS_ENABLED", "1") not in ("0", "false", "no")
+
+
+def metrics_view(collect: Callable[[], Awaitable[List[Family]]]) -> Callable[[web.Request], Awaitable[web.Response]]:
+    async def view(request: web.Request) -> web.Response:
+        body = render(await collect())
+        return web.Response(text=body, content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+    return view
+
+
+def add_metrics_route(app: web.Application) -> None:
+    """GET METRICS_PATH с реестром этого процесса."""
+    if metrics_enabled():
+        app.router.add_get(METRICS_PATH, metrics_view(get_registry().collect))
+
+
+async def start_metrics_server(host: str, port: int) -> Optional[web.AppRunner]:
+    """
+    Отдельный HTTP-сервер только с /metrics (режим long polling).
+    Если порт не удалось занять, бот работает дальше без метрик.
+    """
+    if not metrics_enabled():
+        return None
+    app = web.Application()
+    add_metrics_route(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host=host, port=port).start()
+    except OSError as e:
+        _LOG.error("Метрики: не удалось слушать %s:%s: %r", host, port, e)
+        await runner.cleanup()
+        return None
+    _LOG.info("Метрики: http://%s:%s%s", host, port, METRICS_PATH)
+    return runner
+
+
+__all__ = [
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "HandlerMetrics",
+    "METRICS_PATH",
+    "Registry",
+    "add_metrics_route",
+    "fsm_states",
+    "get_registry",
+    "metrics_enabled",
+    "metrics_view",
+    "render",
+    "setup_bot_metrics",
+    "start_metrics_server",
+    "upstream",
+]
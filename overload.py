@@ -0,0 +1,221 @@
+# overload.py
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from scheduling import HEAVY
+
+_LOG = logging.getLogger("overload")
+
+# Ступени деградации: каждая следующая включает все предыдущие
+NORMAL = 0
+CACHED_ONLY = 1  # к LLM не обращаемся: повторный вопрос — из кеша, новый — BUSY_TEXT
+SHRINK = 2       # урезанный промпт и max_tokens
+NO_VOICE = 3     # озвучка только mp3, без голосового (OGG)
+REJECT = 4       # новые тяжёлые запросы сразу отклоняются
+
+LEVEL_NAMES = ["normal", "cached_only", "shrink", "no_voice", "reject"]
+
+REJECT_TEXT = "⚠️ Сервер сейчас перегружен. Попробуйте, пожалуйста, через пару минут."
+# Ответ на новый вопрос, когда LLM не вызывается (CACHED_ONLY и выше)
+BUSY_TEXT = "⏳ Сейчас большая нагрузка, на новые вопросы отвечу чуть позже. Попробуйте через пару минут."
+
+
+def _thresholds(name: str, default: str) -> List[float]:
+    values = [float(v) for v in os.getenv(name, default).split(",") if v.strip()]
+    if len(values) != REJECT:
+        raise ValueError(f"{name}: нужно {REJECT} порога через запятую, получено {values}")
+    return values
+
+
+def _stage(value: float, thresholds: Sequence[float]) -> int:
+    """Сколько порогов превышено: 0..REJECT."""
+    return sum(1 for t in thresholds if value >= t)
+
+
+class OverloadController:
+    """
+    Следит за числом обрабатываемых обновлений, глубиной очередей и задержкой
+    event loop и по порогам выбирает ступень деградации (level).
+    Каждый сигнал даёт свою ступень, итоговая — максимальная из них.
+
+    Уровень пересчитывается фоновой задачей run(); снижается он не сразу,
+    а после cooldown секунд без перегрузки, чтобы не «дребезжать» на границе.
+    """
+
+    def __init__(
+        self,
+        *,
+        inflight: Sequence[float],
+        queue: Sequence[float],
+        lag_ms: Sequence[float],
+        interval: float = 0.5,
+        cooldown: float = 10.0,
+    ):
+        self.inflight_thresholds = list(inflight)
+        self.queue_thresholds = list(queue)
+        self.lag_thresholds = list(lag_ms)
+        self.interval = interval
+        self.cooldown = cooldown
+        self.level = NORMAL
+        self.inflight = 0
+        self.lag_ms = 0.0
+        self.rejected = 0
+        self._depth_sources: List[Callable[[], int]] = []
+        self._raised_at = 0.0
+
+    @classmethod
+    def from_env(cls) -> "OverloadController":
+        """
+        OVERLOAD_INFLIGHT / OVERLOAD_QUEUE / OVERLOAD_LAG_MS — по четыре порога
+        (для ступеней 1..4) через запятую.
+        """
+        return cls(
+            inflight=_thresholds("OVERLOAD_INFLIGHT", "24,48,72,96"),
+            queue=_thresholds("OVERLOAD_QUEUE", "16,32,64,128"),
+            lag_ms=_thresholds("OVERLOAD_LAG_MS", "100,250,500,1000"),
+            cooldown=float(os.getenv("OVERLOAD_COOLDOWN_SEC", "10")),
+        )
+
+    def add_queue(self, depth: Callable[[], int]) -> None:
+        """Источник глубины очереди (ждущие обработчики, фоновые задачи и т.п.)."""
+        self._depth_sources.append(depth)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(depth() for depth in self._depth_sources)
+
+    def shrink(self, value: int) -> int:
+        """Лимит (символы промпта, max_tokens) с учётом ступени SHRINK."""
+        return value // 2 if self.level >= SHRINK else value
+
+    def _update(self) -> None:
+        target = max(
+            _stage(self.inflight, self.inflight_thresholds),
+            _stage(self.queue_depth, self.queue_thresholds),
+            _stage(self.lag_ms, self.lag_thresholds),
+        )
+        now = time.monotonic()
+        if target >= self.level:
+            if target > self.level:
+                _LOG.warning(
+                    "Перегрузка: %s -> %s (в работе %s, очередь %s, lag %.0f мс)",
+                    LEVEL_NAMES[self.level], LEVEL_NAMES[target],
+                    self.inflight, self.queue_depth, self.lag_ms,
+                )
+            self.level = target
+            if target > NORMAL:
+                self._raised_at = now
+        elif now - self._raised_at >= self.cooldown:
+            # Снижаемся по одной ступени за cooldown
+            _LOG.info("Нагрузка спала: %s -> %s", LEVEL_NAMES[self.level], LEVEL_NAMES[self.level - 1])
+            self.level -= 1
+            self._raised_at = now
+
+    async def run(self) -> None:
+        """Замер задержки event loop и пересчёт уровня; запускается через asyncio.create_task."""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag_ms = max(0.0, (loop.time() - started - self.interval) * 1000)
+            self._update()
+
+    def setup(self, dp: Dispatcher, classify: Callable[[TelegramObject, Dict[str, Any]], str]) -> None:
+        """
+        Регистрирует счётчик обновлений в работе; на ступени REJECT тяжёлые
+        (classify(...) == HEAVY) обновления отклоняются сразу.
+        """
+        guard = _OverloadGuard(self, classify)
+        dp.message.outer_middleware(guard)
+        dp.callback_query.outer_middleware(guard)
+
+
+class _OverloadGuard(BaseMiddleware):
+    def __init__(self, controller: OverloadController,
+                 classify: Callable[[TelegramObject, Dict[str, Any]], str]):
+        self.controller = controller
+        self.classify = classify
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        controller = self.controller
+        if controller.level >= REJECT and self.classify(event, data) == HEAVY:
+            controller.rejected += 1
+            if isinstance(event, (Message, CallbackQuery)):
+                await event.answer(REJECT_TEXT)
+            return None
+
+        controller.inflight += 1
+        try:
+            return await handler(event, data)
+        finally:
+            controller.inflight -= 1
+
+
+class AnswerCache:
+    """LRU последних ответов LLM по (системный промпт, текст пользователя)."""
+
+    def __init__(self, max_items: int = 1000):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(system_prompt: str, user_text: str) -> str:
+        h = hashlib.sha1(system_prompt.encode("utf-8"))
+        h.update(b"\0")
+        h.update(user_text.strip().lower().encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        answer = self._items.get(key)
+        if answer is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(key)
+        return answer
+
+    def put(self, key: str, answer: str) -> None:
+        self._items[key] = answer
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+
+_controller: Optional[OverloadController] = None
+
+
+def get_controller() -> OverloadController:
+    """Один контроллер на процесс: main.py и main2.py видят одну и ту же ступень."""
+    global _controller
+    if _controller is None:
+        _controller = OverloadController.from_env()
+    return _controller
+
+
+__all__ = [
+    "NORMAL",
+    "CACHED_ONLY",
+    "SHRINK",
+    "NO_VOICE",
+    "REJECT",
+    "REJECT_TEXT",
+    "BUSY_TEXT",
+    "AnswerCache",
+    "OverloadController",
+    "get_controller",
+]
@@ -0,0 +1,121 @@
+# scheduling.py
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+_LOG = logging.getLogger("scheduling")
+
+# Полосы приоритета
+CONTROL = "control"  # команды, кнопки меню, отмена — без очереди
+LIGHT = "light"      # быстрые ответы: выбор из меню, страницы, погода
+HEAVY = "heavy"      # генерация: LLM, озвучка
+
+
+class PriorityScheduler(BaseMiddleware):
+    """
+    Outer-middleware для message и callback_query: раскладывает обновления по полосам
+    с отдельными лимитами параллельности, чтобы /start и «❌ Отмена» не ждали
+    за очередью долгих LLM/TTS-запросов.
+
+    Полоса с лимитом None не ограничивается. Выполняющиеся и ждущие HEAVY-обработчики
+    запоминаются по пользователю — cancel_user() прерывает их.
+    """
+
+    def __init__(
+        self,
+        *,
+        control_texts: Iterable[str] = (),
+        heavy_states: Iterable[str] = (),
+        limits: Optional[Dict[str, Optional[int]]] = None,
+    ):
+        self.control_texts = frozenset(control_texts)
+        self.heavy_states = frozenset(heavy_states)
+        limits = {CONTROL: None, LIGHT: 16, HEAVY: 4, **(limits or {})}
+        self._semaphores = {
+            lane: asyncio.Semaphore(limit) for lane, limit in limits.items() if limit
+        }
+        self._heavy: Dict[int, Set[asyncio.Task]] = {}
+        self._cancelled: Set[asyncio.Task] = set()
+        # Сколько обработчиков ждут своей очереди в каждой полосе
+        self.waiting = {lane: 0 for lane in limits}
+
+    def classify(self, event: TelegramObject, data: Dict[str, Any]) -> str:
+        if isinstance(event, CallbackQuery):
+            return LIGHT
+        if not isinstance(event, Message):
+            return LIGHT
+        text = event.text or ""
+        if text.startswith("/") or text in self.control_texts:
+            return CONTROL
+        raw_state = data.get("raw_state")
+        if raw_state in self.heavy_states:
+            return HEAVY
+        if raw_state is not None or not text:
+            return LIGHT
+        # Свободный текст вне сценария уходит в LLM
+        return HEAVY
+
+    def cancel_user(self, user_id: int) -> int:
+        """Прерывает HEAVY-обработчики пользователя. Возвращает их число."""
+        tasks = self._heavy.pop(user_id, set())
+        for task in tasks:
+            self._cancelled.add(task)
+            task.cancel()
+        if tasks:
+            _LOG.info("Пользователь %s отменил %s тяжёлых запросов", user_id, len(tasks))
+        return len(tasks)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        lane = self.classify(event, data)
+        semaphore = self._semaphores.get(lane)
+        if semaphore is None:
+            return await handler(event, data)
+
+        user = data.get("event_from_user")
+        task = asyncio.current_task()
+        tracked = lane == HEAVY and user is not None and task is not None
+        if tracked:
+            self._heavy.setdefault(user.id, set()).add(task)
+
+        self.waiting[lane] += 1
+        acquired = False
+        try:
+            async with semaphore:
+                self.waiting[lane] -= 1
+                acquired = True
+                return await handler(event, data)
+        except asyncio.CancelledError:
+            if task in self._cancelled:
+                # Отменено пользователем — не ошибка
+                return None
+            raise
+        finally:
+            if not acquired:
+                self.waiting[lane] -= 1
+            if tracked:
+                self._cancelled.discard(task)
+                tasks = self._heavy.get(user.id)
+                if tasks is not None:
+                    tasks.discard(task)
+                    if not tasks:
+                        del self._heavy[user.id]
+
+    def setup(self, dp: Dispatcher) -> None:
+        dp.message.outer_middleware(self)
+        dp.callback_query.outer_middleware(self)
+
+
+__all__ = [
+    "CONTROL",
+    "LIGHT",
+    "HEAVY",
+    "PriorityScheduler",
+]
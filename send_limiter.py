@@ -0,0 +1,168 @@
+# send_limiter.py
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+_LOG = logging.getLogger("send_limiter")
+
+# Методы, на которые распространяются лимиты Telegram на отправку
+_SEND_METHODS = frozenset({
+    "sendMessage", "sendPhoto", "sendAudio", "sendVoice", "sendDocument", "sendVideo",
+    "sendAnimation", "sendSticker", "sendMediaGroup", "sendLocation", "sendChatAction",
+    "copyMessage", "forwardMessage",
+    "editMessageText", "editMessageCaption", "editMessageReplyMarkup", "editMessageMedia",
+})
+
+
+class _Gcra:
+    """
+    Ограничитель по алгоритму GCRA: rate событий в секунду с запасом burst.
+    reserve() занимает слот и возвращает, сколько секунд до него ждать.
+    """
+
+    __slots__ = ("interval", "tolerance", "tat")
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.interval = 1.0 / rate
+        self.tolerance = self.interval * max(0, burst - 1)
+        self.tat = 0.0
+
+    def reserve(self, now: float) -> float:
+        tat = max(self.tat, now)
+        delay = max(0.0, tat - self.tolerance - now)
+        self.tat = tat + self.interval
+        return delay
+
+    def pause(self, until: float) -> None:
+        """Сдвигает следующий слот (после RetryAfter)."""
+        self.tat = max(self.tat, until + self.tolerance)
+
+
+class RateLimiter:
+    """
+    Общий асинхронный ограничитель частоты вызовов внешнего API (GCRA):
+    acquire() ждёт своего слота. Один экземпляр на процесс делят все,
+    кто ходит в тот же API, — ответы чата и фрагменты перевода документов.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self._gcra = _Gcra(rate, burst)
+        self.delayed = 0
+
+    async def acquire(self) -> None:
+        delay = self._gcra.reserve(time.monotonic())
+        if delay > 0:
+            self.delayed += 1
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """Притормозить всех (например, после 429 от API)."""
+        self._gcra.pause(time.monotonic() + seconds)
+
+
+class SendRateLimiter(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: выравнивает исходящие отправки под лимиты Telegram —
+    общий (по умолчанию 30 сообщений/с) и на чат (1/с в личке, 20/мин в группах) —
+    и централизованно обрабатывает RetryAfter: ждёт и повторяет запрос,
+    придерживая остальные отправки в тот же чат.
+    """
+
+    def __init__(
+        self,
+        *,
+        global_rate: float = 30.0,
+        private_rate: float = 1.0,
+        private_burst: int = 3,
+        group_rate: float = 20 / 60,
+        group_burst: int = 3,
+        max_retries: int = 3,
+    ):
+        self._global = _Gcra(global_rate, burst=max(1, int(global_rate)))
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self._chats: Dict[int, _Gcra] = {}
+        self.delayed = 0
+        self.retries = 0
+
+    @classmethod
+    def from_env(cls) -> "SendRateLimiter":
+        """
+        SEND_GLOBAL_RATE — отправок в секунду на весь бот; при нескольких
+        шардах (workers.py) делится между процессами поровну.
+        """
+        shards = int(os.getenv("SHARD_COUNT", "1"))
+        return cls(
+            global_rate=float(os.getenv("SEND_GLOBAL_RATE", "30")) / max(1, shards),
+            private_rate=float(os.getenv("SEND_CHAT_RATE", "1")),
+            group_rate=float(os.getenv("SEND_GROUP_RATE_PER_MIN", "20")) / 60,
+        )
+
+    def _chat(self, chat_id: int) -> _Gcra:
+        limiter = self._chats.get(chat_id)
+        if limiter is None:
+            if len(self._chats) > 10_000:
+                # Забываем чаты, у которых нет занятых слотов в будущем
+                now = time.monotonic()
+                self._chats = {k: v for k, v in self._chats.items() if v.tat > now}
+            if chat_id < 0:
+                limiter = _Gcra(self.group_rate, self.group_burst)
+            else:
+                limiter = _Gcra(self.private_rate, self.private_burst)
+            self._chats[chat_id] = limiter
+        return limiter
+
+    async def _wait_turn(self, chat_id: Optional[int]) -> None:
+        now = time.monotonic()
+        delay = self._global.reserve(now)
+        if isinstance(chat_id, int):
+            delay = max(delay, self._chat(chat_id).reserve(now))
+        if delay > 0:
+            self.delayed += 1
+            await asyncio.sleep(delay)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if method.__api_method__ not in _SEND_METHODS:
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        attempt = 0
+        while True:
+            await self._wait_turn(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+                until = time.monotonic() + e.retry_after
+                # Флуд-лимит в одном чате не должен тормозить остальные
+                if isinstance(chat_id, int):
+                    self._chat(chat_id).pause(until)
+                else:
+                    self._global.pause(until)
+                _LOG.warning("RetryAfter %s с для %s (chat %s), повтор %s",
+                             e.retry_after, method.__api_method__, chat_id, attempt)
+
+
+__all__ = [
+    "RateLimiter",
+    "SendRateLimiter",
+]
@@ -0,0 +1,9 @@
+# tests/conftest.py
+import os
+import sys
+
+# Модули бота лежат в корне репозитория, а не в пакете
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Отменённые задачи в тестах job_queue иначе пишут трассы в data/traces.jsonl
+os.environ.setdefault("TRACING_ENABLED", "0")
@@ -0,0 +1,75 @@
+# tests/test_blob_files.py
+import os
+
+import pytest
+
+from blob_files import BlobFileStore, TextChunks, split_text
+
+
+def test_split_text_keeps_text_and_limit():
+    text = "\n\n".join(f"Абзац {i}\n" + "строка " * 30 for i in range(20))
+    pieces = split_text(text, 500)
+    assert "".join(pieces) == text
+    assert all(len(p) <= 500 for p in pieces)
+    # Режем по границе абзаца, если она есть в пределах лимита
+    assert all(p.endswith("\n\n") for p in pieces[:-1])
+
+
+def test_split_text_without_breaks():
+    text = "x" * 1050
+    assert split_text(text, 500) == ["x" * 500, "x" * 500, "x" * 50]
+
+
+def test_split_text_empty():
+    assert split_text("") == [""]
+
+
+@pytest.fixture
+def files(tmp_path):
+    store = BlobFileStore(str(tmp_path / "blobs"), chunk_chars=100)
+    yield store
+    store.close()
+
+
+def test_write_and_read_chunks(files):
+    text = "\n".join(f"Строка номер {i} с юникодом ё" for i in range(50))
+    files.write("h1", text)
+    reader = files.open("h1")
+    assert len(reader) == len(split_text(text, 100))
+    assert reader.chunk(1) == split_text(text, 100)[1]
+    assert reader.chars == len(text)
+    assert files.read_text("h1") == text
+    assert not os.path.exists(files.path_for("h1") + ".part")
+
+
+def test_write_same_hash_is_noop(files):
+    size = files.write("h1", "первый")
+    assert files.write("h1", "другой текст под тем же хэшем") == size
+    assert files.read_text("h1") == "первый"
+
+
+def test_missing_and_deleted(files):
+    assert files.open("nope") is None
+    assert files.read_text("nope") is None
+    files.write("h1", "текст")
+    files.open("h1")
+    files.delete("h1")
+    assert not files.exists("h1")
+    assert files.open("h1") is None
+    files.delete("h1")
+
+
+def test_foreign_file_is_rejected(files):
+    with open(files.path_for("bad"), "wb") as f:
+        f.write(b"not a blob file at all")
+    with pytest.raises(ValueError):
+        files.open("bad")
+
+
+def test_text_chunks_matches_reader(files):
+    text = "абв " * 120
+    files.write("h1", text)
+    reader, pending = files.open("h1"), TextChunks(text, 100)
+    assert len(reader) == len(pending)
+    assert list(reader.chunks()) == list(pending.chunks())
+    assert pending.text() == text
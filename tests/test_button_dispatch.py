@@ -0,0 +1,134 @@
+# tests/test_button_dispatch.py
+import asyncio
+import datetime
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from button_dispatch import ButtonDispatch
+
+USER = User(id=7, is_bot=False, first_name="Тест")
+
+
+def make_message(text):
+    return Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=7, type="private"),
+        from_user=USER,
+        text=text,
+    )
+
+
+class Fallback:
+    """Обычная цепочка обработчиков: сюда попадает всё, что не кнопка."""
+
+    def __init__(self):
+        self.events = []
+
+    async def __call__(self, event, data):
+        self.events.append(event)
+        return "fallback"
+
+
+def dispatch(buttons, event, **data):
+    fallback = Fallback()
+    result = asyncio.run(buttons(fallback, event, data))
+    return result, fallback.events
+
+
+def test_button_routes_to_its_handler():
+    buttons = ButtonDispatch()
+    seen = []
+
+    @buttons.message("🌤️ Погода")
+    async def weather(message: Message, state):
+        seen.append((message.text, state))
+        return "weather"
+
+    result, fallen = dispatch(buttons, make_message("🌤️ Погода"), state="st", bot=None)
+    assert result == "weather"
+    # Лишние аргументы (bot) отброшены, нужные (state) переданы
+    assert seen == [("🌤️ Погода", "st")]
+    assert fallen == []
+    assert buttons.hits == 1
+
+
+def test_command_ignores_case_bot_name_and_payload():
+    buttons = ButtonDispatch()
+
+    @buttons.message("/start")
+    async def start(message: Message):
+        return "start"
+
+    assert dispatch(buttons, make_message("/Start@my_bot ref42"))[0] == "start"
+    assert buttons.lookup("/start") is buttons.lookup("/START")
+
+
+def test_unknown_text_goes_through_normal_handlers():
+    buttons = ButtonDispatch()
+
+    @buttons.message("🌤️ Погода")
+    async def weather(message: Message):
+        return "weather"
+
+    for text in ("погода", "/unknown", None):
+        message = make_message(text)
+        result, fallen = dispatch(buttons, message)
+        assert result == "fallback"
+        assert fallen == [message]
+    assert buttons.hits == 0
+
+
+def test_non_message_events_are_not_routed():
+    buttons = ButtonDispatch()
+
+    @buttons.message("/start")
+    async def start(message: Message):
+        return "start"
+
+    query = CallbackQuery(id="1", from_user=USER, chat_instance="ci", data="/start")
+    assert dispatch(buttons, query)[0] == "fallback"
+
+
+def test_duplicate_key_is_rejected():
+    buttons = ButtonDispatch()
+
+    @buttons.message("/start")
+    async def start(message: Message):
+        pass
+
+    with pytest.raises(ValueError):
+        @buttons.message("/START@other_bot")
+        async def start_again(message: Message):
+            pass
+
+
+def test_routed_handler_passes_inner_middleware():
+    dp = Dispatcher()
+    buttons = ButtonDispatch()
+    order = []
+
+    async def inner(handler, event, data):
+        order.append(("inner", data["handler"].callback.__name__))
+        return await handler(event, data)
+
+    dp.message.middleware(inner)
+    buttons.setup(dp)
+
+    @buttons.message("/help")
+    async def help_command(message: Message):
+        order.append(("help", message.text))
+
+    bot = Bot("123:abc")
+    update = Update(update_id=1, message=make_message("/help"))
+
+    async def scenario():
+        try:
+            await dp.feed_update(bot, update)
+        finally:
+            await bot.session.close()
+
+    asyncio.run(scenario())
+    assert order == [("inner", "help_command"), ("help", "/help")]
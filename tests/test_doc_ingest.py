@@ -0,0 +1,66 @@
+# tests/test_doc_ingest.py
+import asyncio
+import hashlib
+
+import pytest
+
+from doc_ingest import DocumentTooLarge, TextIngestor, ingest_stream
+
+
+def ingest(data: bytes, piece: int = 7, **kwargs):
+    ingestor = TextIngestor(**kwargs)
+    for i in range(0, len(data), piece):
+        ingestor.feed(data[i:i + piece])
+    return ingestor.finish()
+
+
+def test_utf8_is_normalized():
+    raw = "\ufeff\r\n\nПервая строка  \r\nвторая\r\n\r\n\r\nтретья\n\n\n".encode("utf-8")
+    doc = ingest(raw)
+    assert doc.encoding == "utf-8"
+    assert doc.text == "Первая строка\nвторая\n\n\nтретья"
+    assert doc.paragraphs == 2
+    assert doc.size == len(raw)
+    assert doc.sha256 == hashlib.sha256(doc.text.encode("utf-8")).hexdigest()
+
+
+def test_nfc_normalization():
+    # «й» из двух кодовых точек склеивается в одну
+    doc = ingest("\u0438\u0306од".encode("utf-8"))
+    assert doc.text == "\u0439од"
+
+
+def test_cp1251_fallback_after_utf8_prefix():
+    text = "Hello world, " * 20 + "а дальше по-русски: Привет\n\nвторой абзац"
+    doc = ingest(text.encode("cp1251"), piece=16)
+    assert doc.encoding == "cp1251"
+    assert doc.text == text
+    assert doc.paragraphs == 2
+    assert doc.sha256 == hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def test_utf8_split_inside_character():
+    text = "ёжик " * 100
+    doc = ingest(text.encode("utf-8"), piece=3)
+    assert doc.encoding == "utf-8"
+    assert doc.text == text.rstrip()
+
+
+def test_truncated_utf8_tail_switches_to_fallback():
+    doc = ingest("текст".encode("utf-8")[:-1])
+    assert doc.encoding == "cp1251"
+
+
+def test_too_large():
+    with pytest.raises(DocumentTooLarge):
+        ingest(b"x" * 101, max_bytes=100)
+
+
+def test_ingest_stream():
+    async def stream():
+        for part in (b"a\n", b"", b"\n\nb"):
+            yield part
+
+    doc = asyncio.run(ingest_stream(stream()))
+    assert doc.text == "a\n\n\nb"
+    assert doc.paragraphs == 2
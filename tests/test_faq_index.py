@@ -0,0 +1,47 @@
+# tests/test_faq_index.py
+from faq_index import FaqIndex
+
+KNOWLEDGE = """
+Часто задаваемые вопросы
+
+1. **Нужна ли виза в Турцию?**
+Ответ: Для граждан России виза не нужна при поездке до 60 дней.
+
+2. **Какую валюту взять в Таиланд?**
+Ответ: Лучше взять доллары
+крупными купюрами и обменять на месте.
+
+3) **Можно ли провезти лекарства?**  Ответ: Да, в личной аптечке с рецептом.
+"""
+
+
+def test_build_parses_entries():
+    faq = FaqIndex.build(KNOWLEDGE)
+    assert len(faq) == 3
+    assert faq.entries[0].question == "Нужна ли виза в Турцию?"
+    assert faq.entries[1].answer == "Лучше взять доллары\nкрупными купюрами и обменять на месте."
+    assert faq.entries[2].answer == "Да, в личной аптечке с рецептом."
+
+
+def test_not_faq_text_gives_empty_index():
+    faq = FaqIndex.build("Просто текст о путешествиях без вопросов.")
+    assert len(faq) == 0
+    assert faq.match("виза в Турцию") is None
+
+
+def test_match_tolerates_word_forms_and_typos():
+    faq = FaqIndex.build(KNOWLEDGE)
+    entry, score = faq.match("нужна виза в турцию?")
+    assert entry.question == "Нужна ли виза в Турцию?"
+    assert score >= 0.6
+    # Опечатка «Тайланд»
+    entry, _ = faq.match("какую валюту взять в тайланд")
+    assert entry.question == "Какую валюту взять в Таиланд?"
+    entry, _ = faq.match("можно провезти лекарства")
+    assert entry.question == "Можно ли провезти лекарства?"
+
+
+def test_unrelated_question_is_not_matched():
+    faq = FaqIndex.build(KNOWLEDGE)
+    assert faq.match("Где лучше отдохнуть летом с детьми?") is None
+    assert faq.match("и в на") is None
@@ -0,0 +1,122 @@
+# tests/test_flood_control.py
+import asyncio
+import datetime
+
+import pytest
+from aiogram.types import Chat, Message, User
+
+import flood_control
+from flood_control import NOTICE_TEXT, FloodControl
+
+USER = User(id=7, is_bot=False, first_name="Тест")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeBot:
+    """Вместо Telegram: запоминает тексты отправленных сообщений."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def __call__(self, method, request_timeout=None):
+        self.sent.append(method.text)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(flood_control, "time", fake)
+    return fake
+
+
+def make_message(text, bot):
+    return Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=7, type="private"),
+        from_user=USER,
+        text=text,
+    ).as_(bot)
+
+
+class Counter:
+    def __init__(self):
+        self.passed = []
+
+    async def __call__(self, event, data):
+        self.passed.append(event.text)
+
+
+def feed(flood, handler, bot, *texts):
+    async def scenario():
+        for text in texts:
+            await flood(handler, make_message(text, bot), {"event_from_user": USER})
+
+    asyncio.run(scenario())
+
+
+def test_burst_then_reject_with_one_notice(clock):
+    flood = FloodControl(rate=1, burst=3, dup_window=0)
+    handler, bot = Counter(), FakeBot()
+    feed(flood, handler, bot, "1", "2", "3", "4", "5")
+    assert handler.passed == ["1", "2", "3"]
+    assert flood.dropped_rate == 2
+    # Уведомление — один раз на серию отказов
+    assert bot.sent == [NOTICE_TEXT]
+
+
+def test_tokens_refill_with_time(clock):
+    flood = FloodControl(rate=2, burst=2, dup_window=0)
+    handler, bot = Counter(), FakeBot()
+    feed(flood, handler, bot, "1", "2", "3")
+    assert handler.passed == ["1", "2"]
+
+    clock.now += 0.5  # rate=2: ровно один новый токен
+    feed(flood, handler, bot, "4", "5")
+    assert handler.passed == ["1", "2", "4"]
+
+    clock.now += 60  # запас не копится выше burst
+    feed(flood, handler, bot, "6", "7", "8")
+    assert handler.passed == ["1", "2", "4", "6", "7"]
+    # После каждого прохода следующий отказ снова уведомляется
+    assert bot.sent == [NOTICE_TEXT] * 3
+
+
+def test_duplicate_within_window_is_dropped(clock):
+    flood = FloodControl(rate=10, burst=10, dup_window=5)
+    handler, bot = Counter(), FakeBot()
+    feed(flood, handler, bot, "привет", "привет")
+    clock.now += 6
+    feed(flood, handler, bot, "привет")
+    assert handler.passed == ["привет", "привет"]
+    assert flood.dropped_dup == 1
+    assert bot.sent == []
+
+
+def test_exempt_text_always_passes(clock):
+    flood = FloodControl(rate=1, burst=1, dup_window=0, exempt_texts=["❌ Отмена"])
+    handler, bot = Counter(), FakeBot()
+    feed(flood, handler, bot, "1", "❌ Отмена", "❌ Отмена", "2")
+    assert handler.passed == ["1", "❌ Отмена", "❌ Отмена"]
+    assert flood.dropped_rate == 1
+
+
+def test_users_have_separate_buckets(clock):
+    flood = FloodControl(rate=1, burst=1, dup_window=0)
+    handler, bot = Counter(), FakeBot()
+    other = User(id=8, is_bot=False, first_name="Другой")
+
+    async def scenario():
+        await flood(handler, make_message("a", bot), {"event_from_user": USER})
+        await flood(handler, make_message("b", bot), {"event_from_user": USER})
+        await flood(handler, make_message("c", bot), {"event_from_user": other})
+
+    asyncio.run(scenario())
+    assert handler.passed == ["a", "c"]
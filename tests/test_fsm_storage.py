@@ -0,0 +1,103 @@
+# tests/test_fsm_storage.py
+import asyncio
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+import fsm_storage
+from fsm_storage import SQLiteStorage
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(fsm_storage, "time", fake)
+    return fake
+
+
+def key(user_id):
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def test_state_and_data_roundtrip(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"))
+        try:
+            await storage.set_state(key(1), "Form:name")
+            await storage.set_data(key(1), {"имя": "Анна"})
+            assert await storage.get_state(key(1)) == "Form:name"
+            assert await storage.get_data(key(1)) == {"имя": "Анна"}
+            assert await storage.get_state(key(2)) is None
+            assert await storage.count_states() == {"Form:name": 1}
+        finally:
+            await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_ttl_counts_from_last_read(tmp_path, clock):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), state_ttl=100, data_ttl=100)
+        try:
+            await storage.set_state(key(1), "Form:name")
+            await storage.set_state(key(2), "Form:name")
+            for _ in range(3):
+                clock.now += 60
+                assert await storage.get_state(key(1)) == "Form:name"
+            # Второй ключ не читали: он истёк по простою
+            assert await storage.get_state(key(2)) is None
+            assert await storage.purge_expired() == 1
+            clock.now += 99
+            assert await storage.get_state(key(1)) == "Form:name"
+            clock.now += 101
+            assert await storage.get_state(key(1)) is None
+        finally:
+            await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_touches_are_batched(tmp_path, clock):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), state_ttl=100, touch_batch=3, touch_interval=1000)
+        try:
+            await storage.set_many(states={key(i): "Form:name" for i in range(3)})
+            writes = []
+            touch_many = storage._touch_many
+            storage._touch_many = lambda items: writes.append(len(items)) or touch_many(items)
+            for i in range(3):
+                await storage.get_state(key(i))
+                await storage.get_state(key(i))
+            assert writes == [3]
+        finally:
+            await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_read_does_not_revive_expired(tmp_path, clock):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), state_ttl=100, data_ttl=10)
+        try:
+            await storage.set_state(key(1), "Form:name")
+            await storage.set_data(key(1), {"a": 1})
+            clock.now += 50
+            assert await storage.get_data(key(1)) == {}
+            assert await storage.get_state(key(1)) == "Form:name"
+            await storage.purge_expired()
+            assert await storage.get_data(key(1)) == {}
+        finally:
+            await storage.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,69 @@
+# tests/test_intent_router.py
+import pytest
+
+from intent_router import CHAT, TRANSLATE, WEATHER, IntentRouter, city_candidates
+
+
+@pytest.fixture
+def router():
+    return IntentRouter(log_every=0)
+
+
+@pytest.mark.parametrize("text, slot", [
+    ("переведи: hello world", "hello world"),
+    ("Переведи на английский язык: доброе утро", "доброе утро"),
+    ("translate to English: привет", "привет"),
+    ("перевод: good morning", "good morning"),
+    ("Пожалуйста, переведите «Where is the station?»", "«Where is the station?»"),
+])
+def test_translate_with_text(router, text, slot):
+    intent = router.classify(text)
+    assert intent.name == TRANSLATE
+    assert intent.slot == slot
+
+
+@pytest.mark.parametrize("text", [
+    "Расскажи о турах на русском языке",
+    "перевод денег в Турцию",
+    "переводчик нужен в Китае?",
+    "переведи",
+    "Как лучше перевести деньги за границу?",
+])
+def test_translate_words_without_text_go_to_chat(router, text):
+    assert router.classify(text).name == CHAT
+
+
+@pytest.mark.parametrize("text, slot", [
+    ("Какая погода в Москве", "Москве"),
+    ("погода сегодня в Нижнем Новгороде", "Нижнем Новгороде"),
+    ("weather in London", "London"),
+])
+def test_weather(router, text, slot):
+    intent = router.classify(text)
+    assert intent.name == WEATHER
+    assert intent.slot == slot
+
+
+@pytest.mark.parametrize("text", [
+    "Что надеть в Париж, если погода в Париже дождливая?",
+    "Где лучше отдохнуть летом?",
+    "прогноз",
+])
+def test_weather_needs_city_and_short_question(router, text):
+    assert router.classify(text).name == CHAT
+
+
+def test_route_counts(router):
+    router.route("погода в Казани")
+    router.route("привет")
+    router.answered_locally()
+    router.llm_called()
+    assert router.routed[WEATHER] == 1
+    assert router.routed[CHAT] == 1
+    assert (router.llm_saved, router.llm_calls) == (1, 1)
+
+
+def test_city_candidates():
+    assert city_candidates("Москве") == ["Москве", "Москва", "Москв"]
+    assert city_candidates("Казани")[:2] == ["Казани", "Казань"]
+    assert city_candidates("London") == ["London"]
@@ -0,0 +1,210 @@
+# tests/test_job_queue.py
+import asyncio
+import sqlite3
+
+import pytest
+
+from job_queue import JobQueue, QueueFull
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def wait_for(predicate, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "не дождались"
+        await asyncio.sleep(0.01)
+
+
+def statuses(path):
+    conn = sqlite3.connect(path)
+    try:
+        return dict(conn.execute("SELECT id, status FROM jobs"))
+    finally:
+        conn.close()
+
+
+def test_jobs_run_and_finish(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    done = []
+
+    async def handler(payload):
+        done.append(payload["n"])
+
+    async def scenario():
+        jobs = JobQueue(path)
+        jobs.register("tts", handler, concurrency=2)
+        await jobs.start()
+        try:
+            ids = [await jobs.submit("tts", {"n": n}, user_id=1) for n in range(5)]
+            await wait_for(lambda: len(done) == 5)
+            await wait_for(lambda: all(statuses(path)[i] == "done" for i in ids))
+        finally:
+            await jobs.stop()
+
+    run(scenario())
+    assert sorted(done) == list(range(5))
+
+
+def test_busy_kind_does_not_block_others(tmp_path):
+    release = None
+    done = []
+
+    async def slow(payload):
+        await release.wait()
+
+    async def fast(payload):
+        done.append(payload["n"])
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        jobs = JobQueue(str(tmp_path / "jobs.db"))
+        jobs.register("tts", slow, concurrency=2)
+        jobs.register("document", fast, concurrency=1)
+        await jobs.start()
+        try:
+            for n in range(10):
+                await jobs.submit("tts", {"n": n})
+            await jobs.submit("document", {"n": 1})
+            await wait_for(lambda: done == [1])
+            await wait_for(lambda: jobs.running == 2)
+            # Два tts выполняются, остальные ждут — и считаются ожидающими
+            assert jobs.pending == 8
+            release.set()
+            await wait_for(lambda: jobs.pending == 0 and jobs.running == 0)
+        finally:
+            await jobs.stop()
+
+    run(scenario())
+
+
+def test_queue_full(tmp_path):
+    async def never(payload):
+        await asyncio.Event().wait()
+
+    async def scenario():
+        jobs = JobQueue(str(tmp_path / "jobs.db"), max_pending=2)
+        jobs.register("tts", never)
+        try:
+            # Исполнители ещё не запущены: всё ждёт в очереди
+            await jobs.submit("tts", {})
+            await jobs.submit("tts", {})
+            with pytest.raises(QueueFull):
+                await jobs.submit("tts", {})
+            with pytest.raises(KeyError):
+                await jobs.submit("unknown", {})
+        finally:
+            await jobs.stop()
+
+    run(scenario())
+
+
+def test_cancel_user(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    started = []
+
+    async def handler(payload):
+        started.append(payload["n"])
+        await asyncio.Event().wait()
+
+    async def scenario():
+        jobs = JobQueue(path)
+        jobs.register("tts", handler)
+        await jobs.start()
+        try:
+            first = await jobs.submit("tts", {"n": 1}, user_id=7)
+            second = await jobs.submit("tts", {"n": 2}, user_id=7)
+            await wait_for(lambda: started == [1])
+            payloads = await jobs.cancel_user(7)
+            assert [p["n"] for p in payloads] == [1, 2]
+            await wait_for(lambda: jobs.running == 0 and jobs.pending == 0)
+            assert started == [1]
+            assert statuses(path) == {first: "cancelled", second: "cancelled"}
+        finally:
+            await jobs.stop()
+
+    run(scenario())
+
+
+def test_interrupted_job_is_recovered(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    calls = []
+
+    async def hang(payload):
+        calls.append("old")
+        await asyncio.Event().wait()
+
+    async def finish(payload):
+        calls.append("new")
+
+    async def first_run():
+        jobs = JobQueue(path)
+        jobs.register("tts", hang)
+        await jobs.start()
+        await jobs.submit("tts", {})
+        await wait_for(lambda: jobs.running == 1)
+        await jobs.stop()
+
+    async def second_run():
+        jobs = JobQueue(path)
+        jobs.register("tts", finish)
+        await jobs.start()
+        try:
+            await wait_for(lambda: calls == ["old", "new"])
+        finally:
+            await jobs.stop()
+
+    run(first_run())
+    run(second_run())
+    assert list(statuses(path).values()) == ["done"]
+
+
+def test_new_process_waits_for_lease(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    calls = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def old_handler(payload):
+            calls.append(("old", payload["n"]))
+            if payload["n"] == 1:
+                await release.wait()
+            else:
+                await asyncio.Event().wait()
+
+        async def new_handler(payload):
+            calls.append(("new", payload["n"]))
+
+        old = JobQueue(path)
+        old.register("tts", old_handler)
+        await old.start()
+        await old.submit("tts", {"n": 1})
+        await old.submit("tts", {"n": 2})
+        await wait_for(lambda: old.running == 1)
+
+        # Поочерёдный перезапуск: новый процесс поднят, пока старый ещё работает
+        new = JobQueue(path)
+        new.register("tts", new_handler)
+        await new.start()
+        await new.submit("tts", {"n": 3})
+        await asyncio.sleep(0.2)
+        # Чужие задачи не перехвачены, свою новый тоже пока не исполняет
+        assert calls == [("old", 1)]
+
+        release.set()
+        await wait_for(lambda: len(calls) == 2)
+        # Старый выходит посреди второй задачи — её доделает новый
+        await old.stop()
+        try:
+            await wait_for(lambda: len(calls) == 4)
+        finally:
+            await new.stop()
+
+    run(scenario())
+    assert calls[:2] == [("old", 1), ("old", 2)]
+    assert sorted(calls[2:]) == [("new", 2), ("new", 3)]
+    assert set(statuses(path).values()) == {"done"}
@@ -0,0 +1,50 @@
+# tests/test_lang_detect.py
+import pytest
+
+from lang_detect import detect_language, dominant_script
+
+
+@pytest.mark.parametrize("text, lang", [
+    ("Привет, как дела? Сегодня хорошая погода.", "ru"),
+    ("Добрий день, як справи? Дуже дякую", "uk"),
+    ("Hello, how are you doing today?", "en"),
+    ("Guten Morgen, wie geht es Ihnen heute?", "de"),
+    ("你好，世界", "zh"),
+    ("Γειά σου κόσμε", "el"),
+])
+def test_detect_language(text, lang):
+    detection = detect_language(text)
+    assert detection.lang == lang
+    assert detection.confidence > 0.5
+
+
+@pytest.mark.parametrize("text", [
+    "Це дуже гарно",                   # украинский без і/ї/є
+    "Здравей, как си днес?",           # болгарский
+    "Сайн байна уу, таны нэр хэн бэ",  # монгольский: ы, э как в русском
+    "Саламатсызбы, кандайсыз",         # киргизский
+])
+def test_other_cyrillic_is_not_russian(text):
+    assert detect_language(text).lang != "ru"
+
+
+def test_russian_wins_a_tie_without_extra_confidence():
+    # Поровну совпадений с ru и uk: выбран русский, но без уверенного отрыва
+    detection = detect_language("Расскажи про погоду в Москве")
+    assert detection.lang == "ru"
+    assert detection.confidence <= 0.5
+
+
+def test_no_letters():
+    detection = detect_language("12345 !!!")
+    assert (detection.lang, detection.script, detection.confidence) == (None, None, 0.0)
+
+
+def test_short_text_is_less_certain():
+    assert detect_language("ok").confidence < detect_language("Hello, how are you doing today?").confidence
+
+
+def test_dominant_script_share():
+    script, share = dominant_script("Москва Moscow Санкт-Петербург")
+    assert script == "cyrillic"
+    assert 0.5 < share < 1.0
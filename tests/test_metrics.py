@@ -0,0 +1,71 @@
+# tests/test_metrics.py
+import asyncio
+import socket
+from types import SimpleNamespace
+
+from aiogram import Bot, Dispatcher
+
+import metrics
+from metrics import Registry, render, setup_bot_metrics, start_metrics_server
+
+
+def components(level):
+    return dict(
+        overload=SimpleNamespace(lag_ms=0, level=level, inflight=0, rejected=0),
+        scheduler=SimpleNamespace(waiting={}),
+        flood=SimpleNamespace(dropped_rate=0, dropped_dup=0),
+        buttons=SimpleNamespace(hits=0),
+        send_limiter=SimpleNamespace(delayed=0, retries=0),
+    )
+
+
+def sample(families, name):
+    for family_name, _, _, samples in families:
+        if family_name == name:
+            return samples[0][2]
+    return None
+
+
+def test_render_merges_families():
+    registry = Registry()
+    registry.counter("jobs_total", "Задачи", ("kind",)).labels("tts").inc(2)
+    registry.gauge_func("queue", "Очередь", lambda: 3)
+
+    async def scenario():
+        return await registry.collect({"shard": "0"}) + await registry.collect({"shard": "1"})
+
+    text = render(asyncio.run(scenario()))
+    assert text.count("# TYPE jobs_total counter") == 1
+    assert 'jobs_total{shard="0",kind="tts"} 2' in text
+    assert 'queue{shard="1"} 3' in text
+
+
+def test_bot_metrics_follow_the_started_dispatcher(monkeypatch):
+    registry = Registry()
+    monkeypatch.setattr(metrics, "_registry", registry)
+    started, imported = Dispatcher(), Dispatcher()
+    # Как в main.py: main2 импортируется первым, его диспетчер не запускается
+    setup_bot_metrics(imported, None, **components(level=9))
+    setup_bot_metrics(started, None, **components(level=1))
+    setup_bot_metrics(imported, None, **components(level=9))
+
+    async def scenario():
+        assert sample(await registry.collect(), "bot_overload_level") is None
+        bot = Bot("123:abc")
+        try:
+            await started.emit_startup(bot=bot)
+        finally:
+            await bot.session.close()
+        return await registry.collect()
+
+    assert sample(asyncio.run(scenario()), "bot_overload_level") == 1
+
+
+def test_metrics_server_port_busy_is_not_fatal():
+    async def scenario():
+        with socket.socket() as busy:
+            busy.bind(("127.0.0.1", 0))
+            busy.listen()
+            return await start_metrics_server("127.0.0.1", busy.getsockname()[1])
+
+    assert asyncio.run(scenario()) is None
@@ -0,0 +1,138 @@
+# tests/test_overload.py
+import asyncio
+
+import pytest
+
+import overload
+from overload import (CACHED_ONLY, NO_VOICE, NORMAL, REJECT, SHRINK, AnswerCache,
+                      OverloadController, _OverloadGuard)
+from scheduling import HEAVY, LIGHT
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(overload, "time", fake)
+    return fake
+
+
+def make_controller(cooldown=10.0):
+    return OverloadController(
+        inflight=[10, 20, 30, 40],
+        queue=[100, 200, 300, 400],
+        lag_ms=[100, 200, 300, 400],
+        cooldown=cooldown,
+    )
+
+
+def test_level_is_the_worst_signal(clock):
+    controller = make_controller()
+    depth = [0]
+    controller.add_queue(lambda: depth[0])
+
+    controller.inflight = 12
+    controller._update()
+    assert controller.level == CACHED_ONLY
+
+    depth[0] = 250
+    controller._update()
+    assert controller.level == SHRINK
+
+    controller.lag_ms = 1000
+    controller._update()
+    assert controller.level == REJECT
+
+
+def test_rises_at_once_but_falls_one_step_per_cooldown(clock):
+    controller = make_controller(cooldown=10)
+    controller.inflight = 35
+    controller._update()
+    assert controller.level == NO_VOICE
+
+    # Нагрузка пропала, но до cooldown ступень держится
+    controller.inflight = 0
+    clock.now += 9
+    controller._update()
+    assert controller.level == NO_VOICE
+
+    clock.now += 1
+    controller._update()
+    assert controller.level == SHRINK
+    # Следующий шаг вниз — снова через cooldown
+    clock.now += 5
+    controller._update()
+    assert controller.level == SHRINK
+    clock.now += 5
+    controller._update()
+    assert controller.level == CACHED_ONLY
+    clock.now += 10
+    controller._update()
+    assert controller.level == NORMAL
+
+
+def test_load_at_current_level_restarts_cooldown(clock):
+    controller = make_controller(cooldown=10)
+    controller.inflight = 25
+    controller._update()
+    assert controller.level == SHRINK
+
+    # Колебание на границе: краткий спад и возврат не снижают ступень
+    for _ in range(5):
+        clock.now += 6
+        controller.inflight = 5
+        controller._update()
+        assert controller.level == SHRINK
+        controller.inflight = 25
+        controller._update()
+        assert controller.level == SHRINK
+
+
+def test_shrink_halves_limits_from_shrink_level():
+    controller = make_controller()
+    controller.level = CACHED_ONLY
+    assert controller.shrink(500) == 500
+    controller.level = SHRINK
+    assert controller.shrink(500) == 250
+
+
+def test_guard_rejects_only_heavy_at_reject_level():
+    controller = make_controller()
+    lanes = {"heavy": HEAVY, "light": LIGHT}
+    guard = _OverloadGuard(controller, lambda event, data: lanes[event])
+    passed = []
+
+    async def handler(event, data):
+        assert controller.inflight == 1
+        passed.append(event)
+
+    async def scenario():
+        controller.level = REJECT
+        await guard(handler, "heavy", {})
+        await guard(handler, "light", {})
+        controller.level = NO_VOICE
+        await guard(handler, "heavy", {})
+
+    asyncio.run(scenario())
+    assert passed == ["light", "heavy"]
+    assert controller.rejected == 1
+    assert controller.inflight == 0
+
+
+def test_answer_cache_normalizes_question_and_evicts_oldest():
+    cache = AnswerCache(max_items=2)
+    cache.put(cache.key("prompt", "Где поесть?"), "ответ 1")
+    assert cache.get(cache.key("prompt", "  где поесть? ")) == "ответ 1"
+    assert cache.get(cache.key("другой prompt", "Где поесть?")) is None
+
+    cache.put(cache.key("prompt", "второй"), "ответ 2")
+    cache.put(cache.key("prompt", "третий"), "ответ 3")
+    assert cache.get(cache.key("prompt", "Где поесть?")) is None
+    assert (cache.hits, cache.misses) == (1, 2)
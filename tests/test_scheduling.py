@@ -0,0 +1,104 @@
+# tests/test_scheduling.py
+import asyncio
+import datetime
+
+from aiogram.types import CallbackQuery, Chat, Message, User
+
+from scheduling import CONTROL, HEAVY, LIGHT, PriorityScheduler
+
+USER = User(id=7, is_bot=False, first_name="Тест")
+
+
+def make_message(text):
+    return Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=7, type="private"),
+        from_user=USER,
+        text=text,
+    )
+
+
+def make_data(user=USER, raw_state=None):
+    return {"event_from_user": user, "raw_state": raw_state}
+
+
+def test_classify_lanes():
+    scheduler = PriorityScheduler(control_texts=["❌ Отмена"], heavy_states=["TTS:waiting_text"])
+    query = CallbackQuery(id="1", from_user=USER, chat_instance="ci", data="page:2")
+
+    assert scheduler.classify(make_message("/start"), make_data()) == CONTROL
+    assert scheduler.classify(make_message("❌ Отмена"), make_data(raw_state="TTS:waiting_text")) == CONTROL
+    assert scheduler.classify(query, make_data()) == LIGHT
+    # Свободный текст вне сценария — в LLM
+    assert scheduler.classify(make_message("Куда поехать?"), make_data()) == HEAVY
+    assert scheduler.classify(make_message("текст"), make_data(raw_state="TTS:waiting_text")) == HEAVY
+    # Ответ внутри лёгкого сценария и сообщения без текста
+    assert scheduler.classify(make_message("Москва"), make_data(raw_state="Weather:city")) == LIGHT
+    assert scheduler.classify(make_message(None), make_data()) == LIGHT
+
+
+def test_control_and_light_are_not_starved_by_heavy():
+    async def scenario():
+        scheduler = PriorityScheduler(limits={HEAVY: 1, LIGHT: 1})
+        release = asyncio.Event()
+        done = []
+
+        async def slow(event, data):
+            await release.wait()
+            done.append(event.text)
+
+        async def fast(event, data):
+            done.append(event.text)
+
+        heavy = [
+            asyncio.create_task(scheduler(slow, make_message(f"вопрос {i}"), make_data()))
+            for i in range(3)
+        ]
+        await asyncio.sleep(0)
+        # Одна тяжёлая задача работает, две ждут своей очереди
+        assert scheduler.waiting[HEAVY] == 2
+
+        await asyncio.wait_for(scheduler(fast, make_message("/start"), make_data()), 1)
+        await asyncio.wait_for(scheduler(fast, make_message("Москва"), make_data(raw_state="Weather:city")), 1)
+        assert done == ["/start", "Москва"]
+
+        release.set()
+        await asyncio.wait_for(asyncio.gather(*heavy), 1)
+        # Все ждавшие тяжёлые выполнились, по порядку поступления
+        assert done[2:] == ["вопрос 0", "вопрос 1", "вопрос 2"]
+        assert scheduler.waiting[HEAVY] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancel_user_interrupts_running_and_waiting_heavy():
+    async def scenario():
+        scheduler = PriorityScheduler(limits={HEAVY: 1})
+        other = User(id=8, is_bot=False, first_name="Другой")
+        started = []
+
+        async def forever(event, data):
+            started.append(data["event_from_user"].id)
+            await asyncio.Event().wait()
+
+        mine = [
+            asyncio.create_task(scheduler(forever, make_message(f"вопрос {i}"), make_data()))
+            for i in range(2)
+        ]
+        theirs = asyncio.create_task(scheduler(forever, make_message("чужой"), make_data(user=other)))
+        await asyncio.sleep(0)
+
+        assert scheduler.cancel_user(USER.id) == 2
+        # Отмена пользователем — не ошибка: обработчик просто возвращает None
+        assert await asyncio.gather(*mine) == [None, None]
+        await asyncio.sleep(0)
+        # Освободившийся слот достался другому пользователю
+        assert started == [USER.id, other.id]
+        assert scheduler.cancel_user(USER.id) == 0
+
+        theirs.cancel()
+        await asyncio.gather(theirs, return_exceptions=True)
+        assert scheduler.waiting[HEAVY] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,130 @@
+# tests/test_send_limiter.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetMe, SendMessage
+
+import send_limiter
+from send_limiter import SendRateLimiter, _Gcra
+
+
+class FakeClock:
+    """Часы и sleep без реального ожидания: sleep двигает время вперёд."""
+
+    def __init__(self):
+        self.now = 1_000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(send_limiter, "time", fake)
+    monkeypatch.setattr(send_limiter, "asyncio", SimpleNamespace(sleep=fake.sleep))
+    return fake
+
+
+class FakeApi:
+    """make_request: первые failures вызовов отвечают RetryAfter."""
+
+    def __init__(self, clock, failures=0, retry_after=3):
+        self.clock = clock
+        self.failures = failures
+        self.retry_after = retry_after
+        self.calls = []
+
+    async def __call__(self, bot, method):
+        self.calls.append((getattr(method, "chat_id", None), self.clock.now))
+        if self.failures:
+            self.failures -= 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=self.retry_after)
+        return "ok"
+
+
+def test_burst_then_steady_rate():
+    gcra = _Gcra(rate=2, burst=3)
+    # Первые burst событий — без ожидания
+    assert [gcra.reserve(0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Дальше — по одному на 1 / rate секунд
+    assert gcra.reserve(0.0) == pytest.approx(0.5)
+    assert gcra.reserve(0.0) == pytest.approx(1.0)
+
+
+def test_idle_time_restores_burst():
+    gcra = _Gcra(rate=1, burst=2)
+    gcra.reserve(0.0)
+    gcra.reserve(0.0)
+    assert gcra.reserve(0.0) == pytest.approx(1.0)
+    assert gcra.reserve(10.0) == 0.0
+    assert gcra.reserve(10.0) == 0.0
+
+
+def test_pause_delays_next_slot():
+    gcra = _Gcra(rate=10, burst=5)
+    gcra.pause(until=3.0)
+    assert gcra.reserve(0.0) == pytest.approx(3.0)
+    assert gcra.reserve(3.0) == pytest.approx(0.1)
+
+
+def test_retry_after_pauses_chat_and_retries(clock):
+    limiter = SendRateLimiter()
+    api = FakeApi(clock, failures=1, retry_after=3)
+
+    async def scenario():
+        result = await limiter(api, None, SendMessage(chat_id=1, text="привет"))
+        # Другой чат флуд-лимитом первого не задерживается
+        await limiter(api, None, SendMessage(chat_id=2, text="привет"))
+        return result
+
+    assert asyncio.run(scenario()) == "ok"
+    assert [chat for chat, _ in api.calls] == [1, 1, 2]
+    first, retry, other = (at for _, at in api.calls)
+    assert retry - first == pytest.approx(3.0)
+    assert other == retry
+    assert limiter.retries == 1
+
+
+def test_retry_after_gives_up_after_max_retries(clock):
+    limiter = SendRateLimiter(max_retries=2)
+    api = FakeApi(clock, failures=5, retry_after=1)
+
+    with pytest.raises(TelegramRetryAfter):
+        asyncio.run(limiter(api, None, SendMessage(chat_id=1, text="привет")))
+    assert len(api.calls) == 3
+    assert limiter.retries == 2
+
+
+def test_private_chat_rate_spaces_sends(clock):
+    limiter = SendRateLimiter(private_rate=1, private_burst=2)
+    api = FakeApi(clock)
+
+    async def scenario():
+        for _ in range(4):
+            await limiter(api, None, SendMessage(chat_id=1, text="привет"))
+
+    asyncio.run(scenario())
+    times = [at - 1_000.0 for _, at in api.calls]
+    assert times == pytest.approx([0.0, 0.0, 1.0, 2.0])
+    assert limiter.delayed == 2
+
+
+def test_non_send_methods_pass_through(clock):
+    limiter = SendRateLimiter(global_rate=1)
+    api = FakeApi(clock)
+
+    async def scenario():
+        for _ in range(5):
+            await limiter(api, None, GetMe())
+
+    asyncio.run(scenario())
+    assert len(api.calls) == 5
+    assert clock.sleeps == []
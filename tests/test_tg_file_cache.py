@@ -0,0 +1,100 @@
+# tests/test_tg_file_cache.py
+import asyncio
+import json
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+from tg_file_cache import FileIdCache
+
+
+class FakeSend:
+    """Запоминает, что отправлялось; на загрузку файла отвечает новым file_id."""
+
+    def __init__(self, reject=()):
+        self.calls = []
+        self.reject = set(reject)
+
+    async def __call__(self, photo, **kwargs):
+        self.calls.append(photo)
+        if isinstance(photo, FSInputFile):
+            return SimpleNamespace(photo=[SimpleNamespace(file_id=f"id{len(self.calls)}")])
+        if photo in self.reject:
+            raise TelegramBadRequest(method=None, message="Bad Request: wrong file identifier/HTTP URL specified")
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=photo)])
+
+
+def test_lru_drops_oldest(tmp_path):
+    async def scenario():
+        cache = FileIdCache(str(tmp_path / "ids.json"), max_items=2, save_delay=0)
+        cache.put("a", "A")
+        cache.put("b", "B")
+        assert cache.get("a") == "A"  # "a" становится самым свежим
+        cache.put("c", "C")
+        await cache.flush()
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("A", "C")
+
+
+def test_delayed_save_and_reload(tmp_path):
+    path = tmp_path / "ids.json"
+
+    async def scenario():
+        cache = FileIdCache(str(path), save_delay=0.05)
+        cache.put("k1", "F1")
+        cache.put("k2", "F2")
+        # Запись отложена: файла ещё нет
+        assert not path.exists()
+        await asyncio.sleep(0.2)
+        assert json.loads(path.read_text(encoding="utf-8")) == {"k1": "F1", "k2": "F2"}
+        cache.put("k3", "F3")
+        await cache.flush()
+
+    asyncio.run(scenario())
+    reloaded = FileIdCache(str(path))
+    assert [reloaded.get(k) for k in ("k1", "k2", "k3")] == ["F1", "F2", "F3"]
+
+
+def test_send_uploads_once_then_reuses_file_id(tmp_path):
+    photo = tmp_path / "start.jpg"
+    photo.write_bytes(b"jpeg")
+    send = FakeSend()
+
+    async def scenario():
+        cache = FileIdCache(str(tmp_path / "ids.json"), save_delay=0)
+        await cache.send(send, "photo", str(photo), caption="hi")
+        await cache.send(send, "photo", str(photo), caption="hi")
+        await cache.flush()
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert isinstance(send.calls[0], FSInputFile)
+    assert send.calls[1] == "id1"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_stale_file_id_is_dropped_and_reuploaded(tmp_path):
+    audio = tmp_path / "tts.mp3"
+    audio.write_bytes(b"mp3")
+    send = FakeSend(reject={"old"})
+
+    async def scenario():
+        cache = FileIdCache(str(tmp_path / "ids.json"), save_delay=0)
+        cache.put("tts:v1:abc:mp3", "old")
+        # Только из кеша: Telegram отверг id — запись удалена, ответа нет
+        assert await cache.send_cached(send, "photo", "tts:v1:abc:mp3") is None
+        assert cache.get("tts:v1:abc:mp3") is None
+        # Обычная отправка загружает файл и запоминает новый id
+        cache.put("tts:v1:abc:mp3", "old")
+        await cache.send(send, "photo", str(audio), key="tts:v1:abc:mp3")
+        await cache.flush()
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert send.calls[:2] == ["old", "old"]
+    assert isinstance(send.calls[2], FSInputFile)
+    assert cache.get("tts:v1:abc:mp3") == "id3"
@@ -0,0 +1,357 @@
+# tests/test_user_store.py
+import asyncio
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from user_store import UserStore, content_sha256
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "users.db")
+
+
+def blob_files(db_path):
+    blob_dir = os.path.join(os.path.dirname(db_path), "blobs")
+    return sorted(os.listdir(blob_dir)) if os.path.isdir(blob_dir) else []
+
+
+def test_put_get_roundtrip(db_path):
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            await store.put(1, "knowledge", "текст базы")
+            assert await store.get(1, "knowledge") == "текст базы"
+            assert await store.get(1, "instruction") is None
+            assert await store.get_hash(1, "knowledge") == content_sha256("текст базы")
+            assert await store.get_user(1) == {"knowledge": "текст базы"}
+        finally:
+            await store.close()
+
+    run(scenario())
+
+
+def test_same_text_is_stored_once(db_path):
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            await store.put_many([(1, "knowledge", "общая база"), (2, "knowledge", "общая база")])
+            stats = await store.stats()
+            assert stats["refs"] == 2
+            assert stats["blobs"] == 1
+        finally:
+            await store.close()
+
+    run(scenario())
+    assert blob_files(db_path) == [content_sha256("общая база") + ".kb"]
+
+
+def test_blob_removed_when_last_ref_replaced(db_path):
+    old_hash = content_sha256("старая")
+
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            await store.put_many([(1, "knowledge", "старая"), (2, "knowledge", "старая")])
+            await store.put(1, "knowledge", "новая")
+            # Второй пользователь ещё ссылается на старый текст
+            assert await store.get_blob(old_hash) == "старая"
+            assert (await store.stats())["blobs"] == 2
+
+            await store.put(2, "knowledge", "новая")
+            assert await store.get_blob(old_hash) is None
+            assert (await store.stats())["blobs"] == 1
+        finally:
+            await store.close()
+
+    run(scenario())
+    assert blob_files(db_path) == [content_sha256("новая") + ".kb"]
+
+
+def test_swap_in_one_batch_keeps_both_blobs(db_path):
+    # Хеш «а» освобождается первой строкой пакета и снова нужен второй
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            await store.put_many([(1, "knowledge", "а"), (2, "knowledge", "б")])
+            await store.put_many([(1, "knowledge", "б"), (2, "knowledge", "а")])
+        finally:
+            await store.close()
+
+        store = UserStore(db_path)
+        try:
+            assert await store.get(1, "knowledge") == "б"
+            assert await store.get(2, "knowledge") == "а"
+            assert (await store.stats())["blobs"] == 2
+        finally:
+            await store.close()
+
+    run(scenario())
+    assert blob_files(db_path) == sorted(content_sha256(t) + ".kb" for t in ("а", "б"))
+
+
+def test_same_value_does_not_bump_refcount(db_path):
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            await store.put(1, "knowledge", "база")
+            assert await store.put_many([(1, "knowledge", "база")]) == 0
+            await store.put(1, "knowledge", "другая")
+            # Если бы повторная запись увеличила счётчик, старый текст остался бы
+            assert (await store.stats())["blobs"] == 1
+        finally:
+            await store.close()
+
+    run(scenario())
+
+
+def test_long_text_is_read_by_chunks(db_path):
+    text = "\n\n".join(f"Абзац {i}. " + "слово " * 200 for i in range(30))
+    blob_hash = content_sha256(text)
+
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            await store.put(1, "knowledge", text)
+            count = await store.chunk_count(blob_hash)
+            assert count > 1
+            chunks = [await store.read_chunk(blob_hash, i) for i in range(count)]
+            assert "".join(chunks) == text
+            assert await store.read_chunk(blob_hash, count) is None
+        finally:
+            await store.close()
+
+    run(scenario())
+
+
+def test_put_later_is_visible_before_flush(db_path):
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            store.put_later(1, "instruction", "первая")
+            store.put_later(1, "instruction", "вторая")
+            assert await store.get(1, "instruction") == "вторая"
+            assert await store.get_refs(1) == {"instruction": content_sha256("вторая")}
+            # Повторные сохранения одного ключа схлопываются в одну запись
+            assert await store.flush() == 1
+            assert await store.flush() == 0
+            assert await store.all_rows() == [(1, "instruction", "вторая")]
+        finally:
+            await store.close()
+
+    run(scenario())
+
+
+def test_close_flushes_pending(db_path):
+    async def write():
+        store = UserStore(db_path)
+        store.put_later(7, "knowledge", "не потерять")
+        await store.close()
+
+    async def read():
+        store = UserStore(db_path)
+        try:
+            return await store.get(7, "knowledge")
+        finally:
+            await store.close()
+
+    run(write())
+    assert run(read()) == "не потерять"
+
+
+def test_failed_flush_keeps_pending(db_path, monkeypatch):
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            store.put_later(1, "knowledge", "старое")
+
+            def broken(rows):
+                store.put_later(1, "knowledge", "новее")
+                raise sqlite3.OperationalError("disk I/O error")
+
+            monkeypatch.setattr(store, "_put_many", broken)
+            with pytest.raises(sqlite3.OperationalError):
+                await store.flush()
+            monkeypatch.undo()
+            # Значение, пришедшее во время сбоя, не затёрто старым
+            assert await store.get(1, "knowledge") == "новее"
+            assert await store.flush() == 1
+        finally:
+            await store.close()
+
+    run(scenario())
+
+
+# ---------- Миграция старых файлов ----------
+def write_legacy(data_dir, name, content):
+    with open(os.path.join(data_dir, name), "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def test_migrate_from_dir(db_path, tmp_path):
+    data_dir = tmp_path / "legacy"
+    data_dir.mkdir()
+    write_legacy(data_dir, "knowledge_101.txt", "база 101")
+    # Тип данных с подчёркиванием: старый split('_') его ломал
+    write_legacy(data_dir, "last_answer_101.txt", "ответ")
+    write_legacy(data_dir, "instruction_202.txt", "   \n")
+    write_legacy(data_dir, "notes.txt", "не наш формат")
+    write_legacy(data_dir, "knowledge_abc.txt", "не наш формат")
+
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            assert await store.migrate_from_dir(str(data_dir)) == 2
+            assert await store.get_user(101) == {"knowledge": "база 101", "last_answer": "ответ"}
+            # Пустые файлы не переносятся
+            assert await store.get_user(202) == {}
+        finally:
+            await store.close()
+
+    run(scenario())
+
+
+def test_migrate_from_dir_runs_once_and_keeps_newer_values(db_path, tmp_path):
+    data_dir = tmp_path / "legacy"
+    data_dir.mkdir()
+    write_legacy(data_dir, "knowledge_1.txt", "из файла")
+
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            await store.put(1, "knowledge", "уже в базе")
+            assert await store.migrate_from_dir(str(data_dir)) == 0
+            assert await store.get(1, "knowledge") == "уже в базе"
+
+            write_legacy(data_dir, "knowledge_2.txt", "появился позже")
+            assert await store.migrate_from_dir(str(data_dir)) == 0
+            assert await store.get(2, "knowledge") is None
+        finally:
+            await store.close()
+
+    run(scenario())
+
+
+def test_migrate_from_missing_dir(db_path, tmp_path):
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            assert await store.migrate_from_dir(str(tmp_path / "nope")) == 0
+        finally:
+            await store.close()
+
+    run(scenario())
+
+
+def test_migrate_user_data_table(db_path):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("CREATE TABLE user_data (user_id INTEGER, data_type TEXT, content TEXT)")
+        conn.executemany(
+            "INSERT INTO user_data VALUES (?, ?, ?)",
+            [(1, "knowledge", "общая"), (2, "knowledge", "общая"), (2, "instruction", "своя")],
+        )
+    conn.close()
+
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            assert await store.get_user(2) == {"knowledge": "общая", "instruction": "своя"}
+            assert (await store.stats())["blobs"] == 2
+        finally:
+            await store.close()
+
+    run(scenario())
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+    assert "user_data" not in tables
+
+
+def test_inline_blobs_moved_to_files(db_path):
+    blob_hash = content_sha256("старый формат")
+
+    async def create():
+        store = UserStore(db_path)
+        await store.stats()
+        await store.close()
+
+    run(create())
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("INSERT INTO blobs (hash, content, refcount) VALUES (?, ?, 1)", (blob_hash, "старый формат"))
+        conn.execute("INSERT INTO user_refs VALUES (3, 'knowledge', ?, 0)", (blob_hash,))
+    conn.close()
+
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            assert await store.get(3, "knowledge") == "старый формат"
+        finally:
+            await store.close()
+
+    run(scenario())
+    assert blob_files(db_path) == [blob_hash + ".kb"]
+
+
+def test_close_waits_for_flush_in_progress(db_path, monkeypatch):
+    async def scenario():
+        store = UserStore(db_path)
+        put_many = store._put_many
+        started, release = threading.Event(), threading.Event()
+
+        def slow(rows):
+            if not started.is_set():
+                started.set()
+                release.wait(5)
+            return put_many(rows)
+
+        monkeypatch.setattr(store, "_put_many", slow)
+        store.put_later(1, "knowledge", "первый пакет")
+        flusher = asyncio.create_task(store.flush())
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        # Пока пишется первый пакет, приходит ещё одна запись
+        store.put_later(2, "knowledge", "во время сброса")
+        # Как при остановке бота: фоновый сброс отменён, сразу же close()
+        flusher.cancel()
+        closing = asyncio.create_task(store.close())
+        await asyncio.sleep(0.05)
+        assert not closing.done()
+        release.set()
+        await closing
+
+    async def read():
+        store = UserStore(db_path)
+        try:
+            return await store.all_rows()
+        finally:
+            await store.close()
+
+    run(scenario())
+    assert sorted(run(read())) == [(1, "knowledge", "первый пакет"), (2, "knowledge", "во время сброса")]
+
+
+def test_concurrent_flush_waits_instead_of_skipping(db_path):
+    async def scenario():
+        store = UserStore(db_path)
+        try:
+            store.put_later(1, "knowledge", "a")
+            first = asyncio.create_task(store.flush())
+            await asyncio.sleep(0)
+            store.put_later(2, "knowledge", "b")
+            assert await store.flush() == 1
+            assert await first == 1
+            assert len(await store.all_rows()) == 2
+        finally:
+            await store.close()
+
+    run(scenario())
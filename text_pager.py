@@ -0,0 +1,63 @@
+# text_pager.py
+from typing import Optional, Tuple
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from user_cache import UserDataCache
+from user_store import UserStore
+
+TITLES = {
+    "instruction": "Ваша инструкция",
+    "knowledge": "Ваша база знаний",
+}
+
+
+class PageCallback(CallbackData, prefix="pg"):
+    data_type: str
+    page: int
+
+
+def pager_keyboard(data_type: str, page: int, pages: int) -> Optional[InlineKeyboardMarkup]:
+    """Кнопки «назад / N из M / вперёд»; None, если страница одна."""
+    if pages <= 1:
+        return None
+    builder = InlineKeyboardBuilder()
+    if page > 0:
+        builder.button(text="◀️", callback_data=PageCallback(data_type=data_type, page=page - 1))
+    # Кнопка-счётчик ведёт на ту же страницу (просто закрывает «часики»)
+    builder.button(text=f"{page + 1} / {pages}", callback_data=PageCallback(data_type=data_type, page=page))
+    if page < pages - 1:
+        builder.button(text="▶️", callback_data=PageCallback(data_type=data_type, page=page + 1))
+    builder.adjust(3)
+    return builder.as_markup()
+
+
+async def render_page(
+    store: UserStore,
+    cache: UserDataCache,
+    user_id: int,
+    data_type: str,
+    page: int = 0,
+) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """
+    Текст страницы и клавиатура. Страница — один сжатый фрагмент хранимого текста:
+    по таблице смещений распаковывается только он.
+    """
+    title = TITLES.get(data_type, data_type)
+    blob_hash = (await cache.get_refs(user_id)).get(data_type)
+    if not blob_hash:
+        return f"{title}:\nНе загружена.", None
+
+    pages = await store.chunk_count(blob_hash)
+    page = max(0, min(page, pages - 1))
+    chunk = await store.read_chunk(blob_hash, page) or ""
+    return f"{title}:\n{chunk}", pager_keyboard(data_type, page, pages)
+
+
+__all__ = [
+    "PageCallback",
+    "pager_keyboard",
+    "render_page",
+]
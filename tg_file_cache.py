@@ -0,0 +1,212 @@
+# tg_file_cache.py
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+_LOG = logging.getLogger("tg_file_cache")
+
+# Какое поле ответа Telegram содержит file_id для каждого типа отправки
+_FILE_ID_GETTERS: Dict[str, Callable[[Message], Optional[str]]] = {
+    "photo": lambda m: m.photo[-1].file_id if m.photo else None,
+    "audio": lambda m: m.audio.file_id if m.audio else None,
+    "voice": lambda m: m.voice.file_id if m.voice else None,
+    "document": lambda m: m.document.file_id if m.document else None,
+}
+
+
+def file_sha256(path: str) -> str:
+    """Считает sha256 файла блоками, не читая его целиком в память."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# Сообщения Telegram о том, что сохранённый file_id больше не годится
+_STALE_FILE_ID_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "file reference expired",
+    "file_reference_expired",
+)
+
+
+def _is_stale_file_id(error: TelegramBadRequest) -> bool:
+    text = str(error).lower()
+    return any(marker in text for marker in _STALE_FILE_ID_ERRORS)
+
+
+class FileIdCache:
+    """
+    Постоянное соответствие «ключ -> file_id Telegram». Для статики (фото /start)
+    ключ — sha256 содержимого файла; для сгенерированного (озвучка) вызывающий
+    передаёт свой ключ, например голос + хеш текста, и при попадании файл
+    можно вовсе не создавать (send_cached).
+
+    Повторная отправка того же содержимого идёт по file_id — без загрузки байтов.
+    Если Telegram отверг file_id, запись удаляется и файл загружается заново.
+    Обе таблицы ограничены max_items (LRU); файл кеша пишется в потоке,
+    не чаще раза в save_delay секунд.
+    """
+
+    def __init__(self, path: str, *, max_items: int = 1000, save_delay: float = 2.0):
+        self.path = path
+        self.max_items = max_items
+        self.save_delay = save_delay
+        self._ids: "OrderedDict[str, str]" = OrderedDict()
+        # (path, size, mtime_ns) -> sha256, чтобы не пересчитывать хеш статики
+        self._hash_memo: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        self._save_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._ids = OrderedDict(json.load(f))
+        except Exception as e:
+            _LOG.error("Не удалось прочитать кеш file_id %s: %r", self.path, e)
+            self._ids = OrderedDict()
+        while len(self._ids) > self.max_items:
+            self._ids.popitem(last=False)
+
+    def _write(self, ids: Dict[str, str]) -> None:
+        tmp_name = self.path + ".part"
+        try:
+            with open(tmp_name, "w", encoding="utf-8") as f:
+                json.dump(ids, f, ensure_ascii=False)
+            os.replace(tmp_name, self.path)
+        except Exception as e:
+            _LOG.error("Не удалось сохранить кеш file_id %s: %r", self.path, e)
+
+    async def _save_later(self) -> None:
+        await asyncio.sleep(self.save_delay)
+        self._save_task = None
+        await asyncio.to_thread(self._write, dict(self._ids))
+
+    def _schedule_save(self) -> None:
+        if self._save_task is None:
+            self._save_task = asyncio.get_running_loop().create_task(self._save_later())
+
+    async def flush(self) -> None:
+        """Записывает отложенные изменения сразу (при остановке)."""
+        task, self._save_task = self._save_task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.to_thread(self._write, dict(self._ids))
+
+    @staticmethod
+    def _bound(table: OrderedDict, max_items: int) -> None:
+        while len(table) > max_items:
+            table.popitem(last=False)
+
+    async def content_key(self, path: str) -> str:
+        st = os.stat(path)
+        memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        key = self._hash_memo.get(memo_key)
+        if key is None:
+            key = await asyncio.to_thread(file_sha256, path)
+            self._hash_memo[memo_key] = key
+            self._bound(self._hash_memo, self.max_items)
+        else:
+            self._hash_memo.move_to_end(memo_key)
+        return key
+
+    def get(self, key: str) -> Optional[str]:
+        file_id = self._ids.get(key)
+        if file_id is not None:
+            self._ids.move_to_end(key)
+        return file_id
+
+    def put(self, key: str, file_id: str) -> None:
+        if self._ids.get(key) != file_id:
+            self._ids[key] = file_id
+            self._bound(self._ids, self.max_items)
+            self._schedule_save()
+
+    def invalidate(self, key: str) -> None:
+        if self._ids.pop(key, None) is not None:
+            self._schedule_save()
+
+    async def send_cached(
+        self,
+        send: Callable[..., Awaitable[Message]],
+        kind: str,
+        key: str,
+        **kwargs: Any,
+    ) -> Optional[Message]:
+        """
+        Отправка только по file_id из кеша. None — записи нет или Telegram
+        её отверг (запись удалена): файл нужно загрузить через send().
+        """
+        file_id = self.get(key)
+        if not file_id:
+            return None
+        try:
+            result = await send(**{kind: file_id}, **kwargs)
+        except TelegramBadRequest as e:
+            if not _is_stale_file_id(e):
+                raise
+            _LOG.warning("Telegram отверг file_id для %s (%s), загружаю заново", key, e)
+            self.invalidate(key)
+            return None
+        self.hits += 1
+        return result
+
+    async def send(
+        self,
+        send: Callable[..., Awaitable[Message]],
+        kind: str,
+        path: str,
+        *,
+        key: Optional[str] = None,
+        **kwargs: Any,
+    ) -> Message:
+        """
+        Отправляет файл через send (например, message.answer_photo),
+        подставляя file_id из кеша, если содержимое уже загружалось.
+        kind — имя аргумента send: "photo", "audio", "voice" или "document";
+        key — свой ключ кеша вместо sha256 файла.
+        """
+        if key is None:
+            key = await self.content_key(path)
+        result = await self.send_cached(send, kind, key, **kwargs)
+        if result is not None:
+            return result
+
+        self.misses += 1
+        result = await send(**{kind: FSInputFile(path)}, **kwargs)
+        new_id = _FILE_ID_GETTERS[kind](result)
+        if new_id:
+            self.put(key, new_id)
+        return result
+
+
+_CACHES: Dict[str, FileIdCache] = {}
+
+
+def open_cache(path: str) -> FileIdCache:
+    """Один FileIdCache на файл в пределах процесса (main.py импортирует main2.py)."""
+    path = os.path.abspath(path)
+    cache = _CACHES.get(path)
+    if cache is None:
+        cache = _CACHES[path] = FileIdCache(path)
+    return cache
+
+
+__all__ = [
+    "FileIdCache",
+    "file_sha256",
+    "open_cache",
+]
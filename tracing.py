@@ -0,0 +1,305 @@
+# tracing.py
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+
+_LOG = logging.getLogger("tracing")
+
+# Трасса пишется, если длилась дольше TRACE_SLOW_MS, завершилась ошибкой
+# или попала в случайную выборку TRACE_SAMPLE_RATE (0..1)
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "3000"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+# Не больше стольких спанов в одной трассе — длинные задачи не раздувают память
+MAX_SPANS = 500
+
+
+def tracing_enabled() -> bool:
+    return os.getenv("TRACING_ENABLED", "1") not in ("0", "false", "no")
+
+
+# ---------- Трасса и спаны ----------
+class _Span:
+    __slots__ = ("name", "parent", "start", "end", "attrs", "error")
+
+    def __init__(self, name: str, parent: int, start: float, attrs: Dict[str, Any]):
+        self.name = name
+        self.parent = parent
+        self.start = start
+        self.end: Optional[float] = None
+        self.attrs = attrs
+        self.error: Optional[str] = None
+
+
+class Trace:
+    """Одно обновление (или фоновая задача): trace_id и плоский список спанов с индексом родителя."""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None, **attrs: Any):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.wall = time.time()
+        self.started = time.perf_counter()
+        self.duration_ms = 0.0
+        self.error: Optional[str] = None
+        self.spans: List[_Span] = []
+        self.dropped = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        def ms(t: Optional[float]) -> Optional[float]:
+            return None if t is None else round((t - self.started) * 1000, 2)
+
+        record: Dict[str, Any] = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "ts": self.wall,
+            "duration_ms": round(self.duration_ms, 2),
+            "attrs": self.attrs,
+            "spans": [
+                {
+                    "name": s.name,
+                    "parent": s.parent,
+                    "start_ms": ms(s.start),
+                    # None — спан не закрыт (например, задача ещё идёт в фоне)
+                    "duration_ms": None if s.end is None else round((s.end - s.start) * 1000, 2),
+                    **({"attrs": s.attrs} if s.attrs else {}),
+                    **({"error": s.error} if s.error else {}),
+                }
+                for s in self.spans
+            ],
+        }
+        if self.error:
+            record["error"] = self.error
+        if self.dropped:
+            record["dropped_spans"] = self.dropped
+        return record
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+# Индекс текущего спана: дочерние asyncio-задачи наследуют его вместе с контекстом
+_parent: ContextVar[int] = ContextVar("trace_parent", default=-1)
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace.trace_id if trace else None
+
+
+class span:
+    """
+    Спан внутри текущей трассы: with span("mp3_to_ogg_opus"): ... или async with.
+    Вне трассы ничего не записывает. set(**attrs) добавляет атрибуты.
+    """
+
+    __slots__ = ("_name", "_attrs", "_trace", "_span", "_token")
+
+    def __init__(self, name: str, **attrs: Any):
+        self._name = name
+        self._attrs = attrs
+        self._trace: Optional[Trace] = None
+        self._span: Optional[_Span] = None
+        self._token = None
+
+    def set(self, **attrs: Any) -> None:
+        if self._span is not None:
+            self._span.attrs.update(attrs)
+
+    def __enter__(self) -> "span":
+        trace = _trace.get()
+        if trace is None:
+            return self
+        if len(trace.spans) >= MAX_SPANS:
+            trace.dropped += 1
+            return self
+        self._trace = trace
+        self._span = _Span(self._name, _parent.get(), time.perf_counter(), self._attrs)
+        trace.spans.append(self._span)
+        self._token = _parent.set(len(trace.spans) - 1)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self._span is None:
+            return
+        self._span.end = time.perf_counter()
+        if exc_type is not None:
+            self._span.error = "cancelled" if exc_type is asyncio.CancelledError else repr(exc)
+        _parent.reset(self._token)
+
+    async def __aenter__(self) -> "span":
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.__exit__(exc_type, exc, tb)
+
+
+# ---------- Запись ----------
+class TraceSink:
+    """
+    Дописывает трассы в JSONL-файл в отдельном потоке, не задерживая event loop.
+    При превышении max_bytes файл переименовывается в *.1 (одна старая копия).
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tracing")
+        self.written = 0
+
+    def _append(self, line: str) -> None:
+        try:
+            out_dir = os.path.dirname(self.path)
+            if out_dir:
+                os.makedirs(out_dir, exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self.written += 1
+        except Exception as e:
+            _LOG.error("Не удалось записать трассу в %s: %r", self.path, e)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+        self._executor.submit(self._append, line)
+
+
+_sink: Optional[TraceSink] = None
+
+
+def get_sink() -> TraceSink:
+    """
+    TRACE_PATH — файл трасс (по умолчанию data/traces.jsonl; у шардов workers.py —
+    свой файл на шард), TRACE_MAX_MB — размер до ротации.
+    """
+    global _sink
+    if _sink is None:
+        default = "traces.jsonl"
+        if os.getenv("SHARD_INDEX"):
+            default = f"traces.shard{os.getenv('SHARD_INDEX')}.jsonl"
+        _sink = TraceSink(
+            os.getenv("TRACE_PATH") or os.path.join(os.getcwd(), "data", default),
+            max_bytes=int(float(os.getenv("TRACE_MAX_MB", "50")) * 1024 * 1024),
+        )
+    return _sink
+
+
+@asynccontextmanager
+async def start_trace(name: str, trace_id: Optional[str] = None, **attrs: Any):
+    """
+    Новая трасса на время блока. По завершении она пишется в файл, если медленная,
+    с ошибкой или попала в выборку. trace_id можно передать (фоновая задача
+    продолжает трассу обновления, которое её поставило).
+    """
+    if not tracing_enabled():
+        yield None
+        return
+    trace = Trace(name, trace_id, **attrs)
+    token = _trace.set(trace)
+    parent_token = _parent.set(-1)
+    try:
+        yield trace
+    except asyncio.CancelledError:
+        trace.error = "cancelled"
+        raise
+    except Exception as e:
+        trace.error = repr(e)
+        raise
+    finally:
+        _parent.reset(parent_token)
+        _trace.reset(token)
+        trace.duration_ms = (time.perf_counter() - trace.started) * 1000
+        slow = trace.duration_ms >= TRACE_SLOW_MS
+        if slow or trace.error or random.random() < TRACE_SAMPLE_RATE:
+            record = trace.to_dict()
+            record["reason"] = "slow" if slow else "error" if trace.error else "sampled"
+            get_sink().write(record)
+            if slow:
+                _LOG.warning("Медленно: %s %.0f мс (trace %s, %s)",
+                             name, trace.duration_ms, trace.trace_id, attrs)
+
+
+# ---------- Middleware ----------
+class UpdateTracer(BaseMiddleware):
+    """Outer-middleware на dp.update: трасса на каждое обновление, снаружи антифлуда и очередей."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        attrs: Dict[str, Any] = {"user_id": user.id if user else None}
+        if isinstance(event, Update):
+            attrs["update_id"] = event.update_id
+            attrs["type"] = event.event_type
+        async with start_trace("update", **attrs):
+            return await handler(event, data)
+
+
+class HandlerSpans(BaseMiddleware):
+    """Inner-middleware: спан на обработчик (после фильтров, антифлуда и ожидания в очереди)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        target = data.get("handler")
+        name = getattr(getattr(target, "callback", None), "__name__", "unknown")
+        with span("handler:" + name):
+            return await handler(event, data)
+
+
+class TelegramSpans(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: спан на каждый вызов Bot API. Регистрируется до
+    SendRateLimiter, чтобы ожидание лимитов отправки попадало в спан.
+    """
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        with span("telegram:" + method.__api_method__):
+            return await make_request(bot, method)
+
+
+def setup_tracing(dp: Dispatcher) -> None:
+    if not tracing_enabled():
+        return
+    dp.update.outer_middleware(UpdateTracer())
+    handler_spans = HandlerSpans()
+    dp.message.middleware(handler_spans)
+    dp.callback_query.middleware(handler_spans)
+
+
+__all__ = [
+    "HandlerSpans",
+    "TelegramSpans",
+    "Trace",
+    "TraceSink",
+    "UpdateTracer",
+    "current_trace_id",
+    "get_sink",
+    "setup_tracing",
+    "span",
+    "start_trace",
+    "tracing_enabled",
+]
@@ -0,0 +1,194 @@
+# user_cache.py
+import sys
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from user_store import UserStore, content_sha256
+
+_LOG = logging.getLogger("user_cache")
+
+DATA_TYPES = ("knowledge", "instruction")
+
+# Сколько пользователей держим в таблице ссылок (каждая запись — пара хешей)
+DEFAULT_MAX_USERS = 100_000
+# Сколько производных индексов (FAQ, страницы и т.п.) держим одновременно
+DEFAULT_MAX_INDEXES = 256
+
+
+class _SingleFlight:
+    """Параллельные запросы одного ключа ждут одну загрузку."""
+
+    def __init__(self):
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        fut = self._loading.get(key)
+        if fut is not None:
+            return await asyncio.shield(fut)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._loading[key] = fut
+        try:
+            result = await load()
+            fut.set_result(result)
+            return result
+        except Exception as e:
+            fut.set_exception(e)
+            # Исключение уже передано ожидающим; помечаем его полученным
+            fut.exception()
+            raise
+        finally:
+            self._loading.pop(key, None)
+
+
+class UserDataCache:
+    """
+    Ленивый кеш данных пользователей поверх UserStore.
+
+    У пользователя в памяти только ссылки {data_type: hash}; сами тексты лежат
+    в общем LRU по hash с бюджетом по байтам, поэтому одна и та же «база»
+    у тысячи пользователей занимает память один раз. Производные структуры
+    (индексы поиска и т.п.) тоже строятся один раз на hash — см. shared_index().
+    """
+
+    def __init__(self, store: UserStore, max_bytes: int, *,
+                 max_users: int = DEFAULT_MAX_USERS,
+                 max_indexes: int = DEFAULT_MAX_INDEXES):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.max_users = max_users
+        self.max_indexes = max_indexes
+        self._refs: "OrderedDict[int, Dict[str, str]]" = OrderedDict()
+        self._blobs: "OrderedDict[str, str]" = OrderedDict()
+        self._blob_sizes: Dict[str, int] = {}
+        self._total = 0
+        self._indexes: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._flight = _SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+    # ---------- Тексты по hash ----------
+    def _set_blob(self, blob_hash: str, content: str) -> None:
+        if blob_hash in self._blobs:
+            self._blobs.move_to_end(blob_hash)
+            return
+        size = sys.getsizeof(content)
+        self._blobs[blob_hash] = content
+        self._blob_sizes[blob_hash] = size
+        self._total += size
+        # Вытесняем самые старые, но не только что добавленный
+        while self._total > self.max_bytes and len(self._blobs) > 1:
+            old_hash, _ = self._blobs.popitem(last=False)
+            self._total -= self._blob_sizes.pop(old_hash, 0)
+
+    async def get_blob(self, blob_hash: str) -> str:
+        content = self._blobs.get(blob_hash)
+        if content is not None:
+            self.hits += 1
+            self._blobs.move_to_end(blob_hash)
+            return content
+
+        self.misses += 1
+
+        async def load() -> str:
+            loaded = await self.store.get_blob(blob_hash) or ""
+            self._set_blob(blob_hash, loaded)
+            return loaded
+
+        return await self._flight.run(("blob", blob_hash), load)
+
+    # ---------- Ссылки пользователей ----------
+    def _set_refs(self, user_id: int, refs: Dict[str, str]) -> None:
+        self._refs[user_id] = refs
+        self._refs.move_to_end(user_id)
+        while len(self._refs) > self.max_users:
+            self._refs.popitem(last=False)
+
+    async def get_refs(self, user_id: int) -> Dict[str, str]:
+        """Ссылки пользователя: {data_type: hash}."""
+        refs = self._refs.get(user_id)
+        if refs is not None:
+            self._refs.move_to_end(user_id)
+            return refs
+
+        async def load() -> Dict[str, str]:
+            loaded = await self.store.get_refs(user_id)
+            self._set_refs(user_id, loaded)
+            return loaded
+
+        return await self._flight.run(("refs", user_id), load)
+
+    async def get(self, user_id: int) -> Dict[str, str]:
+        """Данные пользователя: {"knowledge": str, "instruction": str, ...}."""
+        entry = {t: "" for t in DATA_TYPES}
+        for data_type, blob_hash in (await self.get_refs(user_id)).items():
+            entry[data_type] = await self.get_blob(blob_hash)
+        return entry
+
+    def put(self, user_id: int, data_type: str, content: str,
+            content_hash: Optional[str] = None) -> None:
+        """
+        Обновляет кеш после загрузки нового текста (сохранение в базу — отдельно).
+        Если пользователя нет в кеше, его ссылки будут прочитаны при следующем get().
+        """
+        blob_hash = content_hash or content_sha256(content)
+        self._set_blob(blob_hash, content)
+        refs = self._refs.get(user_id)
+        if refs is not None:
+            refs = dict(refs)
+            refs[data_type] = blob_hash
+            self._set_refs(user_id, refs)
+
+    def invalidate(self, user_id: int) -> None:
+        self._refs.pop(user_id, None)
+
+    # ---------- Общие производные индексы ----------
+    async def shared(self, name: str, blob_hash: str,
+                     load: Callable[[], Awaitable[Any]]) -> Any:
+        """Производная структура `name` для текста blob_hash, одна на содержимое."""
+        key = (name, blob_hash)
+        index = self._indexes.get(key)
+        if index is not None:
+            self._indexes.move_to_end(key)
+            return index
+
+        async def run() -> Any:
+            built = await load()
+            self._indexes[key] = built
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+            return built
+
+        return await self._flight.run(("index",) + key, run)
+
+    async def shared_index(self, user_id: int, data_type: str, name: str,
+                           build: Callable[[str], Any]) -> Optional[Any]:
+        """
+        Индекс `name`, построенный функцией build(text) по тексту пользователя.
+        Строится один раз на содержимое: пользователи с одинаковой базой
+        получают один и тот же объект. None — если текста нет.
+        """
+        blob_hash = (await self.get_refs(user_id)).get(data_type)
+        if not blob_hash:
+            return None
+
+        async def load() -> Any:
+            text = await self.get_blob(blob_hash)
+            return await asyncio.to_thread(build, text)
+
+        return await self.shared(name, blob_hash, load)
+
+
+__all__ = [
+    "UserDataCache",
+    "DATA_TYPES",
+]
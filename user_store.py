@@ -0,0 +1,427 @@
+# user_store.py
+import os
+import re
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from blob_files import BlobFileStore, TextChunks
+
+_LOG = logging.getLogger("user_store")
+
+# Старый формат: {data_type}_{user_id}.txt; data_type может содержать "_"
+_LEGACY_NAME_RE = re.compile(r"^(?P<data_type>.+)_(?P<user_id>\d+)\.txt$")
+
+_SCHEMA = """
+-- content пустой: текст лежит сжатым в файле blobs/<hash>.kb
+CREATE TABLE IF NOT EXISTS blobs (
+    hash     TEXT    PRIMARY KEY,
+    content  TEXT    NOT NULL DEFAULT '',
+    refcount INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_refs (
+    user_id    INTEGER NOT NULL,
+    data_type  TEXT    NOT NULL,
+    blob_hash  TEXT    NOT NULL,
+    updated_at REAL    NOT NULL,
+    PRIMARY KEY (user_id, data_type)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+Row = Tuple[int, str, str]  # (user_id, data_type, content)
+
+
+def content_sha256(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class UserStore:
+    """
+    Хранилище данных пользователей во встроенной SQLite (режим WAL).
+
+    Тексты лежат один раз в таблице blobs под своим sha256 со счётчиком ссылок;
+    у пользователя хранится только ссылка (user_id, data_type) -> hash.
+    Одинаковые «база»/«инструкция» у разных пользователей не дублируются.
+    Сам текст хранится сжатыми фрагментами в BlobFileStore (каталог blob_dir),
+    read_chunk() распаковывает только нужный фрагмент.
+
+    Все обращения к базе идут через отдельный однопоточный executor,
+    поэтому async-хендлеры не блокируют event loop.
+
+    put_later() копит записи в памяти (повторные сохранения одного ключа
+    схлопываются) и сбрасывает их одной транзакцией по таймеру и при close().
+    Чтения видят ещё не сброшенные значения.
+    """
+
+    def __init__(self, path: str, blob_dir: Optional[str] = None):
+        self.path = path
+        self._files = BlobFileStore(blob_dir or os.path.join(os.path.dirname(os.path.abspath(path)), "blobs"))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="user_store")
+        self._conn: Optional[sqlite3.Connection] = None
+        # (user_id, data_type) -> (hash, content)
+        self._pending: Dict[Tuple[int, str], Tuple[str, str]] = {}
+        # Пакет, который сейчас пишется в базу (чтобы чтения не видели «дыру»)
+        self._flushing: Dict[Tuple[int, str], Tuple[str, str]] = {}
+        # Сбросы идут строго по одному; запись пакета — отдельная задача,
+        # чтобы отмена run_flusher не обрывала её посередине
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # ---------- Синхронная часть (выполняется в executor) ----------
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            out_dir = os.path.dirname(self.path)
+            if out_dir:
+                os.makedirs(out_dir, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Записи идут пакетами (см. put_later), поэтому fsync на каждый коммит дёшев
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+            self._migrate_user_data_table()
+            self._migrate_inline_blobs()
+        return self._conn
+
+    def _migrate_inline_blobs(self) -> None:
+        """Тексты, сохранённые прямо в таблице blobs, переносятся в сжатые файлы."""
+        conn = self._conn
+        rows = conn.execute("SELECT hash, content FROM blobs WHERE content != ''").fetchall()
+        for blob_hash, content in rows:
+            self._files.write(blob_hash, content)
+        if rows:
+            with conn:
+                conn.executemany("UPDATE blobs SET content = '' WHERE hash = ?", [(h,) for h, _ in rows])
+            _LOG.info("Тексты перенесены в сжатые файлы: %s", len(rows))
+
+    def _migrate_user_data_table(self) -> None:
+        """Перенос из прежней таблицы user_data (текст в каждой строке) в blobs/user_refs."""
+        conn = self._conn
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_data'"
+        ).fetchone()
+        if not exists:
+            return
+        rows = conn.execute("SELECT user_id, data_type, content FROM user_data").fetchall()
+        self._put_many(rows)
+        with conn:
+            conn.execute("DROP TABLE user_data")
+        _LOG.info("Таблица user_data перенесена в blobs: записей %s", len(rows))
+
+    def _get_refs(self, user_id: int) -> Dict[str, str]:
+        rows = self._db().execute(
+            "SELECT data_type, blob_hash FROM user_refs WHERE user_id = ?",
+            (user_id,),
+        ).fetchall()
+        return dict(rows)
+
+    def _get_ref(self, user_id: int, data_type: str) -> Optional[str]:
+        row = self._db().execute(
+            "SELECT blob_hash FROM user_refs WHERE user_id = ? AND data_type = ?",
+            (user_id, data_type),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _get_blob(self, blob_hash: str) -> Optional[str]:
+        row = self._db().execute(
+            "SELECT content FROM blobs WHERE hash = ?", (blob_hash,)
+        ).fetchone()
+        if not row:
+            return None
+        return row[0] or self._files.read_text(blob_hash)
+
+    def _chunk_count(self, blob_hash: str) -> int:
+        reader = self._files.open(blob_hash)
+        return len(reader) if reader else 0
+
+    def _read_chunk(self, blob_hash: str, index: int) -> Optional[str]:
+        reader = self._files.open(blob_hash)
+        if reader is None or not 0 <= index < len(reader):
+            return None
+        return reader.chunk(index)
+
+    def _get(self, user_id: int, data_type: str) -> Optional[str]:
+        blob_hash = self._get_ref(user_id, data_type)
+        return self._get_blob(blob_hash) if blob_hash else None
+
+    def _get_user(self, user_id: int) -> Dict[str, str]:
+        return {
+            data_type: self._get_blob(blob_hash) or ""
+            for data_type, blob_hash in self._get_refs(user_id).items()
+        }
+
+    def _all_rows(self) -> List[Row]:
+        rows = self._db().execute(
+            "SELECT user_id, data_type, blob_hash FROM user_refs"
+        ).fetchall()
+        return [(uid, dtype, self._get_blob(h) or "") for uid, dtype, h in rows]
+
+    def _stats(self) -> Dict[str, int]:
+        conn = self._db()
+        refs = conn.execute("SELECT COUNT(*) FROM user_refs").fetchone()[0]
+        hashes = [h for (h,) in conn.execute("SELECT hash FROM blobs")]
+        blob_bytes = 0
+        for h in hashes:
+            try:
+                blob_bytes += os.path.getsize(self._files.path_for(h))
+            except FileNotFoundError:
+                pass
+        return {"refs": refs, "blobs": len(hashes), "blob_bytes": blob_bytes}
+
+    def _put_many(self, rows: Iterable[Row]) -> int:
+        now = time.time()
+        conn = self._db()
+        written = 0
+        orphaned: List[str] = []
+        with conn:  # одна транзакция на весь пакет
+            for user_id, data_type, content in rows:
+                new_hash = content_sha256(content)
+                old_hash = self._get_ref(user_id, data_type)
+                if old_hash == new_hash:
+                    continue
+                known = conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (new_hash,)).fetchone()
+                if not known:
+                    self._files.write(new_hash, content)
+                conn.execute(
+                    "INSERT INTO blobs (hash, content, refcount) VALUES (?, '', 1) "
+                    "ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1",
+                    (new_hash,),
+                )
+                conn.execute(
+                    "INSERT INTO user_refs (user_id, data_type, blob_hash, updated_at) "
+                    "VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(user_id, data_type) DO UPDATE SET "
+                    "blob_hash = excluded.blob_hash, updated_at = excluded.updated_at",
+                    (user_id, data_type, new_hash, now),
+                )
+                if old_hash is not None:
+                    conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?", (old_hash,))
+                    left = conn.execute("SELECT refcount FROM blobs WHERE hash = ?", (old_hash,)).fetchone()
+                    if left is not None and left[0] <= 0:
+                        conn.execute("DELETE FROM blobs WHERE hash = ?", (old_hash,))
+                        orphaned.append(old_hash)
+                written += 1
+        # Файлы удаляем только после успешного коммита и только у тех хешей,
+        # на которые никто не сослался снова в том же пакете (A→B, затем B→A)
+        for blob_hash in dict.fromkeys(orphaned):
+            left = conn.execute("SELECT refcount FROM blobs WHERE hash = ?", (blob_hash,)).fetchone()
+            if left is None or left[0] <= 0:
+                self._files.delete(blob_hash)
+        return written
+
+    def _migrate_from_dir(self, data_dir: str) -> int:
+        """Однократный перенос старых {data_type}_{user_id}.txt в базу."""
+        conn = self._db()
+        done = conn.execute("SELECT value FROM meta WHERE key = 'legacy_txt_migrated'").fetchone()
+        if done:
+            return 0
+
+        rows: List[Row] = []
+        if os.path.isdir(data_dir):
+            with os.scandir(data_dir) as it:
+                for entry in it:
+                    m = _LEGACY_NAME_RE.match(entry.name)
+                    if not m or not entry.is_file():
+                        continue
+                    user_id, data_type = int(m["user_id"]), m["data_type"]
+                    # Уже сохранённые в базе значения новее старых файлов
+                    if self._get_ref(user_id, data_type) is not None:
+                        continue
+                    try:
+                        with open(entry.path, "r", encoding="utf-8") as f:
+                            content = f.read()
+                    except Exception as e:
+                        _LOG.error("Ошибка чтения %s при миграции: %r", entry.path, e)
+                        continue
+                    if content.strip():
+                        rows.append((user_id, data_type, content))
+
+        self._put_many(rows)
+        with conn:
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('legacy_txt_migrated', ?)",
+                (str(int(time.time())),),
+            )
+        _LOG.info("Миграция из %s: перенесено записей %s", data_dir, len(rows))
+        return len(rows)
+
+    def _close(self) -> None:
+        self._files.close()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ---------- Async API ----------
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _pending_value(self, user_id: int, data_type: str) -> Optional[Tuple[str, str]]:
+        key = (user_id, data_type)
+        return self._pending.get(key, self._flushing.get(key))
+
+    def _pending_for_user(self, user_id: int) -> Dict[str, Tuple[str, str]]:
+        result: Dict[str, Tuple[str, str]] = {}
+        for overlay in (self._flushing, self._pending):
+            for (uid, data_type), value in overlay.items():
+                if uid == user_id:
+                    result[data_type] = value
+        return result
+
+    async def get(self, user_id: int, data_type: str) -> Optional[str]:
+        pending = self._pending_value(user_id, data_type)
+        if pending is not None:
+            return pending[1]
+        return await self._run(self._get, user_id, data_type)
+
+    async def get_user(self, user_id: int) -> Dict[str, str]:
+        result = await self._run(self._get_user, user_id)
+        for data_type, (_, content) in self._pending_for_user(user_id).items():
+            result[data_type] = content
+        return result
+
+    async def get_refs(self, user_id: int) -> Dict[str, str]:
+        """Ссылки пользователя: {data_type: hash}."""
+        result = await self._run(self._get_refs, user_id)
+        for data_type, (blob_hash, _) in self._pending_for_user(user_id).items():
+            result[data_type] = blob_hash
+        return result
+
+    def _pending_text(self, blob_hash: str) -> Optional[str]:
+        for overlay in (self._pending, self._flushing):
+            for h, content in overlay.values():
+                if h == blob_hash:
+                    return content
+        return None
+
+    async def get_blob(self, blob_hash: str) -> Optional[str]:
+        pending = self._pending_text(blob_hash)
+        if pending is not None:
+            return pending
+        return await self._run(self._get_blob, blob_hash)
+
+    async def chunk_count(self, blob_hash: str) -> int:
+        """Число сжатых фрагментов текста (страниц)."""
+        pending = self._pending_text(blob_hash)
+        if pending is not None:
+            return len(TextChunks(pending))
+        return await self._run(self._chunk_count, blob_hash)
+
+    async def read_chunk(self, blob_hash: str, index: int) -> Optional[str]:
+        """Один фрагмент текста: распаковывается только он, файл читается через mmap."""
+        pending = self._pending_text(blob_hash)
+        if pending is not None:
+            chunks = TextChunks(pending)
+            return chunks.chunk(index) if 0 <= index < len(chunks) else None
+        return await self._run(self._read_chunk, blob_hash, index)
+
+    async def get_hash(self, user_id: int, data_type: str) -> Optional[str]:
+        """sha256 текущего значения — чтобы не обрабатывать повторную загрузку того же текста."""
+        pending = self._pending_value(user_id, data_type)
+        if pending is not None:
+            return pending[0]
+        return await self._run(self._get_ref, user_id, data_type)
+
+    async def all_rows(self) -> List[Row]:
+        return await self._run(self._all_rows)
+
+    async def stats(self) -> Dict[str, int]:
+        """Число ссылок, уникальных текстов и их суммарный объём в байтах."""
+        return await self._run(self._stats)
+
+    async def put(self, user_id: int, data_type: str, content: str) -> None:
+        await self._run(self._put_many, [(user_id, data_type, content)])
+
+    async def put_many(self, rows: Iterable[Row]) -> int:
+        return await self._run(self._put_many, list(rows))
+
+    async def migrate_from_dir(self, data_dir: str) -> int:
+        return await self._run(self._migrate_from_dir, data_dir)
+
+    # ---------- Отложенная запись ----------
+    def put_later(self, user_id: int, data_type: str, content: str,
+                  content_hash: Optional[str] = None) -> None:
+        """Ставит запись в очередь; последнее значение для ключа побеждает."""
+        self._pending[(user_id, data_type)] = (content_hash or content_sha256(content), content)
+
+    async def _write_batch(self, batch: Dict[Tuple[int, str], Tuple[str, str]]) -> int:
+        self._flushing = batch
+        rows = [(uid, dtype, content) for (uid, dtype), (_, content) in batch.items()]
+        try:
+            return await self._run(self._put_many, rows)
+        except Exception:
+            # Не теряем данные: возвращаем в очередь, не затирая более новые значения
+            for key, value in batch.items():
+                self._pending.setdefault(key, value)
+            raise
+        finally:
+            self._flushing = {}
+
+    async def flush(self) -> int:
+        """Сбрасывает накопленные записи одной транзакцией; идущий сброс сначала дожидается."""
+        async with self._flush_lock:
+            previous = self._flush_task
+            if previous is not None and not previous.done():
+                # Вызвавший его flush() был отменён, а запись ещё идёт
+                await asyncio.wait([previous])
+            if previous is not None and not previous.cancelled() and previous.exception() is not None:
+                _LOG.error("Ошибка прерванного сброса: %r", previous.exception())
+            self._flush_task = None
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._flush_task = asyncio.ensure_future(self._write_batch(batch))
+            try:
+                result = await asyncio.shield(self._flush_task)
+            except Exception:
+                self._flush_task = None
+                raise
+            self._flush_task = None
+            return result
+
+    async def run_flusher(self, interval: float = 2.0) -> None:
+        """Периодический сброс очереди; запускается через asyncio.create_task."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                _LOG.error("Ошибка сброса отложенных записей: %r", e)
+
+    async def close(self) -> None:
+        try:
+            # flush() дожидается уже идущего сброса; повторяем, пока очередь не опустеет
+            while True:
+                await self.flush()
+                if not self._pending:
+                    break
+        finally:
+            await self._run(self._close)
+            self._executor.shutdown(wait=True)
+
+
+_STORES: Dict[str, UserStore] = {}
+
+
+def open_store(path: str) -> UserStore:
+    """Один экземпляр UserStore на файл базы в пределах процесса."""
+    path = os.path.abspath(path)
+    store = _STORES.get(path)
+    if store is None:
+        store = _STORES[path] = UserStore(path)
+    return store
+
+
+__all__ = [
+    "UserStore",
+    "open_store",
+    "content_sha256",
+]
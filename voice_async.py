@@ -10,6 +10,8 @@ from elevenlabs.client import AsyncElevenLabs
 # --- Fallback движок: OpenAI TTS (по желанию) ---
 from openai import AsyncOpenAI
 
+from metrics import upstream
+
 _LOG = logging.getLogger("voice_async")
 
 # Предустановленные голоса (без обращения к API списков)
@@ -24,6 +26,10 @@ FALLBACK_VOICES: List[Dict[str, str]] = [
     {"name": "Arnold",    "id": "VR6AewLTigWG4xSOukaG"},
 ]
 
+# Индекс голоса по имени: в FSM пользователя храним только номер голоса,
+# а не копию всего списка
+_VOICE_INDEX: Dict[str, int] = {v["name"]: i for i, v in enumerate(FALLBACK_VOICES)}
+
 # Настройки ElevenLabs по умолчанию
 DEFAULT_MODEL_ID = "eleven_multilingual_v2"
 DEFAULT_OUTPUT_FORMAT = "mp3_44100_128"
@@ -71,6 +77,16 @@ async def find_voice_id_by_name(name: str) -> Optional[str]:
     return None
 
 
+def voice_index(name: str) -> Optional[int]:
+    """Номер голоса в FALLBACK_VOICES по точному имени кнопки."""
+    return _VOICE_INDEX.get(name)
+
+def voice_by_index(index: Optional[int]) -> Optional[Dict[str, str]]:
+    if index is None or not 0 <= index < len(FALLBACK_VOICES):
+        return None
+    return FALLBACK_VOICES[index]
+
+
 # ---------- Вспомогательные ----------
 async def _write_stream_to_file(stream, out_name: str) -> None:
     """
@@ -105,14 +121,15 @@ async def _generate_with_elevenlabs(*, text: str, voice_id: str, out_name: str,
                                     model_id: str = DEFAULT_MODEL_ID,
                                     output_format: str = DEFAULT_OUTPUT_FORMAT) -> str:
     client = _get_el_client()
-    # convert() возвращает async-генератор
-    stream = client.text_to_speech.convert(
-        voice_id=voice_id,
-        text=text,
-        model_id=model_id,
-        output_format=output_format,
-    )
-    await _write_stream_to_file(stream, out_name)
+    # convert() возвращает async-генератор; запрос идёт по мере чтения потока
+    async with upstream("elevenlabs"):
+        stream = client.text_to_speech.convert(
+            voice_id=voice_id,
+            text=text,
+            model_id=model_id,
+            output_format=output_format,
+        )
+        await _write_stream_to_file(stream, out_name)
     return out_name
 
 async def _generate_with_openai(*, text: str, out_name: str, voice: str = "alloy") -> str:
@@ -124,17 +141,18 @@ async def _generate_with_openai(*, text: str, out_name: str, voice: str = "alloy
     if not oai:
         raise RuntimeError("Нет ключа OpenAI для fallback (OPENAI_API_KEY/API_KEY)")
 
-    resp = await oai.audio.speech.with_streaming_response.create(
-        model="gpt-4o-mini-tts",
-        voice=voice,   # alloy/verse/coral/… — выберите любой
-        input=text,
-        format="mp3",
-    )
-    # Убедимся, что каталог существует
-    out_dir = os.path.dirname(out_name)
-    if out_dir:
-        os.makedirs(out_dir, exist_ok=True)
-    await resp.stream_to_file(out_name)
+    async with upstream("openai_tts"):
+        resp = await oai.audio.speech.with_streaming_response.create(
+            model="gpt-4o-mini-tts",
+            voice=voice,   # alloy/verse/coral/… — выберите любой
+            input=text,
+            format="mp3",
+        )
+        # Убедимся, что каталог существует
+        out_dir = os.path.dirname(out_name)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        await resp.stream_to_file(out_name)
     return out_name
 
 
@@ -189,6 +207,8 @@ __all__ = [
     "get_all_voices",
     "generate_audio",
     "find_voice_id_by_name",
+    "voice_index",
+    "voice_by_index",
     "FALLBACK_VOICES",
 ]
 
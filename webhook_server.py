@@ -0,0 +1,143 @@
+# webhook_server.py
+import os
+import asyncio
+import logging
+import secrets
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from metrics import add_metrics_route, start_metrics_server
+
+_LOG = logging.getLogger("webhook_server")
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Принимает обновление, сразу отвечает Telegram 200 OK и обрабатывает его в фоне,
+    но не более max_concurrency обработчиков одновременно.
+    Слот занимается до создания фоновой задачи: пока все заняты, запрос Telegram
+    ждёт (до queue_timeout секунд), затем получает 503 и будет доставлен повторно.
+    Запросы без правильного X-Telegram-Bot-Api-Secret-Token отклоняются (401).
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, *, max_concurrency: int,
+                 queue_timeout: float = 10.0, secret_token: Optional[str] = None, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True,
+                         secret_token=secret_token, **data)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.queue_timeout = queue_timeout
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            _LOG.warning("Все обработчики заняты дольше %s с — обновление отклонено (503)", self.queue_timeout)
+            return web.Response(status=503, text="Busy")
+        try:
+            update: Dict[str, Any] = await request.json(loads=bot.session.json_loads)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        task = asyncio.create_task(self._background_feed_update(bot=bot, update=update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        task.add_done_callback(lambda _: self._semaphore.release())
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+
+def webhook_enabled() -> bool:
+    return bool(os.getenv("WEBHOOK_BASE_URL"))
+
+
+def build_app(dp: Dispatcher, bot: Bot, *, path: str, secret: str,
+              max_concurrency: int, queue_timeout: float = 10.0, **data: Any) -> web.Application:
+    app = web.Application()
+    BoundedRequestHandler(
+        dp, bot, max_concurrency=max_concurrency, queue_timeout=queue_timeout,
+        secret_token=secret, **data
+    ).register(app, path=path)
+    # GET /metrics на том же порту
+    add_metrics_route(app)
+    # startup/shutdown диспетчера вызываются вместе с приложением
+    setup_application(app, dp, bot=bot, **data)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, **data: Any) -> None:
+    """
+    Режим webhook на aiohttp. Настройки из окружения:
+      WEBHOOK_BASE_URL — внешний https-адрес бота (обязателен);
+      WEBHOOK_PATH — путь (по умолчанию /webhook);
+      WEBHOOK_SECRET — секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+        (если не задан — генерируется при каждом старте);
+      WEBHOOK_HOST / PORT — где слушать (по умолчанию 0.0.0.0:80, см. amvera.yml);
+      WEBHOOK_CONCURRENCY — сколько обновлений обрабатывается одновременно;
+      WEBHOOK_QUEUE_TIMEOUT — сколько секунд запрос ждёт свободный обработчик
+        перед ответом 503 (Telegram доставит обновление повторно).
+    """
+    base_url = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+    path = os.getenv("WEBHOOK_PATH", "/webhook")
+    secret = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+    host = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", "80"))
+    concurrency = int(os.getenv("WEBHOOK_CONCURRENCY", "32"))
+    queue_timeout = float(os.getenv("WEBHOOK_QUEUE_TIMEOUT", "10"))
+
+    app = build_app(dp, bot, path=path, secret=secret, max_concurrency=concurrency,
+                    queue_timeout=queue_timeout, **data)
+
+    async def on_startup(bot: Bot) -> None:
+        await bot.set_webhook(
+            url=f"{base_url}{path}",
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=max(1, min(concurrency, 100)),
+        )
+        _LOG.info("Webhook установлен: %s%s", base_url, path)
+
+    dp.startup.register(on_startup)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    _LOG.info("Webhook-сервер слушает %s:%s", host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def serve(dp: Dispatcher, bot: Bot, **data: Any) -> None:
+    """
+    Webhook, если задан WEBHOOK_BASE_URL, иначе long polling.
+    /metrics в режиме webhook — на том же порту, в режиме polling —
+    на METRICS_PORT (если не задан, сервер метрик не поднимается).
+    """
+    if webhook_enabled():
+        await run_webhook(dp, bot, **data)
+    else:
+        # Если раньше работали через webhook, getUpdates без этого не заработает
+        await bot.delete_webhook(drop_pending_updates=False)
+        # В режиме polling /metrics отдаётся, только если задан METRICS_PORT
+        metrics_port = os.getenv("METRICS_PORT")
+        metrics = None
+        if metrics_port:
+            metrics = await start_metrics_server(os.getenv("WEBHOOK_HOST", "0.0.0.0"), int(metrics_port))
+        try:
+            await dp.start_polling(bot, **data)
+        finally:
+            if metrics is not None:
+                await metrics.cleanup()
+
+
+__all__ = [
+    "BoundedRequestHandler",
+    "build_app",
+    "run_webhook",
+    "serve",
+    "webhook_enabled",
+]
@@ -0,0 +1,381 @@
+# workers.py
+"""
+Многопроцессный режим: супервизор получает обновления Telegram (webhook или
+long polling) и раздаёт их N рабочим процессам по user_id, так что FSM
+и кеши каждого пользователя живут в одном процессе.
+
+Запуск:  python workers.py [модуль] --workers 4   (по умолчанию модуль main)
+Модуль должен объявлять async def main(run=serve): воркер передаёт в run
+свою функцию чтения очереди вместо webhook/polling.
+SIGHUP — поочерёдный перезапуск воркеров без потери обновлений.
+"""
+import os
+import sys
+import time
+import queue
+import signal
+import asyncio
+import logging
+import argparse
+import importlib
+import multiprocessing as mp
+from typing import Any, Dict, List, Optional
+
+_LOG = logging.getLogger("workers")
+
+HEARTBEAT_SEC = 5.0
+STOP = None  # сигнал воркеру: дообработать очередь и выйти
+
+# Поля обновления, в которых лежит автор (from)
+_USER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query",
+    "chosen_inline_result", "shipping_query", "pre_checkout_query",
+    "my_chat_member", "chat_member", "chat_join_request",
+    "business_message", "edited_business_message", "message_reaction",
+)
+
+
+def shard_for(update: Dict[str, Any], shards: int) -> int:
+    """Номер воркера для обновления: по id пользователя, иначе по id чата."""
+    for field in _USER_FIELDS:
+        event = update.get(field)
+        if not event:
+            continue
+        user = event.get("from") or event.get("user")
+        if user and "id" in user:
+            return user["id"] % shards
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"] % shards
+    return update.get("update_id", 0) % shards
+
+
+# ---------- Рабочий процесс ----------
+def _worker_process(module_name: str, shard: int, shards: int, inbox: "mp.Queue",
+                    health: "mp.Queue", start: "mp.synchronize.Event") -> None:
+    os.environ["SHARD_INDEX"] = str(shard)
+    os.environ["SHARD_COUNT"] = str(shards)
+    # Своё FSM-хранилище на шард: меньше конкуренции за блокировки SQLite
+    if not os.getenv("FSM_DB_PATH"):
+        os.environ["FSM_DB_PATH"] = os.path.join(os.getcwd(), "data", f"fsm.shard{shard}.db")
+    # И своя очередь фоновых задач: после перезапуска шард доделывает только свои
+    if not os.getenv("JOBS_DB_PATH"):
+        os.environ["JOBS_DB_PATH"] = os.path.join(os.getcwd(), "data", f"jobs.shard{shard}.db")
+    # В воркере HTTP-сервер не нужен — обновления приходят от супервизора
+    os.environ.pop("WEBHOOK_BASE_URL", None)
+
+    module = importlib.import_module(module_name)
+    stats = {"processed": 0, "failed": 0, "inflight": 0}
+    concurrency = int(os.getenv("WORKER_CONCURRENCY", "32"))
+
+    async def consume(dp, bot, **data) -> None:
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = set()
+
+        async def handle(update: Dict[str, Any]) -> None:
+            stats["inflight"] += 1
+            try:
+                await dp.feed_raw_update(bot, update, **data)
+                stats["processed"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                _LOG.error("Шард %s: ошибка обработки обновления: %r", shard, e)
+            finally:
+                stats["inflight"] -= 1
+                semaphore.release()
+
+        async def heartbeat() -> None:
+            from metrics import get_registry, metrics_enabled
+
+            while True:
+                report = dict(stats)
+                if metrics_enabled():
+                    # Метрики шарда отдаёт супервизор на своём /metrics
+                    report["metrics"] = await get_registry().collect({"shard": str(shard)})
+                health.put((shard, os.getpid(), "ok", report, time.time()))
+                await asyncio.sleep(HEARTBEAT_SEC)
+
+        await dp.emit_startup(bot=bot, **data)
+        hb = asyncio.create_task(heartbeat())
+        health.put((shard, os.getpid(), "ready", dict(stats), time.time()))
+        await loop.run_in_executor(None, start.wait)
+        try:
+            while True:
+                update = await loop.run_in_executor(None, inbox.get)
+                if update is STOP:
+                    break
+                await semaphore.acquire()
+                task = asyncio.create_task(handle(update))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            hb.cancel()
+            await dp.emit_shutdown(bot=bot, **data)
+            await bot.session.close()
+            health.put((shard, os.getpid(), "stopped", dict(stats), time.time()))
+
+    asyncio.run(module.main(run=consume))
+
+
+class _Worker:
+    def __init__(self, ctx, module_name: str, shard: int, shards: int, health: "mp.Queue"):
+        self.shard = shard
+        self.inbox = ctx.Queue()
+        self.start_event = ctx.Event()
+        self.process = ctx.Process(
+            target=_worker_process,
+            args=(module_name, shard, shards, self.inbox, health, self.start_event),
+            name=f"bot-worker-{shard}",
+            daemon=False,
+        )
+        self.process.start()
+
+
+# ---------- Супервизор ----------
+class Supervisor:
+    def __init__(self, module_name: str, shards: int):
+        self.module_name = module_name
+        self.shards = shards
+        self._ctx = mp.get_context("spawn")
+        self.health_queue = self._ctx.Queue()
+        self.workers: List[Optional[_Worker]] = [None] * shards
+        # shard -> {"pid", "status", "stats", "seen"}
+        self.health: Dict[int, Dict[str, Any]] = {}
+        # shard -> последние метрики из heartbeat (metrics.Family)
+        self.metrics: Dict[int, List[Any]] = {}
+        self._restart_lock = asyncio.Lock()
+
+    def _spawn(self, shard: int) -> _Worker:
+        return _Worker(self._ctx, self.module_name, shard, self.shards, self.health_queue)
+
+    async def _wait_ready(self, worker: _Worker, timeout: float = 60.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            info = self.health.get(worker.shard)
+            if info and info["pid"] == worker.process.pid and info["status"] in ("ready", "ok"):
+                return True
+            if not worker.process.is_alive():
+                return False
+            await asyncio.sleep(0.2)
+        return False
+
+    async def start(self) -> None:
+        for shard in range(self.shards):
+            worker = self._spawn(shard)
+            self.workers[shard] = worker
+            worker.start_event.set()
+
+    def dispatch(self, update: Dict[str, Any]) -> None:
+        self.workers[shard_for(update, self.shards)].inbox.put(update)
+
+    async def _replace(self, shard: int) -> None:
+        """Новый воркер поднимается заранее; старый дообрабатывает очередь и выходит."""
+        old = self.workers[shard]
+        new = self._spawn(shard)
+        if not await self._wait_ready(new):
+            _LOG.error("Шард %s: новый воркер не стартовал, оставляю старый", shard)
+            new.process.terminate()
+            return
+        # С этого момента новые обновления копятся в очереди нового воркера,
+        # но он начнёт их обрабатывать только после выхода старого — порядок сохраняется
+        self.workers[shard] = new
+        if old is not None and old.process.is_alive():
+            old.inbox.put(STOP)
+            await asyncio.get_running_loop().run_in_executor(None, old.process.join, 60)
+            if old.process.is_alive():
+                old.process.terminate()
+        new.start_event.set()
+        _LOG.info("Шард %s перезапущен (pid %s)", shard, new.process.pid)
+
+    async def rolling_restart(self) -> None:
+        async with self._restart_lock:
+            for shard in range(self.shards):
+                await self._replace(shard)
+
+    async def monitor(self) -> None:
+        """Собирает heartbeat'ы и поднимает упавшие воркеры."""
+        while True:
+            try:
+                while True:
+                    shard, pid, status, stats, ts = self.health_queue.get_nowait()
+                    if "metrics" in stats:
+                        self.metrics[shard] = stats.pop("metrics")
+                    self.health[shard] = {"pid": pid, "status": status, "stats": stats, "seen": ts}
+            except queue.Empty:
+                pass
+            if not self._restart_lock.locked():
+                for shard, worker in enumerate(self.workers):
+                    if worker is not None and not worker.process.is_alive():
+                        _LOG.error("Шард %s: воркер pid %s упал (код %s), перезапуск",
+                                   shard, worker.process.pid, worker.process.exitcode)
+                        self._respawn(shard, worker)
+            await asyncio.sleep(1.0)
+
+    def _respawn(self, shard: int, dead: _Worker) -> None:
+        """
+        Новый процесс получает новую очередь: блокировку чтения старой мог
+        держать упавший процесс. Необработанные обновления перекладываются
+        в новую очередь до того, как в неё пойдут новые — порядок сохраняется.
+        """
+        fresh = self._spawn(shard)
+        moved = 0
+        try:
+            while True:
+                update = dead.inbox.get(timeout=0.05)
+                if update is not STOP:
+                    fresh.inbox.put(update)
+                    moved += 1
+        except queue.Empty:
+            pass
+        except Exception as e:
+            # Процесс мог упасть посреди чтения сообщения — остаток очереди не разобрать
+            _LOG.error("Шард %s: очередь упавшего воркера повреждена: %r", shard, e)
+        dead.inbox.close()
+        dead.inbox.cancel_join_thread()
+        self.workers[shard] = fresh
+        fresh.start_event.set()
+        if moved:
+            _LOG.info("Шард %s: передано необработанных обновлений %s", shard, moved)
+
+    def health_report(self) -> Dict[str, Any]:
+        now = time.time()
+        report = {}
+        for shard, worker in enumerate(self.workers):
+            info = self.health.get(shard, {})
+            alive = worker is not None and worker.process.is_alive()
+            fresh = bool(info) and now - info["seen"] < HEARTBEAT_SEC * 3
+            report[str(shard)] = {
+                "pid": worker.process.pid if worker else None,
+                "alive": alive,
+                "healthy": alive and fresh,
+                "status": info.get("status"),
+                "stats": info.get("stats", {}),
+            }
+        return report
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            if worker is not None and worker.process.is_alive():
+                worker.inbox.put(STOP)
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            if worker is not None:
+                await loop.run_in_executor(None, worker.process.join, 60)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+
+
+# ---------- Источники обновлений ----------
+async def _poll(supervisor: Supervisor, token: str) -> None:
+    from aiogram import Bot
+
+    bot = Bot(token=token)
+    await bot.delete_webhook(drop_pending_updates=False)
+    offset = None
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30)
+            except Exception as e:
+                _LOG.error("getUpdates: %r", e)
+                await asyncio.sleep(1.0)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                supervisor.dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+    finally:
+        await bot.session.close()
+
+
+async def _serve_http(supervisor: Supervisor, token: str) -> None:
+    """
+    HTTP супервизора на PORT: GET /health — состояние воркеров, GET /metrics —
+    метрики всех шардов (метка shard); в режиме webhook (WEBHOOK_BASE_URL)
+    ещё и приём обновлений.
+    """
+    import secrets
+    from aiohttp import web
+    from aiogram import Bot
+    from metrics import METRICS_PATH, metrics_enabled, metrics_view
+
+    async def health(request: web.Request) -> web.Response:
+        report = supervisor.health_report()
+        ok = all(w["healthy"] for w in report.values())
+        return web.json_response(report, status=200 if ok else 503)
+
+    async def collect() -> List[Any]:
+        return [family for families in supervisor.metrics.values() for family in families]
+
+    app = web.Application()
+    app.router.add_get("/health", health)
+    if metrics_enabled():
+        app.router.add_get(METRICS_PATH, metrics_view(collect))
+
+    base_url = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+    bot = None
+    if base_url:
+        path = os.getenv("WEBHOOK_PATH", "/webhook")
+        secret = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+
+        async def webhook(request: web.Request) -> web.Response:
+            if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+                return web.Response(status=401)
+            supervisor.dispatch(await request.json())
+            return web.Response()
+
+        app.router.add_post(path, webhook)
+        bot = Bot(token=token)
+        await bot.set_webhook(url=f"{base_url}{path}", secret_token=secret)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+                      port=int(os.getenv("PORT", "80"))).start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        if bot is not None:
+            await bot.session.close()
+
+
+async def run_supervisor(module_name: str, shards: int) -> None:
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        raise RuntimeError("TELEGRAM_BOT_TOKEN не найден")
+
+    supervisor = Supervisor(module_name, shards)
+    await supervisor.start()
+    loop = asyncio.get_running_loop()
+    if hasattr(signal, "SIGHUP"):
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(supervisor.rolling_restart()))
+
+    tasks = [asyncio.create_task(supervisor.monitor()), asyncio.create_task(_serve_http(supervisor, token))]
+    if not os.getenv("WEBHOOK_BASE_URL"):
+        tasks.append(asyncio.create_task(_poll(supervisor, token)))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await supervisor.stop()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler()]
+    )
+    parser = argparse.ArgumentParser(description="Бот в нескольких процессах, шардирование по user_id")
+    parser.add_argument("module", nargs="?", default="main", help="модуль с ботом (по умолчанию main)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", os.cpu_count() or 1)))
+    args = parser.parse_args()
+    sys.path.insert(0, os.getcwd())
+    asyncio.run(run_supervisor(args.module, max(1, args.workers)))